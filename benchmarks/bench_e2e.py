@@ -0,0 +1,170 @@
+"""
+End-to-end throughput of the CLI against the local mock bookmall server.
+
+Starts benchmarks/mock_server.py in a subprocess, runs the CLI's main() in this
+process against it (resolving every code and downloading every file into a
+temporary directory) and reports:
+
+* codes/s and MiB/s over the whole run,
+* p50/p99 latency per downloaded file,
+* peak RSS of the client process.
+
+    python benchmarks/bench_e2e.py --codes 50 --links 10 --size 1M --latency 0.02 -j 8
+    python benchmarks/bench_e2e.py --engine async -j 200 --codes 2000 --links 2 --size 16K
+
+Options not listed by --help are passed through to the CLI, e.g. --per-host 2.
+"""
+import argparse
+import functools
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+CLI_PATH = os.path.join(ROOT, "上海中小学教材配套音频下载工具.py")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+from mock_server import parse_size  # noqa: E402
+
+
+def start_mock_server(args):
+    command = [
+        sys.executable, os.path.join(HERE, "mock_server.py"), "--port", "0",
+        "--links", str(args.links), "--size", str(args.size), "--latency", str(args.latency),
+        "--bandwidth", str(args.bandwidth), "--error-rate", str(args.error_rate), "--seed", "1",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise SystemExit(f"mock server did not start: {line!r}")
+    return process, line.split()[-1]
+
+
+def load_cli():
+    spec = importlib.util.spec_from_file_location("shedu_cli", CLI_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn, latencies, lock, is_async=False):
+    """Wraps a download function so every call's wall time is recorded."""
+    if is_async:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            began = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - began)
+        return wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        began = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - began)
+    return wrapper
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 ** 2
+        except (ImportError, AttributeError):
+            return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux but in bytes on macOS.
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def tree_bytes(path):
+    total = files = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            if not name.startswith("."):
+                total += os.path.getsize(os.path.join(folder, name))
+                files += 1
+    return total, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end CLI throughput against a local mock server.")
+    parser.add_argument("--codes", type=int, default=20, help="Number of codes to resolve (default: 20).")
+    parser.add_argument("--links", type=int, default=10, help="Files per code (default: 10).")
+    parser.add_argument("--size", type=parse_size, default="256K", help="Size of every file (default: 256K).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server latency per response in seconds (default: 0.02).")
+    parser.add_argument("--bandwidth", type=parse_size, default="0", help="Server per-connection cap in bytes/s (default: unlimited).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503 (default: 0).")
+    parser.add_argument("--list-only", action="store_true", help="Only resolve codes, don't download.")
+    parser.add_argument("--keep", action="store_true", help="Keep the download directory.")
+    args, cli_args = parser.parse_known_args()
+
+    server, base_url = start_mock_server(args)
+    target = tempfile.mkdtemp(prefix="shedu-bench-")
+    os.environ["SHEDU_BASE_URL"] = base_url
+    os.environ["SHEDU_CACHE_DIR"] = os.path.join(target, ".cache")
+    try:
+        cli = load_cli()
+        latencies, lock = [], threading.Lock()
+        from shedu.engine import Engine
+        Engine.download = timed(Engine.download, latencies, lock)
+        from shedu import aio
+        aio.download = timed(aio.download, latencies, lock, is_async=True)
+
+        codes = ",".join(str(10000000 + i) for i in range(args.codes))
+        # One folder per code, as the mock's file names repeat across codes.
+        argv = ["bench", "-c", codes, "-t", os.path.join(target, "out"), "-f", "c", "-s", "--no-cache"] + cli_args
+        if not args.list_only:
+            argv.append("-d")
+        sys.argv = argv
+
+        began = time.perf_counter()
+        with redirect_stdout(io.StringIO()) as output:
+            cli.main()
+        elapsed = time.perf_counter() - began
+
+        total_bytes, files = tree_bytes(os.path.join(target, "out"))
+        failed_codes = output.getvalue().count("An error occurred for code")
+        print(f"server:   {args.links} links/code, {args.size / 1024:.0f} KiB/file, "
+              f"{args.latency * 1000:.0f} ms latency, error rate {args.error_rate:g}")
+        print(f"client:   {' '.join(cli_args) or '(defaults)'}")
+        print(f"wall:     {elapsed:.2f} s")
+        print(f"codes:    {args.codes - failed_codes}/{args.codes} resolved, {(args.codes - failed_codes) / elapsed:.1f} codes/s")
+        if not args.list_only:
+            print(f"files:    {files}/{args.codes * args.links} downloaded, {total_bytes / 1024 ** 2 / elapsed:.1f} MiB/s")
+            print(f"per file: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+        print(f"peak RSS: {peak_rss_mb():.1f} MiB")
+    finally:
+        server.terminate()
+        server.wait()
+        if args.keep:
+            print(f"downloads kept in {target}")
+        else:
+            shutil.rmtree(target, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
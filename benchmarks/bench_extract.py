@@ -0,0 +1,85 @@
+"""
+Parse cost per access.action page: BeautifulSoup vs shedu.extract.
+
+Runs every extraction strategy over the saved pages in benchmarks/fixtures and
+prints the mean time per page. "bs4" is the full-tree approach the front ends
+used before shedu.extract (the GUI ran its title selector twice, shown as
+"bs4 (GUI)"); it needs beautifulsoup4, and the lxml row needs lxml.
+
+    python benchmarks/bench_extract.py [-n ROUNDS]
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shedu import extract
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def soup_cli(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    title_element = soup.select_one('dl.EnglishBox dd h5')
+    title = title_element.get_text(strip=True) if title_element else None
+    return title, [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.shtml')]
+
+
+def soup_gui(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    title = soup.select_one('dl.EnglishBox dd h5').get_text(strip=True) if soup.select_one('dl.EnglishBox dd h5') else None
+    return title, [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.shtml')]
+
+
+def stream(content):
+    return extract._extract_stream(extract.decode_page(content))
+
+
+def lxml_backend(content):
+    return extract._extract_lxml(extract.decode_page(content))
+
+
+def strategies():
+    found = []
+    if importlib.util.find_spec("bs4"):
+        found += [("bs4", soup_cli), ("bs4 (GUI)", soup_gui)]
+    else:
+        print("beautifulsoup4 is not installed; skipping the baseline rows.")
+    found.append(("stream", stream))
+    if extract.BACKEND == "lxml":
+        found.append(("lxml", lxml_backend))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark access.action page extraction.")
+    parser.add_argument("-n", "--rounds", type=int, default=50, help="Parses per page and strategy (default: 50).")
+    args = parser.parse_args()
+
+    pages = sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+    runs = strategies()
+    baseline = {}
+    print(f"extract_page backend: {extract.BACKEND}")
+    print(f"{'page':<22}{'size':>9}  {'strategy':<11}{'ms/page':>9}{'speedup':>9}")
+    for path in pages:
+        with open(path, 'rb') as f:
+            content = f.read()
+        expected = None
+        for name, fn in runs:
+            result = fn(content)
+            if expected is None:
+                expected = result
+            elif result != expected:
+                print(f"  !! {name} disagrees on {os.path.basename(path)}: {result[0]!r}, {len(result[1])} links")
+            seconds = min(timeit.repeat(lambda: fn(content), number=args.rounds, repeat=3)) / args.rounds
+            baseline.setdefault(path, seconds)
+            print(f"{os.path.basename(path):<22}{len(content):>9}  {name:<11}{seconds * 1000:>9.3f}{baseline[path] / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Startup time of the tools: how long a fresh process takes to be useful.
+
+Every case is run `--runs` times, each in a new interpreter (or a new frozen
+executable), and the minimum and median wall times are reported:
+
+* `cli --help`: argument parsing only, nothing from the network stack;
+* `cli list`: one code resolved against the local mock server (started here);
+* `gui import`: the graphical version's module executed up to, not including,
+  creating its window, so no display is needed;
+* `link tool`: the link tool resolving one code against the mock server.
+
+With --imports each source case is also run once under `python -X importtime`
+and the modules with the largest cumulative import time are listed.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --imports --top 15
+    python benchmarks/bench_startup.py --exe dist/onefile/gui.exe --exe dist/onedir/gui/gui.exe
+
+A frozen GUI started by --exe gets SHEDU_STARTUP_PROBE=1 in its environment,
+which makes it close as soon as its window is up; the time is then launch to
+first window (unpacking included for onefile builds). Builds made with
+SHEDU_PROFILE_IMPORTS=1 (see the onedir .spec file) print -X importtime
+output, which --imports summarises the same way.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+CLI_PATH = os.path.join(ROOT, "上海中小学教材配套音频下载工具.py")
+GUI_PATH = os.path.join(ROOT, "上海中小学教材配套音频下载工具-图形界面版.py")
+LINK_PATH = os.path.join(ROOT, "other", "上海中小学教材配套音频链接获取工具.py")
+CODE = "12345678"
+
+
+def start_mock_server():
+    command = [sys.executable, os.path.join(HERE, "mock_server.py"), "--port", "0", "--links", "5", "--latency", "0"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise SystemExit(f"mock server did not start: {line!r}")
+    return process, line.split()[-1]
+
+
+def source_cases():
+    """Returns `(name, argv)` for every case that runs from source."""
+    python = sys.executable
+    return [
+        ("cli --help", [python, CLI_PATH, "--help"]),
+        ("cli list", [python, CLI_PATH, "-c", CODE, "--no-cache"]),
+        ("gui import", [python, "-c", "import runpy, sys; runpy.run_path(sys.argv[1], run_name='gui')", GUI_PATH]),
+        ("link tool", [python, LINK_PATH, "-c", CODE, "--no-cache"]),
+    ]
+
+
+def run_once(argv, env):
+    """Runs `argv` to completion; returns `(seconds, returncode, stderr)`."""
+    began = time.perf_counter()
+    # From ROOT, so `python -c` cases import the shedu package next to the tools.
+    result = subprocess.run(argv, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+    return time.perf_counter() - began, result.returncode, result.stderr
+
+
+def import_times(stderr):
+    """Parses -X importtime output into `{module: cumulative microseconds}`."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            # Nested imports keep their indentation.
+            times[fields[2][1:].rstrip()] = int(fields[1])
+    return times
+
+
+def print_imports(name, stderr, top):
+    times = import_times(stderr)
+    if not times:
+        print(f"  {name}: no -X importtime output")
+        return
+    # Top-level imports (no indentation) add up to the whole import phase.
+    total = sum(us for module, us in times.items() if not module.startswith(" "))
+    print(f"  {name}: {len(times)} modules, {total / 1000:.1f} ms importing")
+    for module, us in sorted(times.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"    {us / 1000:8.1f} ms  {module.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the CLI, GUI and link tool, and of frozen builds.")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per case (default: 10).")
+    parser.add_argument("--imports", action="store_true", help="Also list the slowest imports of every case.")
+    parser.add_argument("--top", type=int, default=10, help="Imports listed per case with --imports (default: 10).")
+    parser.add_argument("--exe", action="append", default=[], metavar="PATH",
+                        help="Also time a frozen executable (repeatable).")
+    parser.add_argument("--no-source", action="store_true", help="Only time the --exe executables.")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server()
+    cache_dir = tempfile.TemporaryDirectory()
+    env = dict(os.environ, SHEDU_BASE_URL=base_url, SHEDU_CACHE_DIR=cache_dir.name, SHEDU_STARTUP_PROBE="1")
+    try:
+        cases = [] if args.no_source else source_cases()
+        cases += [(path, [os.path.abspath(path)]) for path in args.exe]
+        width = max(len(name) for name, _ in cases)
+        profiles = []
+        print(f"{'case':<{width}} {'min':>9} {'median':>9}  exit")
+        for name, argv in cases:
+            samples, returncode, stderr = [], None, ""
+            for _ in range(args.runs):
+                seconds, returncode, stderr = run_once(argv, env)
+                samples.append(seconds)
+            print(f"{name:<{width}} {min(samples) * 1000:7.1f}ms {statistics.median(samples) * 1000:7.1f}ms  {returncode}")
+            if args.imports:
+                if argv[0] == sys.executable:
+                    stderr = run_once([argv[0], "-X", "importtime"] + argv[1:], env)[2]
+                profiles.append((name, stderr))
+        if profiles:
+            print("\nslowest imports (cumulative):")
+            for name, stderr in profiles:
+                print_imports(name, stderr, args.top)
+    finally:
+        server.terminate()
+        server.wait()
+        cache_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Client CPU per MiB of the download write loop: iter_content(8192) vs shedu.stream.
+
+Downloads one large file from benchmarks/mock_server.py (run as a subprocess,
+so its CPU isn't counted) several times with each strategy, writing to a
+temporary file with a tqdm bar attached as the CLI does, and prints the CPU
+and wall time per MiB and how many progress updates were made.
+
+    python benchmarks/bench_write.py [--size 64M] [--rounds 5] [--hash] [--bandwidth 20M]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_e2e import start_mock_server  # noqa: E402
+from mock_server import parse_size  # noqa: E402
+from shedu.session import get_session  # noqa: E402
+from shedu.stream import copy_response  # noqa: E402
+from tqdm import tqdm  # noqa: E402
+
+
+def iter_content_loop(r, f, bar, digest):
+    """The loop download_file used before shedu.stream."""
+    for chunk in r.iter_content(chunk_size=8192):
+        size = f.write(chunk)
+        bar.update(size)
+        if digest:
+            digest.update(chunk)
+
+
+def copy_response_loop(r, f, bar, digest):
+    copy_response(r, f, progress=bar.update, digest=digest)
+
+
+STRATEGIES = [("iter_content(8192)", iter_content_loop), ("copy_response", copy_response_loop)]
+
+
+def run(strategy, url, path, size, use_hash):
+    with open(os.devnull, 'w') as devnull:
+        began_cpu, began = time.process_time(), time.perf_counter()
+        with get_session().get(url, stream=True, timeout=20) as r, open(path, 'wb') as f, tqdm(
+            total=size, unit='iB', unit_scale=True, file=devnull, mininterval=0.1
+        ) as bar:
+            r.raise_for_status()
+            updates = 0
+            update = bar.update
+
+            def counted(n):
+                nonlocal updates
+                updates += 1
+                return update(n)
+
+            bar.update = counted
+            strategy(r, f, bar, hashlib.sha256() if use_hash else None)
+        cpu, wall = time.process_time() - began_cpu, time.perf_counter() - began
+    if os.path.getsize(path) != size:
+        raise SystemExit(f"short download: {os.path.getsize(path)} of {size} bytes")
+    return cpu, wall, updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the download write loop.")
+    parser.add_argument("--size", type=parse_size, default="64M", help="Size of the downloaded file (default: 64M).")
+    parser.add_argument("--rounds", type=int, default=5, help="Downloads per strategy; the best is reported (default: 5).")
+    parser.add_argument("--bandwidth", type=parse_size, default="0", help="Server cap in bytes/s (default: unlimited).")
+    parser.add_argument("--hash", action="store_true", help="Also hash the body with SHA-256, as --sync does.")
+    args = parser.parse_args()
+    args.links, args.latency, args.error_rate = 1, 0.0, 0.0
+
+    server, base_url = start_mock_server(args)
+    url = f"{base_url}/resource/bench/001.shtml"
+    mib = args.size / 1024 ** 2
+    try:
+        with tempfile.TemporaryDirectory(prefix="shedu-bench-") as target:
+            path = os.path.join(target, "001.mp3")
+            print(f"{args.size / 1024 ** 2:.0f} MiB file, best of {args.rounds}{', SHA-256' if args.hash else ''}")
+            print(f"{'strategy':<20}{'CPU ms/MiB':>12}{'wall ms/MiB':>13}{'updates':>9}")
+            baseline = None
+            for name, strategy in STRATEGIES:
+                results = [run(strategy, url, path, args.size, args.hash) for _ in range(args.rounds)]
+                cpu, wall, updates = min(results)
+                baseline = baseline or cpu
+                print(f"{name:<20}{cpu * 1000 / mib:>12.3f}{wall * 1000 / mib:>13.3f}{updates:>9}  {baseline / cpu:.1f}x")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Local stand-in for mp3.bookmall.com.cn.
+
+Serves access.action pages and the .shtml files they link to, with knobs for
+the things that matter to throughput: links per code, file size, per-response
+latency, a per-connection bandwidth cap and a random error rate. Files support
+Range requests, ETag/Last-Modified and conditional GETs like a real static file
+server, so resuming and --sync runs can be exercised too. The first --shared
+tracks of every code are the same file, as for --dedup.
+
+Run it on its own and point the tools at it:
+
+    python benchmarks/mock_server.py --port 8765 --links 20 --size 2M
+    SHEDU_BASE_URL=http://127.0.0.1:8765 python 上海中小学教材配套音频下载工具.py -c 12345678 -d
+
+or start it in-process with make_server().
+"""
+import argparse
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote
+
+BLOCK_SIZE = 64 * 1024
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """Parses sizes like 512, 256K, 2M or 1.5G into bytes."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', str(text), re.I)
+    if not match:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+class MockConfig:
+    """Behaviour of the stand-in server; attributes may be changed while it runs."""
+
+    def __init__(self, links=10, size=256 * 1024, latency=0.0, bandwidth=0, error_rate=0.0, seed=None, shared=0):
+        self.links = links
+        self.shared = shared
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+def render_page(code, links):
+    """Returns an access.action page for `code` with `links` .shtml links."""
+    rows = "".join(
+        f'<tr><td>{i}</td><td>Track {i}</td><td><a href="/resource/{code}/{i:03d}.shtml">播放</a></td></tr>'
+        for i in range(1, links + 1)
+    )
+    return (
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8" /></head><body>'
+        '<div class="nav"><a href="/">首页</a><a href="/book/list.action">书目</a></div>'
+        f'<dl class="EnglishBox"><dt><img src="/cover/{code}.jpg" /></dt><dd><h5>Mock textbook {code}</h5></dd></dl>'
+        f'<table>{rows}</table></body></html>'
+    ).encode('utf-8')
+
+
+def file_block(path):
+    """Deterministic content for a file: one block repeated to the file size."""
+    seed = hashlib.sha256(path.encode('utf-8')).digest()
+    return (seed * (BLOCK_SIZE // len(seed)))[:BLOCK_SIZE]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockBookmall/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _error(self, status):
+        body = f"{status} mock error".encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8', 'replace'))
+        self._delay()
+        if not self.path.startswith("/book/access.action"):
+            return self._error(404)
+        if self.config.should_fail():
+            return self._error(503)
+        body = render_page(form.get("code", [""])[0], self.config.links)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._serve_file(head=True)
+
+    def do_GET(self):
+        self._serve_file(head=False)
+
+    def _serve_file(self, head):
+        self._delay()
+        if not self.path.endswith(".shtml"):
+            return self._error(404)
+        if self.config.should_fail():
+            return self._error(503)
+
+        size = self.config.size
+        # Shared tracks have the same content (and ETag) under every code's URL.
+        name = self.path.rsplit("/", 1)[-1]
+        track = re.match(r"(\d+)\.shtml$", name)
+        content_path = f"/resource/shared/{name}" if track and int(track.group(1)) <= self.config.shared else self.path
+        etag = '"%s"' % hashlib.md5(f"{content_path}:{size}".encode()).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        start, status = 0, 200
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        filename = unquote(self.path.rsplit("/", 1)[-1]).replace(".shtml", ".mp3")
+        self.send_response(status)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        if not head:
+            self._send_body(file_block(content_path), start, size)
+
+    def _send_body(self, block, start, size):
+        bandwidth = self.config.bandwidth
+        chunk = min(BLOCK_SIZE, bandwidth // 10) if bandwidth else BLOCK_SIZE
+        view = memoryview(block)
+        began = time.monotonic()
+        sent = 0
+        position = start
+        try:
+            while position < size:
+                offset = position % BLOCK_SIZE
+                n = min(chunk, BLOCK_SIZE - offset, size - position)
+                self.wfile.write(view[offset:offset + n])
+                position += n
+                sent += n
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def make_server(config=None, host="127.0.0.1", port=0):
+    """
+    Starts a stand-in server on a background thread and returns it.
+
+    Use `server.base_url` as SHEDU_BASE_URL and `server.shutdown()` to stop it.
+    """
+    server = MockServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, name="mock-bookmall", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for mp3.bookmall.com.cn.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on; 0 picks a free one (default: 8765).")
+    parser.add_argument("--links", type=int, default=10, help=".shtml links per code (default: 10).")
+    parser.add_argument("--size", type=parse_size, default="256K", help="Size of every file, e.g. 300K or 20M (default: 256K).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every response (default: 0).")
+    parser.add_argument("--bandwidth", type=parse_size, default="0", help="Per-connection cap in bytes/s, e.g. 2M; 0 is unlimited.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503 (default: 0).")
+    parser.add_argument("--seed", type=int, help="Seed for the error sequence.")
+    parser.add_argument("--shared", type=int, default=0, help="Tracks 1..N are the same file for every code (default: 0).")
+    args = parser.parse_args()
+
+    config = MockConfig(args.links, args.size, args.latency, args.bandwidth, args.error_rate, args.seed, args.shared)
+    server = MockServer((args.host, args.port), config)
+    # The benchmark reads this line to learn the port when started with --port 0.
+    print(f"Listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,61 @@
 import argparse
-import requests
-from bs4 import BeautifulSoup
+import os
+import sys
 from colorama import init, Fore, Style
-from urllib.parse import urljoin # <-- NEW IMPORT
 
-def fetch_and_parse(code):
+# The shared "shedu" package lives one directory up, next to the main tools.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shedu.events import Events
+from shedu.cache import open_cache
+from shedu.failures import describe_error
+from shedu.records import JsonlWriter, code_record, resolved_record, STATUS_ERROR, STATUS_INVALID
+
+class LinkPrinter(Events):
     """
-    Posts a code to the URL, extracts the title and all .shtml links from the response.
+    Prints the title and all .shtml links of each code the engine resolves.
 
     Args:
-        code (str): The 8-digit code to post.
+        writer (JsonlWriter): Write a JSON record for each code instead of printing it (--format jsonl).
     """
-    base_url = "https://mp3.bookmall.com.cn"
-    target_url = f"{base_url}/book/access.action"
-    
-    # Set the User-Agent header to mimic IE 11 on Windows 8.1
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; rv:11.0) like Gecko"
-    }
-    
-    # The data payload for the POST request
-    payload = {
-        "code": code
-    }
-
-    try:
-        # Make the POST request
-        response = requests.post(target_url, headers=headers, data=payload, timeout=10)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-
-        # Parse the HTML content of the page
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Find the title using the specified CSS selector
-        title_element = soup.select_one('dl.EnglishBox dd h5')
-        title = title_element.get_text(strip=True) if title_element else "No title found."
-        
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.blocks = 0
+
+    def separator(self):
+        # Print the separator between the results of two codes
+        if not self.writer and self.blocks:
+            print(f"{Fore.LIGHTRED_EX}--------{Style.RESET_ALL}")
+        self.blocks += 1
+
+    def code_invalid(self, code):
+        if self.writer:
+            self.writer.write(code_record(code, STATUS_INVALID))
+            return
+        self.separator()
+        print(f"{Fore.YELLOW}Warning: '{code}' is not a valid 8-digit number. Skipping.{Style.RESET_ALL}")
+
+    def code_resolved(self, code, title, links, seconds):
+        if self.writer:
+            self.writer.write(resolved_record(code, title, links, seconds))
+            return
+
         # Print the code and the extracted title
+        self.separator()
         print(f"{Fore.LIGHTGREEN_EX}{code}{Style.RESET_ALL}")
-        print(f"{Fore.LIGHTGREEN_EX}{title}{Style.RESET_ALL}")
+        print(f"{Fore.LIGHTGREEN_EX}{title or 'No title found.'}{Style.RESET_ALL}")
 
-        # Find all anchor (<a>) tags that have an 'href' attribute ending in '.shtml'
-        shtml_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.shtml')]
-
-        if shtml_links:
-            for link in shtml_links:
-                # --- MODIFICATION START ---
-                # Convert the relative link to an absolute URL
-                full_url = urljoin(base_url, link)
+        if links:
+            for full_url in links:
                 print(f"{Fore.CYAN}{full_url}{Style.RESET_ALL}")
-                # --- MODIFICATION END ---
         else:
             print(f"{Fore.YELLOW}No .shtml links found for this code.{Style.RESET_ALL}")
 
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}An error occurred for code {code}: {e}{Style.RESET_ALL}")
+    def code_failed(self, code, error, seconds):
+        if self.writer:
+            self.writer.write(code_record(code, STATUS_ERROR, error=describe_error(error), resolve_seconds=seconds))
+            return
+        self.separator()
+        print(f"{Fore.RED}An error occurred for code {code}: {describe_error(error)}{Style.RESET_ALL}")
 
 def main():
     """
@@ -72,6 +73,25 @@ def main():
         required=True,
         help="A comma-separated string of 8-digit codes (e.g., 'no1,no2,no3')."
     )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached lookups and fetch every code again (the cache is updated)."
+    )
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither read nor write the lookup cache."
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=['text', 'jsonl'],
+        default='text',
+        help="'text' prints colored blocks (default); 'jsonl' writes one JSON object per code "
+             "(code, status, title, links, error, timings) as soon as it is resolved."
+    )
 
     args = parser.parse_args()
     
@@ -81,16 +101,13 @@ def main():
     # Use a set to avoid processing duplicate codes
     unique_codes = sorted(list(set(codes)))
 
-    for i, code in enumerate(unique_codes):
-        if not (code.isdigit() and len(code) == 8):
-            print(f"{Fore.YELLOW}Warning: '{code}' is not a valid 8-digit number. Skipping.{Style.RESET_ALL}")
-            continue
-        
-        fetch_and_parse(code)
-        
-        # Print the separator after each code's results
-        if i < len(unique_codes) - 1:
-             print(f"{Fore.LIGHTRED_EX}--------{Style.RESET_ALL}")
+    # Lookups go through the same engine as the downloader tools, with their cache on disk
+    # and retries with backoff; the POSTs go over one shared keep-alive session.
+    # Imported only now (requests, lxml), so --help and argument errors don't wait for it.
+    from shedu.engine import Engine
+    writer = JsonlWriter() if args.format == 'jsonl' else None
+    engine = Engine(events=LinkPrinter(writer), cache=open_cache(not args.no_cache), refresh=args.refresh)
+    engine.run(unique_codes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+"""Shared building blocks for the SHEDU audio downloader front ends."""
@@ -0,0 +1,209 @@
+"""
+asyncio engine for resolving codes and downloading files.
+
+It implements the same operations as the synchronous Engine.download(), but
+every request is a coroutine on a single event loop, so thousands of requests
+can be in flight without a thread per request. It needs the optional aiohttp
+package (`pip install aiohttp`).
+"""
+import asyncio
+import os
+import time
+from urllib.parse import urljoin, urlsplit
+
+from shedu import partial
+from shedu.extract import extract_page
+from shedu.dedup import validator_key
+from shedu.folders import response_filename, sanitize_filename
+from shedu.manifest import Manifest, new_digest
+from shedu.metrics import get_metrics
+from shedu.profiling import get_recorder
+from shedu.session import BASE_URL, USER_AGENT
+from shedu.ratelimit import get_limiter
+from shedu.stream import ThrottledProgress
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+CHUNK_SIZE = 64 * 1024
+# Errors that mean a request failed, as opposed to a bug or a file error.
+REQUEST_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp else (asyncio.TimeoutError,)
+
+
+def open_session(pool_size=100):
+    """
+    Creates the aiohttp session shared by all coroutines of one run.
+
+    `pool_size` caps the number of simultaneous connections; connections are
+    kept alive and reused like the synchronous shared session.
+    """
+    if aiohttp is None:
+        raise RuntimeError("The async engine needs aiohttp. Install it with: pip install aiohttp")
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    return aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+
+
+class DownloadLimits:
+    """Caps the number of concurrent downloads overall and per host."""
+
+    def __init__(self, max_downloads, per_host):
+        self._all = asyncio.Semaphore(max_downloads)
+        self._per_host = per_host
+        self._hosts = {}
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self._per_host)
+        return self._hosts[host]
+
+    async def run(self, url, coro_fn, *args):
+        """Awaits `coro_fn(*args)` once a slot for `url` is free."""
+        async with self._host(url), self._all:
+            return await coro_fn(*args)
+
+
+async def _request(session, method, url, **kwargs):
+    """
+    Sends a request paced by the process-wide RateLimiter and reports its outcome to it.
+
+    Returns the response, whose body has yet to be read.
+    """
+    limiter = get_limiter()
+    host = urlsplit(url).netloc
+    delay = limiter.request_delay(host)
+    if delay:
+        await asyncio.sleep(delay)
+    began = time.monotonic()
+    try:
+        response = await session.request(method, url, **kwargs)
+    except REQUEST_ERRORS:
+        limiter.record(host, failed=True)
+        raise
+    limiter.record(host, time.monotonic() - began, response.status)
+    return response
+
+
+async def resolve(session, code, base_url=None, no_title="No title found"):
+    """
+    Posts a code and returns its title and the absolute URLs of its .shtml links.
+
+    Raises one of REQUEST_ERRORS if the request fails.
+    """
+    base_url = base_url or BASE_URL
+    recorder = get_recorder()
+    # Like requests' timeout=10: per connect and per read, not for the whole exchange.
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+    with recorder.span('lookup.post', code=code) as span:
+        began = time.perf_counter()
+        async with await _request(session, 'POST', f"{base_url}/book/access.action", data={"code": code}, timeout=timeout) as response:
+            span.update(status=response.status, ttfb=time.perf_counter() - began)
+            response.raise_for_status()
+            content = await response.read()
+
+    with recorder.span('lookup.parse', code=code, bytes=len(content)):
+        title, shtml_links = extract_page(content)
+    return title or no_title, [urljoin(base_url, link) for link in shtml_links]
+
+
+async def download(session, url, download_path, progress=None, manifest=None, skipped=None, dedup=None, linked=None):
+    """
+    Streams `url` into `download_path` and returns the path of the written file.
+
+    Like the synchronous download it writes to a .part file, resumes it with a
+    Range request and renames it into place once complete.
+    `progress(filename, total_size, offset)` may return an object with
+    `update(n)` and `close()` methods (a tqdm bar fits) that is told about
+    the bytes written a few times per second.
+    With a `manifest` (--sync), files the server reports unchanged are not
+    downloaded again: `skipped(path)` is called and None is returned.
+    With a `dedup` store, content it already has is linked into place instead
+    and `linked(path)` is called.
+    Raises one of REQUEST_ERRORS, partial.IncompleteDownload (a body cut short)
+    or OSError on failure.
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=20, sock_read=20)
+    recorder = get_recorder()
+    recorder.count('download.attempts')
+    part_file = partial.part_path(download_path, url)
+    entry = manifest.unchanged_candidate(url) if manifest else None
+    conditional_headers = Manifest.conditional_headers(entry)
+    headers = {**partial.IDENTITY_HEADERS, **conditional_headers}
+
+    if entry and not conditional_headers:
+        # No validators were recorded: a HEAD reporting the same size counts as unchanged.
+        async with await _request(session, 'HEAD', url, headers=partial.IDENTITY_HEADERS, allow_redirects=True, timeout=timeout) as r:
+            if r.status < 400 and int(r.headers.get('content-length', -1)) == entry['size']:
+                if skipped:
+                    skipped(entry['path'])
+                return None
+
+    offset = partial.resume_offset(part_file)
+    with recorder.span('download.ttfb', url=url) as ttfb:
+        r = await _request(session, 'GET', url, headers={**headers, **partial.range_headers(offset)}, timeout=timeout)
+        start = partial.resumed_offset(r.status, r.headers, offset)
+        if offset and (r.status == 416 or start is None):
+            # The partial file doesn't fit what the server has now; start over.
+            r.release()
+            os.remove(part_file)
+            r, start = await _request(session, 'GET', url, headers=headers, timeout=timeout), 0
+        ttfb.update(status=r.status, offset=start)
+    offset = start
+
+    async with r:
+        if r.status == 304:
+            if skipped:
+                skipped(entry['path'])
+            return None
+        r.raise_for_status()
+
+        filename = response_filename(r.headers, str(r.url))
+        file_path = os.path.join(download_path, sanitize_filename(filename))
+        total_size = partial.expected_size(r.headers, offset)
+        key = validator_key(url, r.headers, total_size) if dedup else None
+        stored = dedup.lookup(key) if key else None
+        if stored:
+            dedup.link(stored, file_path)
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            if linked:
+                linked(file_path)
+            if manifest:
+                manifest.record(url, file_path, os.path.getsize(file_path), r.headers, stored[1])
+            return file_path
+
+        bar = progress(filename, total_size, offset) if progress else None
+        report = ThrottledProgress(bar.update) if bar else None
+        digest = new_digest(part_file, offset) if manifest or dedup else None
+        limiter, host = get_limiter(), urlsplit(str(r.url)).netloc
+        with partial.open_part(part_file, offset) as part, recorder.span('download.transfer', url=url) as transfer:
+            f = recorder.timed_writes(get_metrics().counted_writes(part))
+            written = 0
+            try:
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    # Local disk writes are short enough to do on the loop thread.
+                    f.write(chunk)
+                    written += len(chunk)
+                    if report:
+                        report(len(chunk))
+                    if digest:
+                        digest.update(chunk)
+                    delay = limiter.byte_delay(host, len(chunk))
+                    if delay:
+                        await asyncio.sleep(delay)
+            finally:
+                transfer['bytes'] = written
+                recorder.count('download.bytes', written)
+                if bar:
+                    report.flush()
+                    bar.close()
+    with recorder.span('download.finish', url=url):
+        partial.check_complete(part_file, total_size)
+        partial.finish(part_file, file_path)
+        if dedup:
+            dedup.add(file_path, digest.hexdigest(), key)
+        if manifest:
+            manifest.record(url, file_path, os.path.getsize(file_path), r.headers, digest.hexdigest())
+    return file_path
@@ -0,0 +1,110 @@
+"""
+Persistent cache of code -> (title, links) resolutions.
+
+Resolving a code means a POST to access.action plus parsing the whole page,
+yet the result almost never changes. The cache keeps results in a small SQLite
+database in the user's cache directory, shared by every front end. Entries
+expire after a TTL and the least recently used ones are dropped once the cache
+holds more than `max_entries` codes.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_FILENAME = "resolve-cache.sqlite3"
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 20000
+
+
+def user_cache_dir():
+    """Returns the per-user cache directory for this tool (SHEDU_CACHE_DIR overrides it)."""
+    if os.environ.get("SHEDU_CACHE_DIR"):
+        return os.environ["SHEDU_CACHE_DIR"]
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser(r"~\AppData\Local")
+        return os.path.join(root, "shedu", "Cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/shedu")
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "shedu")
+
+
+class ResolveCache:
+    """
+    Thread-safe SQLite store of resolved codes.
+
+    Entries are keyed by base URL and code, so runs against a stand-in server
+    never mix with results from the real site.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        if path is None:
+            os.makedirs(user_cache_dir(), exist_ok=True)
+            path = os.path.join(user_cache_dir(), CACHE_FILENAME)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS resolved ("
+            " base_url TEXT NOT NULL, code TEXT NOT NULL, title TEXT, links TEXT NOT NULL,"
+            " fetched REAL NOT NULL, used REAL NOT NULL, PRIMARY KEY (base_url, code))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS resolved_used ON resolved (used)")
+
+    def get(self, base_url, code):
+        """Returns the cached `(title, links)` for a code, or None if missing or expired."""
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT title, links FROM resolved WHERE base_url = ? AND code = ? AND fetched > ?",
+                    (base_url, code, now - self.ttl),
+                ).fetchone()
+                if row is None:
+                    return None
+                self._db.execute("UPDATE resolved SET used = ? WHERE base_url = ? AND code = ?", (now, base_url, code))
+        except sqlite3.Error:
+            # Another process holding the database too long is a miss, not a failure.
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, base_url, code, title, links):
+        """Stores a resolution and evicts the least recently used entries over the size bound."""
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO resolved (base_url, code, title, links, fetched, used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (base_url, code, title, json.dumps(links), now, now),
+                )
+                self._db.execute(
+                    "DELETE FROM resolved WHERE rowid IN ("
+                    " SELECT rowid FROM resolved ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_cache(enabled=True):
+    """
+    Opens the shared cache, or returns None if it is disabled or unusable.
+
+    A cache that can't be opened (read-only profile, locked file) just means
+    every code is fetched from the server as before.
+    """
+    if not enabled:
+        return None
+    try:
+        return ResolveCache()
+    except (OSError, sqlite3.Error):
+        return None
@@ -0,0 +1,146 @@
+"""
+Reading access codes from arguments, files and pipes.
+
+Codes may be separated by commas, spaces or newlines. Files are read line by
+line and duplicates are dropped as codes arrive, so a long export piped in
+starts being processed right away and never has to fit in memory as a list.
+"""
+import collections
+import queue
+import re
+import threading
+
+_SEPARATORS = re.compile(r'[\s,]+')
+# How long to wait for more input before handing out codes that are still resolving.
+IDLE_WAIT = 0.05
+_END = object()
+
+
+def is_valid_code(code):
+    """Returns whether `code` looks like an access code: exactly 8 digits."""
+    return len(code) == 8 and code.isdigit()
+
+
+def split_codes(text):
+    """Returns the codes in a comma/whitespace separated string."""
+    return [code for code in _SEPARATORS.split(text.strip().lstrip('\ufeff')) if code]
+
+
+def read_codes(lines):
+    """Yields the codes in an iterable of lines (such as an open file) as it is read."""
+    for line in lines:
+        yield from split_codes(line)
+
+
+def unique_codes(codes):
+    """
+    Yields every code from `codes` the first time it appears.
+
+    Valid codes are remembered as ints, which take less than half the memory
+    of the strings, so even a very long stream dedupes in a small set.
+    """
+    seen = set()
+    for code in codes:
+        key = int(code) if is_valid_code(code) and code.isascii() else code
+        if key not in seen:
+            seen.add(key)
+            yield code
+
+
+class CodeFeed:
+    """
+    Reads codes from an iterable on a background thread.
+
+    Whoever processes the codes can then tell "nothing has arrived yet" apart
+    from the end of the input, so codes already resolved are never held back
+    by a pipe that delivers the next ones slowly. Errors raised while reading
+    are raised again by `get()`.
+    """
+
+    def __init__(self, codes, buffer=1024):
+        self._queue = queue.Queue(buffer)
+        self._error = None
+        threading.Thread(target=self._read, args=(codes,), name="code-reader", daemon=True).start()
+
+    def _read(self, codes):
+        try:
+            for code in codes:
+                self._queue.put(code)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._queue.put(_END)
+
+    def get(self, timeout=None):
+        """
+        Returns the next code, or None at the end of the input.
+
+        Raises queue.Empty if no code arrives within `timeout` seconds.
+        """
+        code = self._queue.get(timeout=timeout)
+        if code is _END:
+            # Leave the marker for any later call.
+            self._queue.put(_END)
+            if self._error:
+                raise self._error
+            return None
+        return code
+
+
+def _ready(handle):
+    return handle is None or handle.done()
+
+
+def prefetch(feed, start, window):
+    """
+    Yields `(code, start(code))` for every code of a CodeFeed, in input order.
+
+    `start` should begin resolving a code in the background (submit it to a
+    pool) and return a future, so up to `window` codes are fetched while the
+    caller handles the current one. A code is yielded as soon as its result is
+    ready, or once the window is full or the input has gone quiet. Invalid
+    codes are yielded with None.
+    """
+    pending = collections.deque()
+    ended = False
+    while True:
+        while pending and (ended or len(pending) >= window or _ready(pending[0][1])):
+            yield pending.popleft()
+        if ended:
+            return
+        try:
+            code = feed.get(timeout=IDLE_WAIT if pending else None)
+        except queue.Empty:
+            yield pending.popleft()
+            continue
+        if code is None:
+            ended = True
+        else:
+            pending.append((code, start(code) if is_valid_code(code) else None))
+
+
+async def prefetch_async(feed, start, window):
+    """
+    prefetch() for asyncio: `start` returns a task, and input is awaited off the loop thread.
+    """
+    # Imported here so the threaded front ends never load asyncio.
+    import asyncio
+    pending = collections.deque()
+    ended = False
+    while True:
+        while pending and (ended or len(pending) >= window or _ready(pending[0][1])):
+            yield pending.popleft()
+        if ended:
+            return
+        try:
+            code = feed.get(timeout=0)
+        except queue.Empty:
+            try:
+                code = await asyncio.to_thread(feed.get, IDLE_WAIT if pending else None)
+            except queue.Empty:
+                yield pending.popleft()
+                continue
+        if code is None:
+            ended = True
+        else:
+            pending.append((code, start(code) if is_valid_code(code) else None))
@@ -0,0 +1,209 @@
+"""
+Content-addressed store that keeps one copy of files shared between codes (--dedup).
+
+The same track often belongs to several textbooks. With --dedup every
+download is hashed (SHA-256) as it streams in, and the store in the target
+directory remembers
+
+* each piece of content by its hash, as a file under `.shedu-store/objects`
+  hardlinked to the first download of it, and
+* which server validators (URL, strong ETag and size) led to which hash.
+
+When a later download of the same URL comes with the same validators, the
+body is not downloaded at all: the stored object is linked into the code's
+folder. An ETag only identifies content within one URL (nginx derives it
+from the modification time and size, which two tracks uploaded together can
+share), so content is only shared between different URLs once its hash is
+known: a downloaded file that turns out to have the same content as a stored
+one is replaced by a link, so it costs no extra disk.
+
+Links are hardlinks where the file system allows them, reflinks (copy on
+write clones, Linux only) where it doesn't, and copies as a last resort.
+Hardlinked files share their content: editing one edits every copy.
+"""
+import json
+import os
+import shutil
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+STORE_DIR = ".shedu-store"
+INDEX_NAME = "index.json"
+# Version 1 keyed validators by ETag and size alone; its keys are dropped on loading.
+INDEX_VERSION = 2
+# ioctl request number of Linux's FICLONE.
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    """Clones `src` to `dst` sharing its blocks; raises OSError where that isn't supported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def link_file(src, dst, allow_copy=True):
+    """
+    Makes `dst` a hardlink, reflink or (with `allow_copy`) copy of `src`, replacing it if it exists.
+
+    Returns "hardlink", "reflink" or "copy"; raises OSError if nothing worked.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # Linked by an earlier run already.
+        return "hardlink"
+    tmp_path = dst + ".shedu-link"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+        method = "hardlink"
+    except OSError:
+        try:
+            _reflink(src, tmp_path)
+            method = "reflink"
+        except OSError:
+            if not allow_copy:
+                raise
+            shutil.copyfile(src, tmp_path)
+            method = "copy"
+    os.replace(tmp_path, dst)
+    if os.path.lexists(tmp_path):
+        # rename() leaves both names in place when they are links to the same file.
+        os.remove(tmp_path)
+    return method
+
+
+def normalize_url(url):
+    """Returns `url` with its scheme and host lowercased and without a fragment."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+def validator_key(url, headers, size):
+    """
+    Returns the store key for a response to `url`, or None if it can't identify the content.
+
+    Only strong ETags qualify; a weak one (W/"...") may be shared by different
+    bytes. The key includes the URL, as ETags are only unique per resource.
+    """
+    etag = headers.get('etag')
+    if not etag or etag.startswith('W/') or not size:
+        return None
+    return f"{normalize_url(url)}|{etag}|{size}"
+
+
+class DedupStore:
+    """
+    Thread-safe content-addressed store in `base_dir`.
+
+    `lookup()` before downloading, `add()` after; `save()` writes the index
+    back once the run is over.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.store_dir = os.path.join(base_dir, STORE_DIR)
+        self.path = os.path.join(self.store_dir, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._keys = {}
+        self._dirty = False
+        # Files linked instead of downloaded, and the bytes that saved.
+        self.linked = self.bytes_saved = 0
+        # Downloaded files replaced by a link to identical content already stored.
+        self.merged = self.disk_saved = 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._objects = data.get('objects', {})
+            self._keys = data.get('keys', {}) if data.get('version') == INDEX_VERSION else {}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            # A damaged index only means shared files are downloaded once more.
+            self._objects, self._keys = {}, {}
+
+    def _object(self, sha256):
+        """Returns the absolute path of the stored object, if it is still there at its size."""
+        entry = self._objects.get(sha256)
+        if not entry:
+            return None
+        path = os.path.join(self.base_dir, entry['path'])
+        try:
+            if os.path.getsize(path) == entry['size']:
+                return path
+        except OSError:
+            pass
+        del self._objects[sha256]
+        self._dirty = True
+        return None
+
+    def lookup(self, key):
+        """Returns `(path, sha256)` of the stored content for a validator key, or None."""
+        if not key:
+            return None
+        with self._lock:
+            sha256 = self._keys.get(key)
+            path = self._object(sha256) if sha256 else None
+        return (path, sha256) if path else None
+
+    def link(self, stored, file_path):
+        """Puts the stored content (from lookup()) at `file_path` instead of downloading it."""
+        path, _ = stored
+        link_file(path, file_path)
+        with self._lock:
+            self.linked += 1
+            self.bytes_saved += os.path.getsize(file_path)
+
+    def add(self, file_path, sha256, key=None):
+        """
+        Adds a completed download to the store.
+
+        If identical content is stored already, `file_path` is replaced by a
+        link to it. Returns True in that case.
+        """
+        size = os.path.getsize(file_path)
+        with self._lock:
+            existing = self._object(sha256)
+            if key:
+                self._keys[key] = sha256
+                self._dirty = True
+        if existing and not os.path.samefile(existing, file_path):
+            link_file(existing, file_path)
+            with self._lock:
+                self.merged += 1
+                self.disk_saved += size
+            return True
+        if not existing:
+            object_path = os.path.join(self.store_dir, "objects", sha256[:2], sha256)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            try:
+                link_file(file_path, object_path, allow_copy=False)
+            except OSError:
+                # Without links the download itself serves as the stored copy.
+                object_path = file_path
+            with self._lock:
+                self._objects[sha256] = {'path': os.path.relpath(object_path, self.base_dir), 'size': size}
+                self._dirty = True
+        return False
+
+    def save(self):
+        """Writes the index back atomically if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': INDEX_VERSION, 'objects': self._objects, 'keys': self._keys}
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,488 @@
+"""
+The resolve, plan and download engine behind every front end.
+
+The command-line tool, the GUI and the link tool all drive an Engine and
+only decide how to show what it reports. An Engine resolves codes (through
+the lookup cache, on `resolve_jobs` threads, with retries), probes their
+links for --plan, and downloads files on a DownloadScheduler (resumable,
+rate limited, recorded in a manifest, linked from a dedup store) or, with
+run_async(), on the asyncio engine. Whatever happens is reported through
+the methods of an Events object, which a front end subclasses. With
+profiling on (shedu.profiling), every phase of that work is timed; with
+metrics on (shedu.metrics), it is counted for Prometheus.
+
+Downloads and lookups that fail after all retries are recorded in
+`Engine.failures`; the front end decides where to save them.
+"""
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+from shedu import partial
+from shedu.codes import CodeFeed, is_valid_code, prefetch, prefetch_async
+from shedu.dedup import validator_key
+from shedu.events import Events
+from shedu.extract import extract_page
+from shedu.failures import FailureLog
+from shedu.folders import NO_TITLE, download_dir, response_filename, sanitize_filename
+from shedu.jobs import Cancelled, Paused
+from shedu.manifest import Manifest, new_digest
+from shedu.metrics import get_metrics
+from shedu.plan import make_plan
+from shedu.profiling import get_recorder
+from shedu.ratelimit import get_limiter
+from shedu.retry import get_policy
+from shedu.scheduler import DownloadScheduler, DEFAULT_MAX_DOWNLOADS, DEFAULT_PER_HOST
+from shedu.session import BASE_URL, get_session
+from shedu.stream import copy_response
+
+# Errors of the synchronous engine that mean a request failed, as opposed to a bug or a file error.
+REQUEST_ERRORS = (requests.exceptions.RequestException, partial.IncompleteDownload)
+
+Resolved = collections.namedtuple('Resolved', 'code title links error seconds')
+Resolved.__doc__ = """
+The lookup of one code: its `title` (None if the page has none) and the
+absolute URLs of its .shtml `links`, or the `error` it failed with, and the
+`seconds` it took.
+"""
+
+
+def unchanged_by_size(url, entry):
+    """
+    HEAD check for manifest entries without ETag/Last-Modified: same size counts as unchanged.
+    """
+    r = get_session().head(url, headers=partial.IDENTITY_HEADERS, allow_redirects=True, timeout=20)
+    return r.ok and int(r.headers.get('content-length', -1)) == entry['size']
+
+
+class Engine:
+    """
+    Resolves codes and downloads their files into `target`, reporting to `events`.
+
+    `resolve_jobs` codes are looked up at a time and up to `download_jobs`
+    files (`per_host` per host) downloaded at once. `cache` is a lookup
+    cache (open_cache()), bypassed for reading with `refresh`. Downloads are
+    recorded in `manifest` and shared through `dedup` if given. A JobControl
+    as `control` lets a threaded run be paused and cancelled: backoff waits
+    end on cancel, and downloads stop at their next chunk and remove their
+    .part files, or leave them for a later run to resume with `keep_partial`.
+    Folders of codes without a title are named with `no_title`.
+
+    run() queues the downloads and returns once every code is resolved;
+    finish() then waits for them and saves the manifest and dedup store.
+    """
+
+    def __init__(self, target='.', folder_format='n', events=None, resolve_jobs=1,
+                 download_jobs=DEFAULT_MAX_DOWNLOADS, per_host=DEFAULT_PER_HOST, cache=None, refresh=False,
+                 manifest=None, dedup=None, failures=None, control=None, no_title=NO_TITLE, keep_partial=False):
+        self.target = target
+        self.folder_format = folder_format
+        self.events = events or Events()
+        self.resolve_jobs = resolve_jobs
+        self.download_jobs = download_jobs
+        self.per_host = per_host
+        self.cache = cache
+        self.refresh = refresh
+        self.manifest = manifest
+        self.dedup = dedup
+        self.failures = failures if failures is not None else FailureLog()
+        self.control = control
+        self.no_title = no_title
+        self.keep_partial = keep_partial
+        self._sleep = control.sleep if control else time.sleep
+        self._scheduler = None
+        self._scheduler_lock = threading.Lock()
+
+    # --- Resolving ---
+
+    def resolve(self, code):
+        """
+        Posts a code and returns its title (None if there is none) and the absolute URLs of its .shtml links.
+
+        Results found in the cache are returned without a request unless
+        `refresh` is set; fresh results that have links are stored in it.
+        Raises requests' RequestException if the lookup fails after all retries.
+        """
+        recorder = get_recorder()
+        cached = self.cache.get(BASE_URL, code) if self.cache and not self.refresh else None
+        if cached:
+            recorder.count('lookup.cache_hits')
+            return cached
+
+        def post(url):
+            with recorder.span('lookup.post', code=code) as span:
+                response = get_session().post(url, data={"code": code}, timeout=10)
+                span.update(status=response.status_code, ttfb=response.elapsed.total_seconds())
+                response.raise_for_status()
+                return response.content
+
+        # Looking a code up changes nothing on the server, so the POST is safe to retry.
+        content = get_policy().call(post, f"{BASE_URL}/book/access.action", idempotent=True, sleep=self._sleep)
+        with recorder.span('lookup.parse', code=code, bytes=len(content)):
+            title, shtml_links = extract_page(content)
+        links = [urljoin(BASE_URL, link) for link in shtml_links]
+        self._remember(code, title, links)
+        return title, links
+
+    def _remember(self, code, title, links):
+        # A page without links is usually an error page for a bad code; don't remember it.
+        if self.cache and links:
+            self.cache.put(BASE_URL, code, title, links)
+
+    def _resolve_timed(self, code):
+        began = time.perf_counter()
+        try:
+            with get_recorder().span('resolve', code=code):
+                title, links = self.resolve(code)
+        except requests.exceptions.RequestException as e:
+            return Resolved(code, None, [], e, time.perf_counter() - began)
+        return Resolved(code, title, links, None, time.perf_counter() - began)
+
+    def _resolutions(self, codes, pool):
+        """
+        Yields `(code, Resolved)` for every code in input order; invalid codes come with None.
+
+        With one resolve job every code is resolved inline; otherwise a window
+        of codes is resolved ahead on `pool`, so input can stream in without limit.
+        """
+        if self.resolve_jobs > 1:
+            blocks = prefetch(CodeFeed(codes), lambda code: pool.submit(self._resolve_timed, code), self.resolve_jobs * 2)
+        else:
+            blocks = ((code, None) for code in codes)
+        for code, future in blocks:
+            if self.control:
+                self.control.checkpoint()
+            if not is_valid_code(code):
+                yield code, None
+            else:
+                yield code, future.result() if future else self._resolve_timed(code)
+
+    def _count(self, resolved):
+        """Adds one code's lookup (None for an invalid code) to the metrics."""
+        metrics = get_metrics()
+        if resolved is None:
+            metrics.code_done('invalid')
+        elif resolved.error is not None:
+            metrics.code_done('error', resolved.seconds)
+            metrics.failed('resolve', resolved.error)
+        else:
+            metrics.code_done('ok' if resolved.links else 'no_links', resolved.seconds)
+
+    def _report(self, code, resolved, download=None):
+        """Reports one code's lookup and passes each of its links to `download(url, code, title)`."""
+        self._count(resolved)
+        if resolved is None:
+            self.events.code_invalid(code)
+            return
+        if resolved.error is not None:
+            self.failures.code_failed(code, resolved.error)
+            self.events.code_failed(code, resolved.error, resolved.seconds)
+            return
+        self.events.code_resolved(code, resolved.title, resolved.links, resolved.seconds)
+        for url in resolved.links if download else ():
+            download(url, code, resolved.title)
+
+    # --- Threaded runs ---
+
+    def run(self, codes, download=False, failed_files=()):
+        """
+        Resolves `codes` (any iterable; a stream is read as it goes) and reports each of them in input order.
+
+        With `download` every link is queued for download as soon as its code
+        is reported. `failed_files` are file records of a failures file
+        (--rerun-failed), queued first. A cancelled run drops the downloads
+        that haven't started and returns early.
+        """
+        # Size the shared connection pool for every resolver and download thread.
+        get_session(self.resolve_jobs + (self.download_jobs if download or failed_files else 0))
+        try:
+            for item in failed_files:
+                self.submit(item['url'], item['code'], item['title'])
+            with ThreadPoolExecutor(max_workers=self.resolve_jobs, thread_name_prefix="resolve") as pool:
+                for code, resolved in self._resolutions(codes, pool):
+                    # Downloads for this code start right away while the next codes are resolved.
+                    self._report(code, resolved, self.submit if download else None)
+        except Cancelled:
+            self.cancel()
+
+    def cancel(self):
+        """
+        Cancels the run through `control`: downloads that haven't started are dropped.
+
+        The others stop at their next chunk; finish() still waits for them and
+        saves the manifest. Safe to call from a signal handler.
+        """
+        self.control.cancel()
+        if self._scheduler:
+            self._scheduler.cancel_pending()
+
+    def plan(self, codes):
+        """
+        Resolves `codes` and probes every link with HEAD (--plan); returns the Plan.
+
+        Failed codes are recorded as failures; invalid ones are listed in the
+        plan's `invalid_codes`. Nothing is reported through the events.
+        """
+        invalid = []
+
+        def path_for(code, title, filename):
+            folder = download_dir(self.target, self.folder_format, code, title or self.no_title, create=False)
+            return os.path.join(folder, sanitize_filename(filename))
+
+        def resolved(pool):
+            for code, resolved in self._resolutions(codes, pool):
+                self._count(resolved)
+                if resolved is None:
+                    invalid.append(code)
+                    continue
+                if resolved.error is not None:
+                    self.failures.code_failed(code, resolved.error)
+                yield code, resolved.title, resolved.links, resolved.error
+
+        get_session(self.resolve_jobs + self.download_jobs)
+        with ThreadPoolExecutor(max_workers=self.resolve_jobs, thread_name_prefix="resolve") as pool:
+            plan = make_plan(resolved(pool), path_for, self.resolve_jobs + self.download_jobs, self.dedup)
+        plan.invalid_codes.extend(invalid)
+        return plan
+
+    def download_plan(self, plan):
+        """Queues the files of a Plan that aren't on disk yet."""
+        for f in plan.to_download():
+            self.submit(f.url, f.code, f.title)
+
+    def submit(self, url, code, title):
+        """Queues a download on the engine's scheduler and returns its Future."""
+        with self._scheduler_lock:
+            if self._scheduler is None:
+                self._scheduler = DownloadScheduler(self.download_jobs, self.per_host)
+        self.events.download_queued(url, code, title)
+        return self._scheduler.submit(self.download, url, code, title)
+
+    def finish(self):
+        """Waits for every queued download, then saves the manifest and the dedup store."""
+        try:
+            if self._scheduler:
+                self._scheduler.join()
+        finally:
+            if self.manifest:
+                self.manifest.save()
+            if self.dedup:
+                self.dedup.save()
+
+    def download(self, url, code, title):
+        """
+        Downloads one file into its code's folder and returns its path (None if skipped or failed).
+
+        The data goes to a .part file first, which a retry or a later run
+        resumes from. With a manifest whose skip_unchanged is set (--sync),
+        files the server reports unchanged are skipped; with a dedup store,
+        content it already has is linked into place instead of downloaded.
+        Failures are reported and recorded in `failures`, not raised.
+        """
+        events, manifest, dedup, control = self.events, self.manifest, self.dedup, self.control
+        recorder, metrics = get_recorder(), get_metrics()
+        progress = None
+        part_file = None
+        status = 'failed'
+        began = time.perf_counter()
+        metrics.download_started()
+        try:
+            download_path = download_dir(self.target, self.folder_format, code, title or self.no_title)
+            part_file = partial.part_path(download_path, url)
+            entry = manifest.unchanged_candidate(url) if manifest else None
+            conditional_headers = Manifest.conditional_headers(entry)
+            checkpoint = (lambda: control.checkpoint(streaming=True)) if control else None
+
+            def attempt(url):
+                nonlocal progress
+                # Waits out a pause before (re)connecting and raises Cancelled once the job is cancelled.
+                if control:
+                    control.checkpoint()
+                recorder.count('download.attempts')
+                if entry and not conditional_headers and unchanged_by_size(url, entry):
+                    events.download_skipped(url, entry['path'])
+                    return None
+
+                with recorder.span('download.ttfb', url=url) as ttfb:
+                    r, offset = partial.get_resumable(get_session(), url, part_file, headers=conditional_headers, timeout=20)
+                    ttfb.update(status=r.status_code, offset=offset)
+                with r:
+                    if r.status_code == 304:
+                        events.download_skipped(url, entry['path'])
+                        return None
+                    r.raise_for_status()
+
+                    # Named after the URL the file actually came from, after any redirects.
+                    filename = response_filename(r.headers, r.url)
+                    file_path = os.path.join(download_path, sanitize_filename(filename))
+                    total_size = partial.expected_size(r.headers, offset)
+                    key = validator_key(url, r.headers, total_size) if dedup else None
+                    stored = dedup.lookup(key) if key else None
+                    if stored:
+                        # Only the headers were read; closing the response drops the body.
+                        dedup.link(stored, file_path)
+                        if os.path.exists(part_file):
+                            os.remove(part_file)
+                        events.download_linked(url, file_path)
+                        if manifest:
+                            manifest.record(url, file_path, os.path.getsize(file_path), r.headers, stored[1])
+                        return file_path
+                    digest = new_digest(part_file, offset) if manifest or dedup else None
+
+                    progress = events.download_started(url, filename, total_size, offset, progress)
+                    try:
+                        with partial.open_part(part_file, offset) as f, recorder.span('download.transfer', url=url) as transfer:
+                            transfer['bytes'] = copy_response(
+                                r, recorder.timed_writes(metrics.counted_writes(f)), progress=progress.update if progress else None, digest=digest,
+                                checkpoint=checkpoint, throttle=get_limiter().byte_throttle(r.url, sleep=self._sleep))
+                            recorder.count('download.bytes', transfer['bytes'])
+                    finally:
+                        if progress:
+                            progress.close()
+
+                with recorder.span('download.finish', url=url):
+                    # A body cut short must not become the file; the retry resumes it instead.
+                    partial.check_complete(part_file, total_size)
+                    partial.finish(part_file, file_path)
+                    if dedup:
+                        dedup.add(file_path, digest.hexdigest(), key)
+                    if manifest:
+                        manifest.record(url, file_path, os.path.getsize(file_path), r.headers, digest.hexdigest())
+                return file_path
+
+            while True:
+                try:
+                    # A failed attempt leaves its .part file behind, so a retry carries on where it stopped.
+                    path = get_policy().call(attempt, url, idempotent=True, sleep=self._sleep)
+                    break
+                except Paused:
+                    # The connection is closed; the .part file is picked up again after the pause.
+                    continue
+        except Cancelled:
+            status = 'cancelled'
+            if part_file and not self.keep_partial and os.path.exists(part_file):
+                os.remove(part_file)
+        except REQUEST_ERRORS as e:
+            metrics.failed('download', e)
+            events.download_failed(code, title, url, e)
+            self.failures.file_failed(code, title, url, e)
+        except OSError as e:
+            metrics.failed('download', e)
+            events.file_error(code, title, url, e)
+            self.failures.file_failed(code, title, url, e)
+        else:
+            status = 'ok' if path else 'skipped'
+            if path:
+                events.download_done(url, path)
+            return path
+        finally:
+            events.download_ended(url, progress)
+            seconds = time.perf_counter() - began
+            recorder.add('download', began, seconds, url=url, code=code)
+            metrics.download_ended(status, seconds)
+        return None
+
+    # --- asyncio runs ---
+
+    async def run_async(self, codes, download=False, failed_files=()):
+        """
+        run() and finish() on the asyncio engine (--engine async), reporting the same events.
+
+        Up to `resolve_jobs` codes are resolved at once on a single thread,
+        and each code's downloads start as soon as it has been reported.
+        Needs aiohttp. Pausing and cancelling through `control` is not
+        supported here; cancelling the task stops every download and keeps
+        its .part file.
+        """
+        import asyncio
+        from shedu import aio
+
+        resolve_slots = asyncio.Semaphore(self.resolve_jobs)
+        policy = get_policy()
+        recorder, metrics = get_recorder(), get_metrics()
+        limits = aio.DownloadLimits(self.download_jobs, self.per_host)
+        # Finished downloads drop out of the set, so a long stream of codes doesn't pile them up.
+        downloads = set()
+
+        async def resolve(session, code):
+            began = time.perf_counter()
+            cached = self.cache.get(BASE_URL, code) if self.cache and not self.refresh else None
+            if cached:
+                recorder.count('lookup.cache_hits')
+                recorder.add('resolve', began, time.perf_counter() - began, code=code)
+                return Resolved(code, cached[0], cached[1], None, time.perf_counter() - began)
+            try:
+                async with resolve_slots:
+                    with recorder.span('resolve', code=code):
+                        title, links = await policy.call_async(
+                            lambda url: aio.resolve(session, code, no_title=None), f"{BASE_URL}/book/access.action", idempotent=True)
+            except aio.REQUEST_ERRORS as e:
+                return Resolved(code, None, [], e, time.perf_counter() - began)
+            self._remember(code, title, links)
+            return Resolved(code, title, links, None, time.perf_counter() - began)
+
+        async def fetch(session, url, code, title):
+            progress = None
+            status = 'failed'
+            began = time.perf_counter()
+            metrics.download_started()
+
+            def started(filename, total_size, offset):
+                nonlocal progress
+                progress = self.events.download_started(url, filename, total_size, offset, progress)
+                return progress
+
+            def attempt(url):
+                # The backoff between attempts is waited out without holding a download slot.
+                return limits.run(url, aio.download, session, url, download_path, started, self.manifest,
+                                  lambda path: self.events.download_skipped(url, path), self.dedup,
+                                  lambda path: self.events.download_linked(url, path))
+
+            try:
+                download_path = download_dir(self.target, self.folder_format, code, title or self.no_title)
+                path = await policy.call_async(attempt, url, idempotent=True)
+            except aio.REQUEST_ERRORS + (partial.IncompleteDownload,) as e:
+                metrics.failed('download', e)
+                self.events.download_failed(code, title, url, e)
+                self.failures.file_failed(code, title, url, e)
+            except OSError as e:
+                metrics.failed('download', e)
+                self.events.file_error(code, title, url, e)
+                self.failures.file_failed(code, title, url, e)
+            else:
+                status = 'ok' if path else 'skipped'
+                if path:
+                    self.events.download_done(url, path)
+            finally:
+                self.events.download_ended(url, progress)
+                seconds = time.perf_counter() - began
+                recorder.add('download', began, seconds, url=url, code=code)
+                metrics.download_ended(status, seconds)
+
+        def start_download(url, code, title):
+            self.events.download_queued(url, code, title)
+            download_task = asyncio.ensure_future(fetch(session, url, code, title))
+            downloads.add(download_task)
+            download_task.add_done_callback(downloads.discard)
+
+        async with aio.open_session(self.resolve_jobs + self.download_jobs) as session:
+            # Also when the run is cancelled (Ctrl+C), so the downloads that completed are recorded.
+            try:
+                for item in failed_files:
+                    start_download(item['url'], item['code'], item['title'])
+
+                blocks = prefetch_async(CodeFeed(codes), lambda code: asyncio.ensure_future(resolve(session, code)), self.resolve_jobs * 2)
+                async for code, task in blocks:
+                    self._report(code, await task if task else None, start_download if download else None)
+
+                await asyncio.gather(*downloads)
+            finally:
+                if self.manifest:
+                    self.manifest.save()
+                if self.dedup:
+                    self.dedup.save()
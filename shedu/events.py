@@ -0,0 +1,64 @@
+"""
+The callbacks through which an Engine (shedu.engine) reports what it does.
+
+Front ends subclass Events at import time, while the engine, with its
+networking dependencies, is only imported once there is work to do.
+"""
+
+
+class Events:
+    """
+    What an Engine reports while it works. Every method does nothing here;
+    front ends override the ones they show.
+
+    The code events come from the thread that called run() or plan(), one
+    code at a time in input order. The download events come from the
+    download threads (or the event loop of run_async()), so a front end that
+    isn't thread-safe has to hand them over to its own thread.
+    """
+
+    def code_invalid(self, code):
+        """`code` is not an 8-digit number and was skipped."""
+
+    def code_resolved(self, code, title, links, seconds):
+        """`code` was looked up; `title` is None if the page has none, `links` may be empty."""
+
+    def code_failed(self, code, error, seconds):
+        """Looking up `code` failed after all retries."""
+
+    def download_queued(self, url, code, title):
+        """A download was queued; it is reported as over by download_ended()."""
+
+    def download_started(self, url, filename, total, offset, previous=None):
+        """
+        A transfer of `total` bytes (0 if unknown) starts, resuming at `offset`.
+
+        May return an object with `update(n)` and `close()` methods (a tqdm bar
+        fits) that is told about the bytes written, a few times per second,
+        and closed when the transfer ends. A retry calls this again with the
+        object the earlier attempt got as `previous`.
+        """
+        return None
+
+    def download_skipped(self, url, path):
+        """The server reports the file at `path` unchanged since the manifest recorded it (--sync)."""
+
+    def download_linked(self, url, path):
+        """The dedup store had the content; `path` is a link to it instead of a download."""
+
+    def download_done(self, url, path):
+        """The file is complete at `path`."""
+
+    def download_failed(self, code, title, url, error):
+        """The download failed after all retries."""
+
+    def file_error(self, code, title, url, error):
+        """The download failed because the file couldn't be written."""
+
+    def download_ended(self, url, progress):
+        """
+        Called last for every queued download, whatever its outcome.
+
+        `progress` is what the last download_started() returned, or None if
+        no transfer started.
+        """
@@ -0,0 +1,176 @@
+"""
+Targeted extraction of the title and .shtml links from an access.action page.
+
+Building a full BeautifulSoup tree for every page only to read one heading and
+a list of hrefs costs far more than the two values are worth. This module pulls
+out just those two things:
+
+* with lxml installed, the page is parsed by libxml2 and queried with XPath;
+* otherwise a streaming html.parser tokenizer tracks the open elements and
+  keeps nothing but the title text and matching hrefs.
+
+Both give the same results as `soup.select_one('dl.EnglishBox dd h5')` with
+`get_text(strip=True)` and `soup.find_all('a', href=True)` filtered on `.shtml`.
+"""
+import codecs
+import importlib.util
+import re
+from html.parser import HTMLParser
+
+# lxml takes longer to load than everything else here, so it is only imported
+# when the first page is parsed; this merely checks that it is installed.
+BACKEND = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([-\w.:]+)', re.I)
+# Elements that never have content or an end tag.
+_VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+))
+_TITLE_XPATH = (
+    "(//dl[contains(concat(' ', normalize-space(@class), ' '), ' EnglishBox ')]"
+    "//dd//h5)[1]"
+)
+
+
+def decode_page(content):
+    """
+    Decodes page bytes: a BOM wins, then a <meta> charset, then UTF-8 and GB18030.
+    """
+    if isinstance(content, str):
+        return content
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')):
+        if content.startswith(bom):
+            return content[len(bom):].decode(encoding, 'replace')
+    candidates = ['utf-8', 'gb18030']
+    match = _META_CHARSET.search(content, 0, 4096)
+    if match:
+        candidates.insert(0, match.group(1).decode('ascii', 'replace'))
+    for encoding in candidates:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode('utf-8', 'replace')
+
+
+class _PageScanner(HTMLParser):
+    """html.parser tokenizer that only records the title and the .shtml hrefs."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.title = None
+        # (tag, is EnglishBox dl, is dd) for every open element.
+        self._stack = []
+        self._boxes = 0
+        self._dd_in_box = 0
+        self._title_depth = None
+        self._title_parts = []
+        self._run = []
+
+    def _flush_run(self):
+        # BeautifulSoup strips each run of text between tags, not each data callback.
+        if self._run:
+            text = ''.join(self._run).strip()
+            if text:
+                self._title_parts.append(text)
+            self._run = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._title_depth is not None:
+            self._flush_run()
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href':
+                    if value is not None and value.endswith('.shtml'):
+                        self.links.append(value)
+                    break
+        if tag in _VOID_ELEMENTS:
+            return
+
+        is_box = is_dd = False
+        if tag == 'dl':
+            classes = next((value or '' for name, value in attrs if name == 'class'), '')
+            is_box = 'EnglishBox' in classes.split()
+        elif tag == 'dd' and self._boxes:
+            is_dd = True
+        elif tag == 'h5' and self.title is None and self._title_depth is None and self._dd_in_box:
+            self._title_depth = len(self._stack)
+        self._stack.append((tag, is_box, is_dd))
+        self._boxes += is_box
+        self._dd_in_box += is_dd
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Like BeautifulSoup, close the nearest open element of this name and
+        # everything opened inside it; stray end tags are ignored.
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                break
+        else:
+            return
+        if self._title_depth is not None:
+            self._flush_run()
+            if index <= self._title_depth:
+                self.title = ''.join(self._title_parts)
+                self._title_depth = None
+        for _, is_box, is_dd in self._stack[index:]:
+            self._boxes -= is_box
+            self._dd_in_box -= is_dd
+        del self._stack[index:]
+
+    def handle_data(self, data):
+        if self._title_depth is not None:
+            self._run.append(data)
+
+    def handle_comment(self, data):
+        # Comments aren't title text, but they do end a run of it.
+        if self._title_depth is not None:
+            self._flush_run()
+
+    def close(self):
+        super().close()
+        if self._title_depth is not None:
+            # The h5 was never closed: its text runs to the end of the page.
+            self._flush_run()
+            self.title = ''.join(self._title_parts)
+            self._title_depth = None
+
+
+def _extract_stream(text):
+    scanner = _PageScanner()
+    scanner.feed(text)
+    scanner.close()
+    return scanner.title, scanner.links
+
+
+def _extract_lxml(text):
+    import lxml.html
+    root = lxml.html.fromstring(text)
+    found = root.xpath(_TITLE_XPATH)
+    title = ''.join(part.strip() for part in found[0].itertext()) if found else None
+    links = [href for href in root.xpath('//a/@href') if href.endswith('.shtml')]
+    return title, links
+
+
+def extract_page(content):
+    """
+    Returns `(title, links)` for an access.action page given as bytes or str.
+
+    `title` is None when the page has no `dl.EnglishBox dd h5` heading, and
+    `links` holds the raw href of every <a> ending in `.shtml`, in page order.
+    """
+    text = decode_page(content)
+    if BACKEND == "lxml":
+        from lxml.etree import ParserError
+        try:
+            return _extract_lxml(text)
+        except (ValueError, ParserError):
+            # Empty documents and XML declarations trip up lxml.html; the tokenizer copes.
+            pass
+    return _extract_stream(text)
@@ -0,0 +1,84 @@
+"""
+Codes and files that still failed after all retries, and re-running them.
+
+At the end of a run the failures are written to a JSON Lines file in the
+target directory, one object per failure:
+
+    {"kind": "code", "code": "12345678", "error": "..."}
+    {"kind": "file", "code": "12345678", "title": "...", "url": "https://...", "error": "..."}
+
+`--rerun-failed` reads it back and retries exactly those: a failed code is
+resolved again (and its files downloaded with -d), a failed file is
+downloaded again into the folder it was meant for. The file always describes
+the last run in that directory, so a run without failures removes it.
+"""
+import json
+import os
+import threading
+
+FAILED_FILENAME = "shedu-failed.jsonl"
+
+
+def describe_error(error):
+    """Returns a message for an exception, falling back to its repr for those with none (timeouts)."""
+    return str(error) or repr(error)
+
+
+class FailureLog:
+    """Collects permanent failures from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = []
+
+    def code_failed(self, code, error):
+        with self._lock:
+            self._items.append({"kind": "code", "code": code, "error": describe_error(error)})
+
+    def file_failed(self, code, title, url, error):
+        with self._lock:
+            self._items.append({"kind": "file", "code": code, "title": title, "url": url, "error": describe_error(error)})
+
+    def discard(self, code):
+        """Drops the failures of `code` and returns them."""
+        with self._lock:
+            dropped = [item for item in self._items if item["code"] == code]
+            self._items = [item for item in self._items if item["code"] != code]
+        return dropped
+
+    def counts(self):
+        """Returns `(failed codes, failed files)`."""
+        with self._lock:
+            codes = sum(1 for item in self._items if item["kind"] == "code")
+            return codes, len(self._items) - codes
+
+    def save(self, path):
+        """Writes the failures to `path`, or removes it if there were none; returns the number written."""
+        with self._lock:
+            items = list(self._items)
+        if not items:
+            if os.path.exists(path):
+                os.remove(path)
+            return 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+        return len(items)
+
+
+def load_failures(path):
+    """Returns `(codes, files)` from a failures file: the failed codes and the failed file records."""
+    codes, files = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("kind") == "file":
+                files.append(item)
+            else:
+                codes.append(item["code"])
+    return codes, files
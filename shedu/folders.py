@@ -0,0 +1,49 @@
+"""
+Where downloads are saved: folder formats and safe file names.
+
+Kept free of networking imports, so front ends can use it (and its
+constants for their options) without loading the engine.
+"""
+import os
+import re
+from urllib.parse import unquote
+
+# Folder name part for codes whose page has no title.
+NO_TITLE = "No title found"
+FOLDER_FORMATS = ('ct', 'c', 't', 'tc', 'n')
+
+
+def sanitize_filename(name):
+    """Removes characters that are invalid in folder or file names."""
+    sanitized = re.sub(r'[<>:"/\\|?*]', '_', name)
+    sanitized = re.sub(r'__+', '_', sanitized)
+    return sanitized.strip(' _')
+
+
+def download_dir(base_dir, folder_format, code, title, create=True):
+    """
+    Creates (unless `create` is False) and returns the folder a code's files are saved to.
+
+    `folder_format` is one of FOLDER_FORMATS: 'ct' {code}-{title}, 'c' {code},
+    't' {title}, 'tc' {title}-{code} or 'n' for no sub-folder.
+    """
+    sub_folder = ""
+    if folder_format == 'ct':
+        sub_folder = f"{code}-{title}"
+    elif folder_format == 'c':
+        sub_folder = code
+    elif folder_format == 't':
+        sub_folder = title
+    elif folder_format == 'tc':
+        sub_folder = f"{title}-{code}"
+
+    download_path = os.path.join(base_dir, sanitize_filename(sub_folder))
+    if create:
+        os.makedirs(download_path, exist_ok=True)
+    return download_path
+
+
+def response_filename(headers, url):
+    """Returns the file name a response is saved under: Content-Disposition's, else that of its (final) URL."""
+    match = re.search(r'filename="?([^"]+)"?', headers.get('content-disposition', ''))
+    return unquote(match.group(1)) if match else unquote(url.split('/')[-1])
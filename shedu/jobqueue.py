@@ -0,0 +1,173 @@
+"""
+Persistent queue of codes to mirror, worked through by the `serve` command.
+
+Codes are submitted with the `submit` command or through the service's local
+socket (shedu.service) and kept in a small SQLite database in the target
+directory, so the queue outlives the processes that use it. The service takes
+the oldest queued code, marks it running and, once its last download has
+ended, done or failed. A job still marked running when the service starts
+was cut off by a restart or crash; it is queued again, and its downloads
+resume from their .part files.
+"""
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+from shedu.codes import is_valid_code
+
+QUEUE_FILENAME = ".shedu-queue.sqlite3"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUSES = (STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED)
+
+QueuedJob = collections.namedtuple(
+    'QueuedJob', 'id code status submitted started finished files failed_files error attempts'
+)
+QueuedJob.__doc__ = """
+One submitted code. Times are seconds since the epoch (None until reached);
+`files` and `failed_files` count the code's downloads once the job is over,
+`error` says why it failed, and `attempts` how often it was started.
+"""
+
+_COLUMNS = ", ".join(QueuedJob._fields)
+
+
+class JobQueue:
+    """
+    Thread-safe SQLite queue of codes; several processes may share its file.
+
+    submit() wakes up a wait() in the same process at once; other processes
+    notice new jobs the next time they poll.
+    """
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._submitted = threading.Event()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT NOT NULL, status TEXT NOT NULL,"
+            " submitted REAL NOT NULL, started REAL, finished REAL, files INTEGER, failed_files INTEGER,"
+            " error TEXT, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    def submit(self, codes):
+        """
+        Queues `codes` in order and returns `{'queued': n, 'pending': n, 'invalid': [codes]}`.
+
+        Codes that are queued or running already are counted as pending and not
+        queued twice; a code that is done or failed is queued again, which
+        mirrors it anew. Raises sqlite3.Error if the database stays locked.
+        """
+        queued, pending, invalid = 0, 0, []
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for code in codes:
+                    if not is_valid_code(code):
+                        invalid.append(code)
+                        continue
+                    if self._db.execute("SELECT 1 FROM jobs WHERE code = ? AND status IN (?, ?)",
+                                        (code, STATUS_QUEUED, STATUS_RUNNING)).fetchone():
+                        pending += 1
+                        continue
+                    self._db.execute("INSERT INTO jobs (code, status, submitted) VALUES (?, ?, ?)",
+                                     (code, STATUS_QUEUED, now))
+                    queued += 1
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if queued:
+            self._submitted.set()
+        return {'queued': queued, 'pending': pending, 'invalid': invalid}
+
+    def requeue_interrupted(self):
+        """Queues the jobs left running by a service that stopped, again; returns how many there were."""
+        with self._lock:
+            return self._db.execute("UPDATE jobs SET status = ? WHERE status = ?",
+                                    (STATUS_QUEUED, STATUS_RUNNING)).rowcount
+
+    def claim(self):
+        """
+        Marks the oldest queued job running and returns it, or None if there is none.
+
+        A database another process keeps locked counts as an empty queue; the
+        next call tries again.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                                           (STATUS_QUEUED,)).fetchone()
+                    if row is not None:
+                        self._db.execute("UPDATE jobs SET status = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+                                         (STATUS_RUNNING, now, row[0]))
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        return QueuedJob(*row)._replace(status=STATUS_RUNNING, started=now, attempts=row[-1] + 1)
+
+    def finish(self, job_id, files, failed_files, error=None):
+        """
+        Marks a job done, or failed if it has an `error` or failed files.
+
+        Returns False if the database couldn't be written; the job then stays
+        running and is queued again when the service restarts.
+        """
+        status = STATUS_FAILED if error or failed_files else STATUS_DONE
+        try:
+            with self._lock:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, finished = ?, files = ?, failed_files = ?, error = ? WHERE id = ?",
+                    (status, time.time(), files, failed_files, error, job_id),
+                )
+        except sqlite3.Error:
+            return False
+        return True
+
+    def counts(self):
+        """Returns the number of jobs per status, every status included."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def jobs(self, status=None, limit=20):
+        """Returns the `limit` most recently submitted jobs, of one `status` if given, newest first."""
+        with self._lock:
+            if status is None:
+                rows = self._db.execute(f"SELECT {_COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+            else:
+                rows = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?",
+                                        (status, limit))
+            return [QueuedJob(*row) for row in rows.fetchall()]
+
+    def wait(self, timeout):
+        """Blocks until submit() queues a job in this process, or for `timeout` seconds."""
+        self._submitted.wait(timeout)
+        self._submitted.clear()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
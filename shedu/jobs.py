@@ -0,0 +1,106 @@
+"""
+Background jobs that can be paused, resumed and cancelled.
+
+A job's code calls `control.checkpoint()` at points where it is safe to stop:
+between codes, before each download and before every chunk it reads. While
+the job is paused, a checkpoint blocks, or, inside a transfer
+(`streaming=True`), raises Paused so the connection is dropped and the
+download can resume from its .part file later. Once the job is cancelled,
+every checkpoint raises Cancelled.
+"""
+import threading
+
+
+class Interrupted(Exception):
+    """A job was paused or cancelled at a checkpoint."""
+
+
+class Paused(Interrupted):
+    """A transfer should let go of its connection until the job is resumed."""
+
+
+class Cancelled(Interrupted):
+    """The job was cancelled; stop and clean up."""
+
+
+class JobControl:
+    """Pause and cancel flags shared by every thread working for one job."""
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set() and not self.cancelled
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        # Wake up anything blocked on a pause so it sees the cancellation.
+        self._running.set()
+
+    def checkpoint(self, streaming=False):
+        """
+        Returns if the job may go on, waiting out a pause first.
+
+        Raises Cancelled once the job is cancelled. With `streaming`, a pause
+        raises Paused instead of blocking, so the caller doesn't hold a
+        connection open (and the server doesn't time it out) in the meantime.
+        """
+        if not self._running.is_set():
+            if streaming:
+                raise Paused()
+            self._running.wait()
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+    def sleep(self, seconds):
+        """time.sleep() that raises Cancelled as soon as the job is cancelled."""
+        if self._cancelled.wait(seconds):
+            raise Cancelled()
+
+
+class Job:
+    """
+    Runs `target(control, *args)` on a daemon thread under a JobControl.
+
+    `target` is expected to call `control.checkpoint()` regularly and to
+    return once it raises Cancelled.
+    """
+
+    def __init__(self, target, *args, name=None):
+        self.control = JobControl()
+        self._thread = threading.Thread(target=target, args=(self.control,) + args, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def pause(self):
+        self.control.pause()
+
+    def resume(self):
+        self.control.resume()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def shutdown(self, timeout=None):
+        """Cancels the job and waits up to `timeout` seconds; returns True if it stopped."""
+        self.cancel()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
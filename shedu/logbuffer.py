@@ -0,0 +1,47 @@
+"""
+Bounded buffer between a batch's log messages and the view showing them.
+
+A run over a thousand codes logs tens of thousands of lines. The view only
+ever needs the most recent ones, so lines wait here until the next UI tick
+and only the last `max_lines` are kept; the complete log can be copied to a
+file as it is written.
+"""
+import collections
+import os
+
+DEFAULT_MAX_LINES = 5000
+LOG_FILENAME = "shedu-log.txt"
+
+
+class LogBuffer:
+    """
+    Lines waiting to be shown, each with a tag, bounded to the newest `max_lines`.
+
+    With `spill_path`, every line is also written to that file, which is
+    truncated first. Not thread-safe: append and drain from the UI thread.
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, spill_path=None):
+        self.max_lines = max_lines
+        self._pending = collections.deque(maxlen=max_lines)
+        self._spill = None
+        if spill_path:
+            os.makedirs(os.path.dirname(os.path.abspath(spill_path)), exist_ok=True)
+            self._spill = open(spill_path, 'w', encoding='utf-8')
+
+    def append(self, line, tag=None):
+        self._pending.append((line, tag))
+        if self._spill:
+            self._spill.write(line + '\n')
+
+    def drain(self):
+        """Returns and forgets the `(line, tag)` pairs appended since the last drain."""
+        lines = list(self._pending)
+        self._pending.clear()
+        return lines
+
+    def close(self):
+        """Closes the spill file; lines appended afterwards are only shown."""
+        if self._spill:
+            self._spill.close()
+            self._spill = None
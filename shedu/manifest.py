@@ -0,0 +1,132 @@
+"""
+Manifest of downloaded files for incremental sync runs.
+
+The manifest lives in the target directory and records, for every URL, the file
+it was saved to together with its size, the server's ETag/Last-Modified and a
+SHA-256 of its content. A later sync run asks the server whether the URL
+changed (a conditional GET, or a HEAD when the server sent no validators) and
+skips files that are unchanged and still intact on disk.
+
+Every download run records into it, so `verify` can check any download tree
+against the SHA-256 computed while the files were streamed in; only --sync
+runs skip files because of it.
+"""
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_NAME = ".shedu-manifest.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def new_digest(part_file=None, offset=0):
+    """
+    Returns a SHA-256 object primed with the first `offset` bytes of `part_file`.
+
+    A resumed download only streams the missing tail, so the part already on
+    disk is hashed once up front.
+    """
+    digest = hashlib.sha256()
+    if offset:
+        with open(part_file, 'rb') as f:
+            remaining = offset
+            while remaining:
+                block = f.read(min(HASH_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+    return digest
+
+
+class Manifest:
+    """
+    Thread-safe view of the manifest file in `base_dir`.
+
+    Without `skip_unchanged` it only records downloads and never offers an
+    entry for skipping.
+    """
+
+    def __init__(self, base_dir, skip_unchanged=True):
+        self.base_dir = base_dir
+        self.skip_unchanged = skip_unchanged
+        self.path = os.path.join(base_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._dirty = False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._files = json.load(f).get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            # A damaged manifest only costs one full download; start afresh.
+            self._files = {}
+
+    def unchanged_candidate(self, url):
+        """
+        Returns the entry for `url` if its file is still on disk at the recorded size.
+
+        Only such files can be skipped; the server still has to confirm that
+        the URL didn't change.
+        """
+        if not self.skip_unchanged:
+            return None
+        with self._lock:
+            entry = self._files.get(url)
+        if not entry:
+            return None
+        try:
+            if os.path.getsize(os.path.join(self.base_dir, entry['path'])) != entry['size']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Returns If-None-Match/If-Modified-Since headers for `entry`, if it has validators."""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, url, file_path, size, response_headers, sha256):
+        """Stores the result of a completed download of `url`."""
+        entry = {
+            'path': os.path.relpath(file_path, self.base_dir),
+            'size': size,
+            'etag': response_headers.get('etag'),
+            'last_modified': response_headers.get('last-modified'),
+            'sha256': sha256,
+        }
+        with self._lock:
+            self._files[url] = entry
+            self._dirty = True
+
+    def entries(self):
+        """Returns a copy of the `{url: entry}` mapping."""
+        with self._lock:
+            return dict(self._files)
+
+    def forget(self, url):
+        """Drops the entry for `url`, so the next sync run downloads it again."""
+        with self._lock:
+            if self._files.pop(url, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """Writes the manifest back atomically if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': 1, 'files': self._files}
+            os.makedirs(self.base_dir, exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
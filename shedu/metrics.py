@@ -0,0 +1,348 @@
+"""
+Prometheus metrics of a run (--metrics-listen, --metrics-file).
+
+Once enable() has been called, the engines count what they do:
+
+* `shedu_codes_total{status}`: codes looked up, by outcome ("ok",
+  "no_links", "error", "invalid"), and `shedu_resolve_duration_seconds`,
+  a histogram of how long each lookup took;
+* `shedu_downloads_total{status}`: files by outcome ("ok", "skipped",
+  "failed", "cancelled"), `shedu_download_duration_seconds` for the ones
+  that succeeded, and `shedu_downloads_in_flight`;
+* `shedu_downloaded_bytes_total`, counted as the bytes reach the disk;
+* `shedu_retries_total{reason}` and `shedu_errors_total{phase,reason}`:
+  requests retried, and lookups and downloads that failed for good, by
+  reason ("http_503", "ConnectTimeout", "PermissionError", ...).
+
+The metrics are served in the Prometheus text format over HTTP (serve()),
+or written to a file for node_exporter's textfile collector every few
+seconds and at the end (TextfileWriter), which suits scheduled jobs whose
+process is gone before a scrape would come. Only the standard library is
+used; nothing is imported from prometheus_client.
+
+Until enable() is called, `get_metrics()` returns an object whose methods do
+nothing, and the files given to `counted_writes()` come back untouched.
+"""
+import bisect
+import os
+import socket
+import threading
+import time
+
+RESOLVE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DOWNLOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TEXTFILE_INTERVAL = 15.0
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"
+
+
+def error_reason(error):
+    """Returns a short label for an exception: "http_<status>" for HTTP errors, else its class name."""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None) if response is not None else getattr(error, 'status', None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    return type(error).__name__
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A metric family; the series are keyed by their label values. Not locked: Metrics locks around it."""
+
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, value in sorted(self.series.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(value)}"
+
+
+class _Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *values):
+        self.series[values] = self.series.get(values, 0) + amount
+
+
+class _Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *values):
+        self.series[values] = value
+
+    def inc(self, amount=1, *values):
+        self.series[values] = self.series.get(values, 0) + amount
+
+
+class _Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+        if not self.labelnames:
+            self._counts(())
+
+    def _counts(self, values):
+        # Per series: a count per bucket (not cumulative), then the sum.
+        return self.series.setdefault(values, [0] * (len(self.buckets) + 1) + [0.0])
+
+    def observe(self, value, *values):
+        counts = self._counts(values)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, counts in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class _CountedWriter:
+    """Wraps a file so that the bytes of every write() are added to the downloaded bytes."""
+
+    def __init__(self, f, metrics):
+        self._f = f
+        self._metrics = metrics
+
+    def write(self, data):
+        n = self._f.write(data)
+        self._metrics.add_bytes(len(data))
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class Metrics:
+    """The metrics of one process; thread-safe."""
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.codes = _Counter("shedu_codes_total", "Codes looked up, by outcome.", ("status",))
+        self.resolve_seconds = _Histogram("shedu_resolve_duration_seconds", "Time to look up one code, retries included.",
+                                          RESOLVE_BUCKETS)
+        self.downloads = _Counter("shedu_downloads_total", "Files handled, by outcome.", ("status",))
+        self.download_seconds = _Histogram("shedu_download_duration_seconds",
+                                           "Time to download one file, retries included (successful downloads).",
+                                           DOWNLOAD_BUCKETS)
+        self.in_flight = _Gauge("shedu_downloads_in_flight", "Downloads started and not finished yet.")
+        self.bytes = _Counter("shedu_downloaded_bytes_total", "Bytes written to disk by downloads.")
+        self.retries = _Counter("shedu_retries_total", "Requests retried, by reason.", ("reason",))
+        self.errors = _Counter("shedu_errors_total", "Lookups and downloads that failed after all retries, by reason.",
+                               ("phase", "reason"))
+        self.start_time = _Gauge("shedu_start_time_seconds", "When this run started, in seconds since the epoch.")
+        self.start_time.set(time.time())
+        # Outcomes start at zero, so rates and ratios over them exist before the first failure.
+        for status in ("ok", "no_links", "error", "invalid"):
+            self.codes.inc(0, status)
+        for status in ("ok", "skipped", "failed", "cancelled"):
+            self.downloads.inc(0, status)
+        self.in_flight.set(0)
+        self.bytes.inc(0)
+        self._families = [self.codes, self.resolve_seconds, self.downloads, self.download_seconds, self.in_flight,
+                          self.bytes, self.retries, self.errors, self.start_time]
+
+    def code_done(self, status, seconds=None):
+        """Counts a looked-up code; `seconds` is the lookup time (None for invalid codes)."""
+        with self._lock:
+            self.codes.inc(1, status)
+            if seconds is not None:
+                self.resolve_seconds.observe(seconds)
+
+    def download_started(self):
+        with self._lock:
+            self.in_flight.inc(1)
+
+    def download_ended(self, status, seconds):
+        with self._lock:
+            self.in_flight.inc(-1)
+            self.downloads.inc(1, status)
+            if status == "ok":
+                self.download_seconds.observe(seconds)
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes.inc(n)
+
+    def retried(self, error):
+        with self._lock:
+            self.retries.inc(1, error_reason(error))
+
+    def failed(self, phase, error):
+        """Counts a lookup (`phase` "resolve") or download ("download") that failed for good."""
+        with self._lock:
+            self.errors.inc(1, phase, error_reason(error))
+
+    def counted_writes(self, f):
+        """Returns `f` with the bytes of each write() added to shedu_downloaded_bytes_total."""
+        return _CountedWriter(f, self)
+
+    def exposition(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            return "\n".join(line for family in self._families for line in family.lines()) + "\n"
+
+    def write_textfile(self, path):
+        """Writes exposition() to `path` atomically, so a collector never reads half a file."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+
+class NullMetrics:
+    """What get_metrics() returns while metrics are off: every method does nothing."""
+
+    enabled = False
+
+    def code_done(self, status, seconds=None):
+        pass
+
+    def download_started(self):
+        pass
+
+    def download_ended(self, status, seconds):
+        pass
+
+    def add_bytes(self, n):
+        pass
+
+    def retried(self, error):
+        pass
+
+    def failed(self, phase, error):
+        pass
+
+    def counted_writes(self, f):
+        return f
+
+
+_metrics = NullMetrics()
+
+
+def get_metrics():
+    """Returns the process-wide metrics: a Metrics after enable(), otherwise a NullMetrics."""
+    return _metrics
+
+
+def enable():
+    """Starts collecting metrics, once per process, and returns the Metrics."""
+    global _metrics
+    if not _metrics.enabled:
+        _metrics = Metrics()
+    return _metrics
+
+
+def parse_listen(value):
+    """
+    Parses `[HOST:]PORT` into `(host, port)`; the host defaults to 127.0.0.1. Raises ValueError.
+
+    IPv6 addresses go in brackets ("[::1]:9100") and come back without them.
+    """
+    host, _, port = value.rpartition(':')
+    port = int(port)
+    if not 0 <= port <= 65535:
+        raise ValueError(f"port {port} is out of range")
+    return host.strip('[]') or DEFAULT_HOST, port
+
+
+def address_family(host):
+    """Returns the socket family to listen on `host` with: AF_INET6 for an IPv6 address, else AF_INET."""
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+def serve(metrics, host, port):
+    """
+    Serves `metrics` at http://host:port/metrics from a daemon thread and returns the server.
+
+    Call `shutdown()` on it to stop; it also stops with the process.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = metrics.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes would otherwise print a line to stderr every few seconds.
+            pass
+
+    family = address_family(host)
+
+    class Server(ThreadingHTTPServer):
+        address_family = family
+        daemon_threads = True
+
+    server = Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class TextfileWriter:
+    """
+    Writes `metrics` to `path` every `interval` seconds from a daemon thread.
+
+    `close()` stops it and writes the final values.
+    """
+
+    def __init__(self, metrics, path, interval=TEXTFILE_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self.metrics.write_textfile(path)
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.write_textfile(self.path)
+            except OSError:
+                # A full or vanished volume; try again next time rather than end the thread.
+                pass
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics.write_textfile(self.path)
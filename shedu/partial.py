@@ -0,0 +1,130 @@
+"""
+Bookkeeping for resumable downloads.
+
+A download is streamed into a `.part` file next to its final location and only
+renamed into place once it is complete, so an interrupted transfer never
+leaves a truncated file behind under the real name. The next attempt asks the
+server for the missing bytes with a `Range` header and appends to the
+`.part` file if the server honours it.
+
+Both the size check and resuming count the bytes as they are on disk, so file
+downloads ask for the body unencoded (IDENTITY_HEADERS). A server that
+compresses it anyway (Content-Encoding: gzip, say) sends a Content-Length and
+byte ranges of the compressed body, which say nothing about the file; such a
+body is downloaded whole and its size left unchecked.
+"""
+import hashlib
+import os
+import re
+
+PART_SUFFIX = ".part"
+# Sent with every request for a file, so Content-Length and ranges are those of the file itself.
+IDENTITY_HEADERS = {"Accept-Encoding": "identity"}
+
+
+class IncompleteDownload(ConnectionError):
+    """The body ended short of its Content-Length; retrying resumes from the .part file."""
+
+
+def part_path(download_path, url):
+    """
+    Returns the partial file used while downloading `url` into `download_path`.
+
+    The final filename is only known once the server answers, so the partial
+    file is named after the URL instead. Hashing it keeps two codes' files with
+    the same name apart when they share a folder.
+    """
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(download_path, f".shedu-{digest}{PART_SUFFIX}")
+
+
+def resume_offset(part_file):
+    """Returns how many bytes of a previous attempt are already on disk."""
+    try:
+        return os.path.getsize(part_file)
+    except OSError:
+        return 0
+
+
+def is_encoded(headers):
+    """Returns True if the body comes with a Content-Encoding, so its length isn't the file's."""
+    return headers.get('content-encoding', 'identity').strip().lower() not in ('', 'identity')
+
+
+def range_headers(offset):
+    """Returns the request headers asking for everything from `offset` on."""
+    return {"Range": f"bytes={offset}-"} if offset else {}
+
+
+def resumed_offset(status, headers, offset):
+    """
+    Returns where the response body starts in the file, given the offset asked for.
+
+    Only a 206 whose Content-Range starts exactly at `offset` continues the
+    partial file; anything else (a plain 200 from a server without range
+    support) means the body is the whole file. None means the body doesn't
+    fit the partial file (an unexpected range, or a range of an encoded
+    body) and the file has to be requested again from the start.
+    """
+    if not offset or status != 206:
+        return 0
+    if is_encoded(headers):
+        return None
+    match = re.match(r'bytes (\d+)-', headers.get('content-range', ''))
+    return offset if match and int(match.group(1)) == offset else None
+
+
+def expected_size(headers, offset):
+    """Returns the full size of the file, or 0 when the server doesn't say (or only gives an encoded length)."""
+    if is_encoded(headers):
+        return 0
+    length = int(headers.get('content-length', 0))
+    return offset + length if length else 0
+
+
+def get_resumable(session, url, part_file, headers=None, **kwargs):
+    """
+    Starts a streaming GET that continues `part_file` when possible.
+
+    Returns `(response, offset)`: the response body belongs at `offset` in the
+    file, so the caller appends to the partial file when `offset` is non-zero
+    and truncates it otherwise. `headers` are sent along with the Range header
+    and IDENTITY_HEADERS. Status errors are left to the caller.
+    """
+    headers = {**IDENTITY_HEADERS, **(headers or {})}
+    offset = resume_offset(part_file)
+    r = session.get(url, headers={**headers, **range_headers(offset)}, stream=True, **kwargs)
+    start = resumed_offset(r.status_code, r.headers, offset)
+    if offset and (r.status_code == 416 or start is None):
+        # The partial file doesn't fit what the server has now; start over.
+        r.close()
+        os.remove(part_file)
+        return session.get(url, headers=headers, stream=True, **kwargs), 0
+    return r, start
+
+
+def open_part(part_file, offset):
+    """Opens the partial file for appending at `offset`, or truncates it."""
+    return open(part_file, 'ab' if offset else 'wb')
+
+
+def check_complete(part_file, expected):
+    """
+    Raises IncompleteDownload unless `part_file` holds exactly `expected` bytes (0: size unknown).
+
+    A short file is kept so the next attempt resumes it; a longer one can't
+    be right and is removed, so the next attempt starts over.
+    """
+    if not expected:
+        return
+    size = os.path.getsize(part_file)
+    if size < expected:
+        raise IncompleteDownload(f"incomplete download: received {size} of {expected} bytes")
+    if size > expected:
+        os.remove(part_file)
+        raise IncompleteDownload(f"received {size} bytes, {size - expected} more than the expected {expected}")
+
+
+def finish(part_file, file_path):
+    """Atomically moves a completed partial file to its final name."""
+    os.replace(part_file, file_path)
@@ -0,0 +1,160 @@
+"""
+Planning a download before it starts (--plan).
+
+Every link is probed with a HEAD request, concurrently, for the size, type and
+name of the file it serves. The plan then knows which files are on disk
+already (same name and size), which the --dedup store can supply, how much
+of the rest is left in .part files, and so how many bytes the run will
+actually download, which is checked against the free space of the target
+volume before anything is written.
+"""
+import collections
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shedu import partial
+from shedu.dedup import validator_key
+from shedu.folders import response_filename
+from shedu.profiling import get_recorder
+from shedu.retry import get_policy
+
+# Free space kept in reserve on top of the planned bytes.
+SPACE_RESERVE = 64 * 1024 * 1024
+DEFAULT_TOP = 10
+
+STATUS_NEW = "new"
+STATUS_PARTIAL = "partial"
+STATUS_PRESENT = "present"
+STATUS_STORED = "stored"
+STATUS_FAILED = "failed"
+
+PlannedFile = collections.namedtuple(
+    'PlannedFile', 'code title url filename path size content_type status needed error'
+)
+PlannedFile.__doc__ = """
+One link of a plan.
+
+`path` is where the file would be saved and `size` its size in bytes (None if
+the server doesn't say). `status` is "new", "partial" (a .part file holds the
+start), "present" (on disk at that size), "stored" (the --dedup store has it)
+or "failed" (the probe failed; see `error`). `needed` is the bytes still to
+download, 0 for present and stored files.
+"""
+
+
+def probe(url):
+    """HEADs `url` and returns its response (redirects followed, status checked, retried)."""
+    # Imported here so the statuses and Plan can be used without loading requests.
+    from shedu.session import get_session
+
+    def head(url):
+        with get_recorder().span('plan.probe', url=url) as span:
+            r = get_session().head(url, headers=partial.IDENTITY_HEADERS, allow_redirects=True, timeout=20)
+            span['status'] = r.status_code
+            r.raise_for_status()
+            return r
+    return get_policy().call(head, url, idempotent=True)
+
+
+def free_space(path):
+    """Returns the free bytes on the volume `path` is (or would be) on."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+class Plan:
+    """The files of a batch and what they will cost; `add()` is thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = []
+        self.failed_codes = []
+        self.invalid_codes = []
+
+    def add(self, planned):
+        with self._lock:
+            self.files.append(planned)
+
+    def code_failed(self, code, error):
+        with self._lock:
+            self.failed_codes.append((code, error))
+
+    def count(self, *statuses):
+        return sum(1 for f in self.files if f.status in statuses)
+
+    def total_bytes(self, *statuses):
+        return sum(f.size or 0 for f in self.files if f.status in statuses)
+
+    @property
+    def needed(self):
+        """Bytes the run will download, as far as sizes are known."""
+        return sum(f.needed for f in self.files)
+
+    @property
+    def unknown_sizes(self):
+        return sum(1 for f in self.files if f.size is None and f.status != STATUS_FAILED)
+
+    def largest(self, n=DEFAULT_TOP):
+        return sorted((f for f in self.files if f.size), key=lambda f: f.size, reverse=True)[:n]
+
+    def to_download(self):
+        """The files a download run still has to fetch (or link from the store), in input order."""
+        return [f for f in self.files if f.status != STATUS_PRESENT]
+
+    def space_check(self, target):
+        """Returns `(free bytes, enough)` for downloading the plan into `target`."""
+        free = free_space(target)
+        return free, self.needed + SPACE_RESERVE <= free
+
+
+def plan_file(code, title, url, path_for, dedup=None):
+    """
+    Probes one link and returns its PlannedFile.
+
+    `path_for(code, title, filename)` returns where the file would be saved,
+    without creating anything.
+    """
+    try:
+        r = probe(url)
+    except Exception as e:
+        return PlannedFile(code, title, url, None, None, None, None, STATUS_FAILED, 0, str(e) or repr(e))
+    filename = response_filename(r.headers, r.url)
+    path = path_for(code, title, filename)
+    length = r.headers.get('content-length')
+    size = int(length) if length and length.isdigit() else None
+    content_type = r.headers.get('content-type')
+
+    if size is not None and os.path.isfile(path) and os.path.getsize(path) == size:
+        status, needed = STATUS_PRESENT, 0
+    elif dedup and dedup.lookup(validator_key(url, r.headers, size)):
+        status, needed = STATUS_STORED, 0
+    else:
+        offset = partial.resume_offset(partial.part_path(os.path.dirname(path), url))
+        status = STATUS_PARTIAL if offset else STATUS_NEW
+        needed = max(0, (size or 0) - offset)
+    return PlannedFile(code, title, url, filename, path, size, content_type, status, needed, None)
+
+
+def make_plan(resolved, path_for, workers, dedup=None):
+    """
+    Probes every link of `resolved` on `workers` threads and returns the Plan.
+
+    `resolved` yields `(code, title, links, error)` as codes are resolved;
+    probing starts while later codes are still being resolved.
+    """
+    plan = Plan()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        futures = []
+        for code, title, links, error in resolved:
+            if error is not None:
+                plan.code_failed(code, error)
+                continue
+            futures.extend(pool.submit(plan_file, code, title, url, path_for, dedup) for url in links)
+        # Kept in input order, whatever order the probes finish in.
+        for future in futures:
+            plan.add(future.result())
+    return plan
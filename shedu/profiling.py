@@ -0,0 +1,288 @@
+"""
+Per-phase timings of a run (--profile) and running it under cProfile (--cprofile).
+
+When a Recorder is enabled, the engines time every phase of every lookup and
+download as a span:
+
+* `resolve`: one code, cache and retries included;
+* `lookup.post`: one POST to access.action, with its status and `ttfb`
+  (seconds until the response headers arrived);
+* `lookup.parse`: extracting title and links from the page;
+* `download`: one file, retries included;
+* `download.ttfb`: one GET until its response headers arrived;
+* `download.transfer`: streaming the body to the .part file, and within it
+  `download.write`, every write to disk;
+* `download.finish`: checking, renaming and recording the finished file;
+* `plan.probe`: one HEAD request of --plan.
+
+Counters add what spans don't show (cache hits, attempts, bytes). The
+Recorder summarises the spans per phase and writes them as a trace in the
+Chrome Trace Event Format, which chrome://tracing, https://ui.perfetto.dev
+and speedscope load. Spans are kept per thread, or per task on the asyncio
+engine, so the trace shows each worker on a track of its own.
+
+Until enable() is called, `get_recorder()` returns a recorder that does
+nothing, and the file objects given to `timed_writes()` come back untouched.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_FILENAME = "shedu-trace.json"
+DEFAULT_TOP = 25
+
+Span = collections.namedtuple('Span', 'phase track start seconds args')
+Span.__doc__ = """
+One timed phase: `start` in seconds since the recorder was enabled, on
+`track` (a thread name, or thread and asyncio task), with its `args`.
+"""
+
+PhaseSummary = collections.namedtuple('PhaseSummary', 'phase count total mean p50 p95 max errors')
+
+
+def _track():
+    """Names what the current code runs on: its thread and, on an event loop, its task."""
+    track = threading.current_thread().name
+    asyncio = sys.modules.get('asyncio')
+    if asyncio:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            track += f" / {task.get_name()}"
+    return track
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class _SpanTimer:
+    """Context manager of Recorder.span(); the `args` dict it yields can be added to inside."""
+
+    __slots__ = ('recorder', 'phase', 'args', 'began')
+
+    def __init__(self, recorder, phase, args):
+        self.recorder = recorder
+        self.phase = phase
+        self.args = args
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.recorder.add(self.phase, self.began, time.perf_counter() - self.began, **self.args)
+        return False
+
+
+class _TimedWriter:
+    """Wraps a file so that every write() is recorded as a span."""
+
+    def __init__(self, f, recorder, phase):
+        self._f = f
+        self._recorder = recorder
+        self._phase = phase
+
+    def write(self, data):
+        began = time.perf_counter()
+        n = self._f.write(data)
+        self._recorder.add(self._phase, began, time.perf_counter() - began, bytes=len(data))
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class Recorder:
+    """Thread-safe collection of spans and counters for one run."""
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = collections.Counter()
+
+    def span(self, phase, **args):
+        """Returns a context manager timing `phase`; an exception leaving it is noted in the span's args."""
+        return _SpanTimer(self, phase, args)
+
+    def add(self, phase, began, seconds, **args):
+        """Records a span that started at `began` (a time.perf_counter() value) and took `seconds`."""
+        span = Span(phase, _track(), began - self.origin, seconds, args)
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def timed_writes(self, f, phase="download.write"):
+        """Returns `f` with each write() recorded as a `phase` span."""
+        return _TimedWriter(f, self, phase)
+
+    def elapsed(self):
+        return time.perf_counter() - self.origin
+
+    def summary(self):
+        """Returns a PhaseSummary for every phase, in the order the phases first occurred."""
+        with self._lock:
+            spans = list(self.spans)
+        phases = {}
+        for span in spans:
+            phases.setdefault(span.phase, []).append(span)
+        rows = []
+        for phase, phase_spans in phases.items():
+            seconds = sorted(span.seconds for span in phase_spans)
+            total = sum(seconds)
+            errors = sum(1 for span in phase_spans if 'error' in span.args)
+            rows.append(PhaseSummary(phase, len(seconds), total, total / len(seconds),
+                                     _percentile(seconds, 0.5), _percentile(seconds, 0.95), seconds[-1], errors))
+        return rows
+
+    def trace(self):
+        """Returns the spans and counters as a Chrome Trace Event Format object."""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        tracks = {}
+        events = []
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = tracks.setdefault(span.track, len(tracks) + 1)
+            events.append({
+                'name': span.phase, 'cat': span.phase.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': round(span.start * 1e6, 1), 'dur': round(span.seconds * 1e6, 1), 'args': span.args,
+            })
+        for track, tid in tracks.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': track}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': counters, 'elapsed': round(self.elapsed(), 6)}}
+
+    def save_trace(self, path):
+        """Writes trace() to `path` as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.trace(), f, ensure_ascii=False, default=str)
+
+    def format_summary(self):
+        """Returns the per-phase table and the counters as lines of text."""
+        lines = [f"{'phase':<18} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'errors':>6}"]
+        for row in self.summary():
+            lines.append(f"{row.phase:<18} {row.count:>7} {row.total:>9.3f} {row.mean * 1000:>9.1f} {row.p50 * 1000:>9.1f} "
+                         f"{row.p95 * 1000:>9.1f} {row.max * 1000:>9.1f} {row.errors:>6}")
+        with self._lock:
+            counters = sorted(self.counters.items())
+        if counters:
+            lines.append("  ".join(f"{name}={value}" for name, value in counters))
+        lines.append(f"wall time {self.elapsed():.3f} s; spans of one phase may overlap, so totals can exceed it")
+        return lines
+
+
+class NullRecorder:
+    """What get_recorder() returns while profiling is off: every method does nothing."""
+
+    enabled = False
+
+    def span(self, phase, **args):
+        return _NullSpan()
+
+    def add(self, phase, began, seconds, **args):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def timed_writes(self, f, phase="download.write"):
+        return f
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_recorder = NullRecorder()
+
+
+def get_recorder():
+    """Returns the process-wide recorder: a Recorder after enable(), otherwise a NullRecorder."""
+    return _recorder
+
+
+def enable():
+    """Starts recording the phases of the engines from now on into a new Recorder and returns it."""
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    """Stops recording; the Recorder returned by enable() keeps what it has."""
+    global _recorder
+    _recorder = NullRecorder()
+
+
+def profile_call(fn, path, top=DEFAULT_TOP, file=None):
+    """
+    Returns `fn()`, run under cProfile, and saves the statistics to `path` (pstats format).
+
+    Threads started meanwhile (the engine's resolve and download workers) are
+    profiled too, and the statistics of those that have finished by the time
+    `fn` returns are merged in; the engine's finish() joins its worker pools
+    before that, after Ctrl+C too. Before Python 3.12 each thread has a
+    profiler of its own, which a thread that is still running (a metrics
+    server, say) could update while it is read, so such threads are left out.
+    The `top` functions by cumulative time are printed to `file` (stderr by
+    default).
+    """
+    import cProfile
+    import pstats
+
+    profiles = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # Installed by threading.setprofile() in every new thread; replaces itself with a profiler.
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ profiles every thread from the one profiler already running.
+            return
+        with lock:
+            profiles.append((threading.current_thread(), profile))
+
+    main = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    main.enable()
+    try:
+        return fn()
+    finally:
+        main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main, stream=file or sys.stderr)
+        running = []
+        with lock:
+            for thread, profile in profiles:
+                if thread.is_alive():
+                    running.append(thread.name)
+                else:
+                    stats.add(profile)
+        stats.dump_stats(path)
+        stats.sort_stats('cumulative').print_stats(top)
+        if running:
+            print(f"Left out {len(running)} thread(s) still running: {', '.join(running)}", file=file or sys.stderr)
@@ -0,0 +1,130 @@
+"""
+Aggregate progress of concurrent downloads.
+
+Download threads only add to shared counters here; whoever displays progress
+(the GUI, once per UI tick) asks for a snapshot of the whole batch instead of
+being sent a message for every chunk of every file.
+"""
+import collections
+import re
+import threading
+import time
+
+# Throughput is averaged over this many seconds of snapshots.
+RATE_WINDOW = 5.0
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+ProgressSnapshot = collections.namedtuple(
+    'ProgressSnapshot', 'files files_done active done total known rate eta'
+)
+ProgressSnapshot.__doc__ = """
+Progress of a batch at one moment.
+
+`files` downloads were expected and `files_done` of them have finished;
+`active` holds the names of the files in flight, oldest first. `done` is the
+bytes received and `total` the expected bytes of the batch, estimated from the
+average size of the files started so far while some have yet to start; `known`
+is False while a file of unknown size is in flight. `rate` is bytes/s and `eta`
+seconds, or None when it can't be told.
+"""
+
+
+def parse_size(text):
+    """Parses sizes like 512, 256K, 2M or 1.5G (powers of 1024) into bytes; raises ValueError otherwise."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', str(text), re.I)
+    if not match:
+        raise ValueError(f"not a size: {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_bytes(n):
+    """Formats a byte count like 12.3 MiB."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n) < 1024 or unit == 'GiB':
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def format_eta(seconds):
+    """Formats a duration like 1:02:03 or 2:03, or -- when unknown."""
+    if seconds is None:
+        return "--"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressTracker:
+    """
+    Thread-safe byte counters for a batch of downloads.
+
+    Call `expect()` when a download is queued, `start()` once its size is
+    known, `advance()` as bytes arrive and `finish()` when it is over, whether
+    it succeeded or not.
+    """
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._ids = 0
+        self._active = {}
+        self._files = 0
+        self._files_done = 0
+        # Bytes of finished files.
+        self._done = 0
+        # Bytes received in this run, excluding resumed .part data, for the rate.
+        self._received = 0
+        self._samples = collections.deque()
+
+    def expect(self, count=1):
+        with self._lock:
+            self._files += count
+
+    def start(self, filename, total, offset=0, handle=None):
+        """
+        Registers a file of `total` bytes (0 if unknown) resumed at `offset` and returns its handle.
+
+        Passing the `handle` of an earlier start restarts that file's count,
+        for a transfer that reconnects.
+        """
+        with self._lock:
+            if handle is None:
+                self._ids += 1
+                handle = self._ids
+            self._active[handle] = [filename, offset, total]
+            return handle
+
+    def advance(self, handle, nbytes):
+        with self._lock:
+            self._active[handle][1] += nbytes
+            self._received += nbytes
+
+    def finish(self, handle=None):
+        """Marks a download as over; `handle` is None if it failed before `start()`."""
+        with self._lock:
+            self._files_done += 1
+            entry = self._active.pop(handle, None)
+            if entry:
+                # A failed file counts as done at the bytes it got, so the bar can still reach the end.
+                self._done += entry[1]
+
+    def snapshot(self):
+        """Returns a ProgressSnapshot of the whole batch."""
+        now = time.monotonic()
+        with self._lock:
+            active = [entry[:] for entry in self._active.values()]
+            files, files_done, finished, received = self._files, self._files_done, self._done, self._received
+            self._samples.append((now, received))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+                self._samples.popleft()
+            first_time, first_received = self._samples[0]
+
+        done = finished + sum(entry[1] for entry in active)
+        total = finished + sum(entry[2] for entry in active)
+        known = all(entry[2] for entry in active)
+        started = files_done + len(active)
+        if started and files > started:
+            total += (files - started) * total / started
+        rate = (received - first_received) / (now - first_time) if now > first_time else None
+        eta = max(total - done, 0) / rate if known and rate else None
+        return ProgressSnapshot(files, files_done, [entry[0] for entry in active], done, total, known, rate, eta)
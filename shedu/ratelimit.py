@@ -0,0 +1,222 @@
+"""
+Politeness limits for requests to each host: requests per second and bytes per second.
+
+Both are token buckets. A caller reserves what it is about to use and is told
+how long to wait first; the bucket may go into debt, so a large read simply
+makes the next one wait longer, and the average stays at the configured rate.
+
+The request rate also adapts to how the server is doing (additive increase,
+multiplicative decrease, as in TCP congestion control): a 429/5xx answer, a
+timeout or a response time well above the best one seen halves the rate, at
+most once per DECREASE_INTERVAL; every second without such signs adds
+INCREASE_PER_SECOND back, up to the configured maximum. Without a configured
+maximum the limiter starts out unlimited, and goes back to unlimited once the
+adapted rate is no longer what holds requests back.
+
+Every request goes through one process-wide limiter (`get_limiter()`): the
+shared requests session paces itself through it, and the asyncio engine and
+the streaming copy call it directly.
+"""
+import collections
+import threading
+import time
+from urllib.parse import urlsplit
+
+from shedu.retry import RETRY_STATUSES
+
+# Slowest rate the adaptation goes down to, in requests per second.
+MIN_RATE = 0.5
+DECREASE_FACTOR = 0.5
+DECREASE_INTERVAL = 1.0
+INCREASE_PER_SECOND = 1.0
+# Response times are smoothed with this weight for the newest one.
+LATENCY_ALPHA = 0.2
+# Smoothed response times this many times the best seen, and at least LATENCY_SLACK
+# seconds over it, count as a sign of an overloaded server.
+LATENCY_FACTOR = 3.0
+LATENCY_SLACK = 0.25
+# Requests started within this many seconds measure the rate actually used.
+RATE_WINDOW = 5.0
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, of which up to `burst` (one second's worth by default) can be saved up.
+
+    Not thread-safe; the RateLimiter locks around it.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def set_rate(self, rate):
+        """Changes the rate from now on, keeping the tokens already earned."""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, n=1):
+        """Takes `n` tokens and returns how many seconds to wait before using them."""
+        self._refill(time.monotonic())
+        self._tokens -= n
+        return max(0.0, -self._tokens / self.rate)
+
+
+class _Host:
+    def __init__(self, requests_per_second, bytes_per_second):
+        self.rate = requests_per_second
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.starts = collections.deque()
+        self.latency = None
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self.last_increase = time.monotonic()
+
+    def observed_rate(self, now):
+        while self.starts and self.starts[0] < now - RATE_WINDOW:
+            self.starts.popleft()
+        return len(self.starts) / RATE_WINDOW
+
+
+class RateLimiter:
+    """
+    Per-host request and byte rate limits, with the request rate adapting as described above.
+
+    A rate of 0 or None means unlimited. Thread-safe; the `*_delay` methods
+    return the seconds to wait so both threads and coroutines can use them.
+    """
+
+    def __init__(self, requests_per_second=None, bytes_per_second=None, adaptive=True):
+        self.requests_per_second = requests_per_second or None
+        self.bytes_per_second = bytes_per_second or None
+        self.adaptive = adaptive
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host(self.requests_per_second, self.bytes_per_second)
+        return state
+
+    def rate(self, host):
+        """Returns the current request rate limit for `host`, or None if it is unlimited."""
+        with self._lock:
+            return self._host(host).rate
+
+    def request_delay(self, host):
+        """Reserves one request to `host`; returns the seconds to wait before sending it."""
+        with self._lock:
+            state = self._host(host)
+            now = time.monotonic()
+            state.observed_rate(now)
+            state.starts.append(now)
+            return state.requests.reserve() if state.requests else 0.0
+
+    def byte_delay(self, host, nbytes):
+        """Accounts for `nbytes` received from `host`; returns the seconds to wait before reading on."""
+        if not self.bytes_per_second:
+            return 0.0
+        with self._lock:
+            return self._host(host).bytes.reserve(nbytes)
+
+    def wait_request(self, host, sleep=time.sleep):
+        delay = self.request_delay(host)
+        if delay:
+            sleep(delay)
+
+    def wait_bytes(self, host, nbytes, sleep=time.sleep):
+        delay = self.byte_delay(host, nbytes)
+        if delay:
+            sleep(delay)
+
+    def byte_throttle(self, url, sleep=time.sleep):
+        """Returns a copy_response() `throttle` for a transfer from `url`, or None without a bytes/s limit."""
+        if not self.bytes_per_second:
+            return None
+        host = urlsplit(url).netloc
+        return lambda nbytes: self.wait_bytes(host, nbytes, sleep)
+
+    def record(self, host, latency=None, status=None, failed=False):
+        """
+        Reports the outcome of a request to `host`.
+
+        `latency` is the time until the response headers arrived, `status`
+        the HTTP status; `failed` means no response came (timeout, refused
+        or dropped connection).
+        """
+        if not self.adaptive:
+            return
+        with self._lock:
+            state = self._host(host)
+            now = time.monotonic()
+            congested = failed or status in RETRY_STATUSES
+            if latency is not None:
+                state.latency = latency if state.latency is None else (
+                    LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * state.latency)
+                if state.best_latency is None or state.latency < state.best_latency:
+                    state.best_latency = state.latency
+                limit = max(state.best_latency * LATENCY_FACTOR, state.best_latency + LATENCY_SLACK)
+                congested = congested or state.latency > limit
+            if congested:
+                self._decrease(state, now)
+            else:
+                self._increase(state, now)
+
+    def _set_rate(self, state, rate):
+        state.rate = rate
+        if rate is None:
+            state.requests = None
+        elif state.requests is None:
+            state.requests = TokenBucket(rate)
+        else:
+            state.requests.set_rate(rate)
+
+    def _decrease(self, state, now):
+        if now - state.last_decrease < DECREASE_INTERVAL:
+            return
+        current = state.rate or max(state.observed_rate(now), MIN_RATE)
+        self._set_rate(state, max(MIN_RATE, current * DECREASE_FACTOR))
+        state.last_decrease = state.last_increase = now
+
+    def _increase(self, state, now):
+        elapsed, state.last_increase = now - state.last_increase, now
+        if state.rate is None:
+            return
+        rate = state.rate + INCREASE_PER_SECOND * min(elapsed, 1.0)
+        if self.requests_per_second:
+            rate = min(rate, self.requests_per_second)
+        elif rate > 2 * state.observed_rate(now):
+            # Requests come slower than the limit would allow: it no longer does anything.
+            rate = None
+        self._set_rate(state, rate)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Returns the process-wide RateLimiter, unlimited but adaptive until configured."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+def configure(**kwargs):
+    """Replaces the process-wide limiter with `RateLimiter(**kwargs)` and returns it."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = RateLimiter(**kwargs)
+        return _limiter
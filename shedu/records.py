@@ -0,0 +1,58 @@
+"""
+Machine-readable results for --format jsonl.
+
+Every code produces one JSON object on its own line, written and flushed as
+soon as the code is resolved, so the next stage of a pipeline can consume
+results while the batch is still running:
+
+    {"code": "12345678", "status": "ok", "title": "...", "links": ["https://..."],
+     "error": null, "timings": {"resolve": 0.214}}
+
+`status` is "ok", "no_links" (the page had no .shtml links), "error" (the
+request failed; see `error`) or "invalid" (not an 8-digit code). `title` is
+null when the page has none.
+"""
+import json
+import sys
+import threading
+
+STATUS_OK = "ok"
+STATUS_NO_LINKS = "no_links"
+STATUS_ERROR = "error"
+STATUS_INVALID = "invalid"
+
+
+def code_record(code, status, title=None, links=(), error=None, resolve_seconds=None):
+    """Returns the record for one code."""
+    return {
+        "code": code,
+        "status": status,
+        "title": title,
+        "links": list(links),
+        "error": error,
+        "timings": {"resolve": None if resolve_seconds is None else round(resolve_seconds, 4)},
+    }
+
+
+def resolved_record(code, title, links, resolve_seconds):
+    """Returns the record for a code that resolved, with or without links."""
+    return code_record(code, STATUS_OK if links else STATUS_NO_LINKS, title, links, resolve_seconds=resolve_seconds)
+
+
+class JsonlWriter:
+    """
+    Writes records as UTF-8 JSON Lines, one flushed line per record.
+
+    Safe to share between threads; lines are never interleaved.
+    """
+
+    def __init__(self, stream=None):
+        # Written as bytes so titles come out as UTF-8 whatever the console encoding is.
+        self._stream = stream or sys.stdout.buffer
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            self._stream.write(line)
+            self._stream.flush()
@@ -0,0 +1,271 @@
+"""
+Retries with exponential backoff and a per-host circuit breaker.
+
+Every request the tools make goes through one process-wide RetryPolicy
+(`get_policy()`, like `session.get_session()`):
+
+* only operations declared idempotent are retried: GET and HEAD, and the
+  access.action POST, which only looks a code up;
+* only failures that may go away are retried: connection errors, timeouts,
+  truncated bodies and 408/425/429/5xx responses;
+* the delay before attempt n is drawn uniformly from [0, base * 2**n] ("full
+  jitter", capped at `max_delay`), so clients that failed together don't
+  come back together; a Retry-After header from the server is a lower bound;
+* after `threshold` failures in a row from one host, its circuit opens: no
+  request goes to that host for `cooldown` seconds, then a single trial
+  request decides whether it closes again or stays open for another cooldown.
+"""
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from shedu.metrics import get_metrics
+
+DEFAULT_ATTEMPTS = 4
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+# Longer Retry-After values are capped rather than obeyed.
+MAX_RETRY_AFTER = 300.0
+RETRY_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+# How often callers waiting on another caller's trial request look again.
+_TRIAL_POLL = 0.2
+
+
+def parse_retry_after(value):
+    """Returns the seconds a Retry-After header asks for (delta or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    # Only HTTP dates need email.utils, which is slow to import.
+    import email.utils
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _status_and_headers(exc):
+    # requests' HTTPError carries the response; aiohttp's ClientResponseError the status and headers.
+    response = getattr(exc, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code, response.headers
+    status = getattr(exc, 'status', None)
+    if isinstance(status, int):
+        return status, getattr(exc, 'headers', None) or {}
+    return None, {}
+
+
+def classify(exc):
+    """
+    Returns `(retryable, retry_after)` for an exception raised by a request.
+
+    Network failures and retryable statuses are retryable; anything else (a
+    404, a disk error, a cancelled job) is raised at once.
+    """
+    status, headers = _status_and_headers(exc)
+    if status is not None:
+        return status in RETRY_STATUSES, parse_retry_after(headers.get('Retry-After'))
+    # Only a library that is loaded already can have raised `exc`; none is imported just to check.
+    requests = sys.modules.get('requests')
+    if requests and isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                     requests.exceptions.ChunkedEncodingError)):
+        return True, None
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp and isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True, None
+    asyncio = sys.modules.get('asyncio')
+    timeouts = (asyncio.TimeoutError,) if asyncio else ()
+    return isinstance(exc, timeouts + (ConnectionError, TimeoutError)), None
+
+
+class CircuitBreaker:
+    """
+    Per-host failure counter that stops requests to a host that keeps failing.
+
+    Thread-safe. `acquire(host)` says how long a caller must hold off; the
+    caller reports the outcome with `success(host)` or `failure(host)`. A
+    caller let through as the trial request calls `release(host)` when it is
+    done in any case, so a trial that never heard from the host (paused,
+    cancelled, a local error) hands the trial to the next caller.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        # host -> [consecutive failures, time the circuit opened or None, trial in flight]
+        self._hosts = {}
+
+    def is_open(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            return bool(state and state[1] is not None)
+
+    def acquire(self, host):
+        """
+        Returns `(wait, trial)`: `wait` is 0 if a request to `host` may go ahead
+        now, else the seconds to wait before asking again.
+
+        Once the cooldown is over, the first caller to ask is let through as
+        the trial request (`trial` is True) and the others keep waiting for
+        its outcome.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if not state or state[1] is None:
+                return 0, False
+            remaining = state[1] + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return remaining, False
+            if state[2]:
+                return _TRIAL_POLL, False
+            state[2] = True
+            return 0, True
+
+    def release(self, host):
+        """Ends a trial request; if it reported no outcome, the next caller becomes the trial."""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state:
+                state[2] = False
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, None, False])
+            state[0] += 1
+            if state[2] or state[0] >= self.threshold:
+                state[1] = time.monotonic()
+                state[2] = False
+
+
+class RetryPolicy:
+    """
+    Calls a request function, retrying it as described in the module docstring.
+
+    `on_retry(url, attempt, delay, exc)` is called before every retry, with
+    the number of the attempt that failed.
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY, breaker=None, on_retry=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.on_retry = on_retry
+
+    def backoff(self, attempt, retry_after=None):
+        """Returns the delay after failed attempt number `attempt` (counted from 1)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+        return delay
+
+    def _failed(self, host, url, attempt, attempts, exc):
+        """Records a failure; returns the delay before the next attempt or None to give up."""
+        retryable, retry_after = classify(exc)
+        if not retryable:
+            # The server answered (a 404, say): the host is fine. A local problem or a paused or
+            # cancelled job says nothing about the host; the caller's release() frees its trial.
+            if _status_and_headers(exc)[0] is not None:
+                self.breaker.success(host)
+            return None
+        self.breaker.failure(host)
+        if attempt >= attempts:
+            return None
+        delay = self.backoff(attempt, retry_after)
+        get_metrics().retried(exc)
+        if self.on_retry:
+            self.on_retry(url, attempt, delay, exc)
+        return delay
+
+    def call(self, fn, url, *args, idempotent=False, sleep=time.sleep, **kwargs):
+        """
+        Returns `fn(url, *args, **kwargs)`, retrying it if `idempotent`.
+
+        The last exception is raised once the attempts are used up. Calls to
+        a host whose circuit is open wait for it first. Waits go through
+        `sleep`, which a job can replace with one that notices cancellation.
+        """
+        host = urlsplit(url).netloc
+        attempts = self.attempts if idempotent else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            wait, trial = self.breaker.acquire(host)
+            while wait:
+                sleep(wait)
+                wait, trial = self.breaker.acquire(host)
+            try:
+                result = fn(url, *args, **kwargs)
+            except Exception as e:
+                delay = self._failed(host, url, attempt, attempts, e)
+                if delay is None:
+                    raise
+            else:
+                self.breaker.success(host)
+                return result
+            finally:
+                if trial:
+                    self.breaker.release(host)
+            sleep(delay)
+
+    async def call_async(self, fn, url, *args, idempotent=False, **kwargs):
+        """call() for coroutine functions; waits with asyncio.sleep."""
+        # Imported here: only the async engine calls this, and loading asyncio isn't free.
+        import asyncio
+        host = urlsplit(url).netloc
+        attempts = self.attempts if idempotent else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            wait, trial = self.breaker.acquire(host)
+            while wait:
+                await asyncio.sleep(wait)
+                wait, trial = self.breaker.acquire(host)
+            try:
+                result = await fn(url, *args, **kwargs)
+            except Exception as e:
+                delay = self._failed(host, url, attempt, attempts, e)
+                if delay is None:
+                    raise
+            else:
+                self.breaker.success(host)
+                return result
+            finally:
+                if trial:
+                    self.breaker.release(host)
+            await asyncio.sleep(delay)
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_policy():
+    """Returns the process-wide RetryPolicy, creating it with the defaults on first use."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = RetryPolicy()
+        return _policy
+
+
+def configure(**kwargs):
+    """Replaces the process-wide policy with `RetryPolicy(**kwargs)` and returns it."""
+    global _policy
+    with _policy_lock:
+        _policy = RetryPolicy(**kwargs)
+        return _policy
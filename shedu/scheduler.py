@@ -0,0 +1,83 @@
+"""Download scheduling with a global and a per-host concurrency limit."""
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+DEFAULT_MAX_DOWNLOADS = 4
+DEFAULT_PER_HOST = 4
+
+
+class DownloadScheduler:
+    """
+    Runs download jobs on a shared worker pool.
+
+    At most `max_workers` jobs run at once overall and at most `per_host` of them
+    talk to the same host. Jobs over the per-host cap wait in a per-host queue
+    instead of occupying a worker, so one busy host never blocks the others.
+    Jobs can be submitted from any thread while earlier ones are still running.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_DOWNLOADS, per_host=DEFAULT_PER_HOST):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+        self._per_host = per_host
+        # Reentrant, as cancel_pending() may run in a signal handler on a thread that holds it.
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._active = {}
+        # Jobs that haven't finished; finished ones are dropped so long runs don't accumulate them.
+        self._futures = set()
+
+    def submit(self, fn, url, *args, **kwargs):
+        """Queues `fn(url, *args, **kwargs)` and returns a Future for its result."""
+        host = urlsplit(url).netloc
+        future = Future()
+        with self._lock:
+            self._futures.add(future)
+            self._pending.setdefault(host, deque()).append((future, fn, url, args, kwargs))
+            self._dispatch(host)
+        return future
+
+    def _dispatch(self, host):
+        # Must be called with self._lock held.
+        pending = self._pending[host]
+        while pending and self._active.get(host, 0) < self._per_host:
+            job = pending.popleft()
+            self._active[host] = self._active.get(host, 0) + 1
+            self._pool.submit(self._run, host, *job)
+
+    def _run(self, host, future, fn, url, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(url, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+                self._active[host] -= 1
+                self._dispatch(host)
+
+    def cancel_pending(self):
+        """Cancels every job that hasn't started yet; running jobs are left to finish."""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def join(self):
+        """Waits for every submitted job, then shuts the worker pool down."""
+        while True:
+            with self._lock:
+                outstanding = [f for f in self._futures if not f.done()]
+            if not outstanding:
+                break
+            wait(outstanding)
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.join()
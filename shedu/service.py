@@ -0,0 +1,266 @@
+"""
+The mirror service behind `serve`: one long-lived Engine working through a JobQueue.
+
+A one-shot run pays for starting the interpreter, connecting and warming the
+lookup cache every time. The service keeps all of that for its lifetime: one
+HTTP session with its connection pool, the lookup cache, the manifest, the
+rate limiter and the circuit breakers serve every job. Codes are taken from
+the queue as they are submitted, resolved and downloaded like a --sync run
+(unchanged files are skipped), and each job is marked done or failed once
+its last download has ended.
+
+Jobs are submitted with `submit`, which writes to the queue database, or
+through the local socket served by serve_socket(): a TCP connection that
+takes one JSON object per line and answers each with one line:
+
+    {"submit": ["12345678", ...]}  ->  {"queued": 1, "pending": 0, "invalid": []}
+    {"status": true}               ->  {"counts": {"queued": 0, "running": 1, ...}}
+
+At most `window` jobs (the number of codes resolved at a time) are running
+at once; the next job is only claimed from the queue once one of them is
+over, so the queue's counts show what is actually being worked on.
+
+Stopping the service (JobControl.cancel()) stops the transfers at their next
+chunk and keeps their .part files; the jobs they belonged to stay running in
+the queue and are resumed when the service starts again.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from shedu.events import Events
+from shedu.failures import FailureLog, describe_error
+from shedu.metrics import address_family
+
+# How often the queue database is checked for jobs submitted by other processes.
+POLL_INTERVAL = 1.0
+# How often the manifest and dedup store are saved while the service runs.
+SAVE_INTERVAL = 30.0
+
+
+class _RunningJob:
+    __slots__ = ('job', 'pending', 'files', 'failed', 'began')
+
+    def __init__(self, job):
+        self.job = job
+        self.pending = 0
+        self.files = 0
+        self.failed = 0
+        self.began = time.monotonic()
+
+
+class JobTracker(Events):
+    """
+    Events that close every queued job once all of its downloads have ended.
+
+    The outcome is written to `queue` and described through `log(message)`,
+    from whichever thread reports it. Nothing is closed once `control` is
+    cancelled: downloads ending then were cut off and resume after a restart.
+    Up to `window` jobs run at a time (see reserve()). The Engine records its
+    failures in `failures`, which drops a job's failures once it is closed.
+    """
+
+    def __init__(self, queue, control, log=print, window=1):
+        self.queue = queue
+        self.control = control
+        self.log = log
+        self.failures = FailureLog()
+        self._slots = threading.Semaphore(window)
+        self._lock = threading.Lock()
+        self._running = {}
+        self._urls = {}
+
+    def reserve(self, timeout):
+        """
+        Waits up to `timeout` seconds for fewer than `window` jobs to be running; returns True if so.
+
+        The slot is the caller's to fill with started() or hand back with release().
+        """
+        return self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        self._slots.release()
+
+    def started(self, job):
+        """Registers a job claimed from the queue, before its code reaches the engine."""
+        with self._lock:
+            self._running[job.code] = _RunningJob(job)
+        attempt = f" (attempt {job.attempts})" if job.attempts > 1 else ""
+        self.log(f"job {job.id}: {job.code} started{attempt}")
+
+    def _close(self, code, error=None):
+        with self._lock:
+            running = self._running.pop(code, None)
+        if running is None:
+            return
+        self.failures.discard(code)
+        job, seconds = running.job, time.monotonic() - running.began
+        if not self.queue.finish(job.id, running.files, running.failed, error):
+            self.log(f"job {job.id}: {code} could not be recorded as finished; it runs again after a restart")
+        elif error:
+            self.log(f"job {job.id}: {code} failed after {seconds:.1f}s: {error}")
+        elif running.failed:
+            self.log(f"job {job.id}: {code} failed after {seconds:.1f}s: {running.failed} of {running.files} file(s) failed")
+        else:
+            self.log(f"job {job.id}: {code} done in {seconds:.1f}s, {running.files} file(s)")
+        # Only now, so the next job is claimed after this one is recorded as over.
+        self.release()
+
+    def code_invalid(self, code):
+        self._close(code, "not an 8-digit code")
+
+    def code_failed(self, code, error, seconds):
+        self._close(code, describe_error(error))
+
+    def code_resolved(self, code, title, links, seconds):
+        if not links:
+            self._close(code, "no files found")
+            return
+        with self._lock:
+            running = self._running.get(code)
+            if running:
+                running.pending = running.files = len(links)
+        self.log(f"{code}: {title or '(no title)'}, {len(links)} file(s)")
+
+    def download_queued(self, url, code, title):
+        with self._lock:
+            # A URL shared by two running codes is queued once for each of them.
+            self._urls.setdefault(url, []).append(code)
+
+    def download_failed(self, code, title, url, error):
+        self._file_failed(code, url, error)
+
+    def file_error(self, code, title, url, error):
+        self._file_failed(code, url, error)
+
+    def _file_failed(self, code, url, error):
+        with self._lock:
+            running = self._running.get(code)
+            if running:
+                running.failed += 1
+        self.log(f"{code}: {url} failed: {describe_error(error)}")
+
+    def download_ended(self, url, progress):
+        if self.control.cancelled:
+            return
+        with self._lock:
+            codes = self._urls.get(url)
+            code = codes.pop(0) if codes else None
+            if codes == []:
+                del self._urls[url]
+            running = self._running.get(code)
+            if running is None:
+                return
+            running.pending -= 1
+            last = running.pending == 0
+        if last:
+            self._close(code)
+
+
+def queued_codes(queue, tracker, control, save=None):
+    """
+    Yields the codes of the queued jobs as they are claimed, until `control` is cancelled.
+
+    A job is only claimed once `tracker` has a free slot, and the generator
+    waits for new jobs while the queue is empty. `save()` is called every
+    SAVE_INTERVAL seconds meanwhile, to write out the manifest and dedup store.
+    """
+    last_save = time.monotonic()
+    while not control.cancelled:
+        if save and time.monotonic() - last_save >= SAVE_INTERVAL:
+            save()
+            last_save = time.monotonic()
+        if not tracker.reserve(POLL_INTERVAL):
+            continue
+        job = queue.claim()
+        if job is None:
+            tracker.release()
+            queue.wait(POLL_INTERVAL)
+            continue
+        tracker.started(job)
+        yield job.code
+
+
+def run_service(engine, queue, tracker, control):
+    """
+    Works through `queue` with `engine` until `control` is cancelled.
+
+    The engine reports to `tracker` and records its failures in
+    `tracker.failures`. Jobs a previous service left running are queued again first. Returns
+    once the downloads in flight have stopped and the manifest is saved.
+    """
+    requeued = queue.requeue_interrupted()
+    if requeued:
+        tracker.log(f"{requeued} job(s) interrupted by the last shutdown were queued again")
+
+    def save():
+        if engine.manifest:
+            engine.manifest.save()
+        if engine.dedup:
+            engine.dedup.save()
+
+    engine.run(queued_codes(queue, tracker, control, save), download=True)
+    engine.finish()
+
+
+def handle_request(queue, request):
+    """Answers one request of the socket protocol; returns the reply object."""
+    if not isinstance(request, dict):
+        return {'error': "expected a JSON object"}
+    if 'submit' in request:
+        codes = request['submit']
+        if isinstance(codes, str):
+            codes = [codes]
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            return {'error': "'submit' takes a list of codes"}
+        return queue.submit(codes)
+    if request.get('status'):
+        return {'counts': queue.counts()}
+    return {'error': "expected 'submit' or 'status'"}
+
+
+def serve_socket(queue, host, port):
+    """
+    Accepts requests for `queue` on host:port from a daemon thread and returns the server.
+
+    Anyone who can connect can submit jobs, so keep it on a loopback address.
+    """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    reply = handle_request(queue, json.loads(line))
+                except ValueError as e:
+                    reply = {'error': f"invalid JSON: {e}"}
+                except sqlite3.Error as e:
+                    reply = {'error': f"queue database: {e}"}
+                self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode('utf-8'))
+
+    family = address_family(host)
+
+    class Server(socketserver.ThreadingTCPServer):
+        address_family = family
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="service-socket", daemon=True).start()
+    return server
+
+
+def send_request(host, port, request, timeout=10):
+    """Sends one request to a running service and returns its reply. Raises OSError or ValueError."""
+    import socket
+
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        with connection.makefile('rb') as replies:
+            line = replies.readline()
+    if not line:
+        raise ConnectionError("the service closed the connection without replying")
+    return json.loads(line)
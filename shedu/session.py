@@ -0,0 +1,78 @@
+"""A shared, pooled HTTP session for all requests to the bookmall host."""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shedu.ratelimit import get_limiter
+
+# SHEDU_BASE_URL points every front end at a local stand-in server for testing.
+BASE_URL = os.environ.get("SHEDU_BASE_URL", "https://mp3.bookmall.com.cn")
+# Mimic IE 11 on Windows 8.1, as the site has always been queried this way.
+USER_AGENT = "Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; rv:11.0) like Gecko"
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_session = None
+_pool_size = 0
+
+
+class LimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that paces every request through the process-wide RateLimiter.
+
+    It also reports each outcome, with the time until the response headers
+    arrived, so the limiter can adapt to the server.
+    """
+
+    def send(self, request, **kwargs):
+        limiter = get_limiter()
+        host = urlsplit(request.url).netloc
+        limiter.wait_request(host)
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            limiter.record(host, failed=True)
+            raise
+        limiter.record(host, response.elapsed.total_seconds(), response.status_code)
+        return response
+
+
+def _mount(session, pool_size):
+    adapter = LimitedAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def get_session(pool_size=None):
+    """
+    Returns the process-wide session, creating it on first use.
+
+    The session keeps connections alive between requests so resolving codes and
+    downloading files reuse the same TCP/TLS connections. urllib3's connection
+    pool is thread-safe, so one session is shared by every worker thread.
+    `pool_size` should be at least the number of threads using the session;
+    passing a larger value than before grows the pool.
+    """
+    global _session, _pool_size
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers["User-Agent"] = USER_AGENT
+        if pool_size > _pool_size:
+            _mount(_session, pool_size)
+            _pool_size = pool_size
+        return _session
+
+
+def close_session():
+    """Closes the shared session and its pooled connections."""
+    global _session, _pool_size
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _pool_size = 0
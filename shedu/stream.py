@@ -0,0 +1,153 @@
+"""
+Streaming of response bodies to disk.
+
+`iter_content(8192)` costs a Python-level write, digest update and progress
+report for every 8 KiB, which adds up on files of hundreds of megabytes. This
+module reads the body into one reusable buffer instead, sizing each read to
+what the connection delivers in about a tenth of a second (so slow links still
+report progress promptly and fast ones use a few large reads), and only passes
+progress on a few times per second.
+"""
+import threading
+import time
+
+from requests import exceptions
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+
+from shedu.partial import is_encoded
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# Aim for reads that take about this long at the measured throughput.
+TARGET_READ_SECONDS = 0.1
+PROGRESS_INTERVAL = 0.1
+
+_buffers = threading.local()
+
+
+def _buffer(size):
+    """Returns this thread's read buffer, grown to at least `size` bytes."""
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _buffers.buffer = bytearray(size)
+    return memoryview(buffer)
+
+
+class ChunkSizer:
+    """Picks the next read size from the throughput of the previous reads."""
+
+    def __init__(self, minimum=MIN_CHUNK_SIZE, maximum=MAX_CHUNK_SIZE, target=TARGET_READ_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.size = minimum
+
+    def update(self, nbytes, seconds):
+        """Records a read of `nbytes` that took `seconds` and returns the next size."""
+        if nbytes < self.size:
+            # A short read is the end of the body or a stall; neither says much about speed.
+            return self.size
+        rate = nbytes / max(seconds, 1e-6)
+        wanted = rate * self.target
+        # Move by at most a factor of two per read so one odd read can't swing it.
+        if wanted > self.size * 2:
+            self.size = min(self.size * 2, self.maximum)
+        elif wanted < self.size / 2:
+            self.size = max(self.size // 2, self.minimum)
+        return self.size
+
+
+class ThrottledProgress:
+    """
+    Collects byte counts and passes them to `callback(n)` at most every `interval` seconds.
+
+    Call `flush()` once the transfer is over to report the remainder.
+    """
+
+    def __init__(self, callback, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.pending = 0
+        self._due = time.monotonic() + interval
+
+    def __call__(self, nbytes):
+        self.pending += nbytes
+        now = time.monotonic()
+        if now >= self._due:
+            self._due = now + self.interval
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            pending, self.pending = self.pending, 0
+            self.callback(pending)
+
+
+def _readinto(raw):
+    """Returns `raw.readinto` raising the same requests exceptions as iter_content."""
+    def readinto(view):
+        try:
+            return raw.readinto(view)
+        except ProtocolError as e:
+            raise exceptions.ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise exceptions.ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise exceptions.ConnectionError(e)
+    return readinto
+
+
+def copy_response(r, f, progress=None, digest=None, interval=PROGRESS_INTERVAL, checkpoint=None, throttle=None):
+    """
+    Writes the body of a streaming requests response to the file `f`.
+
+    `progress(n)` is called with the bytes written since its previous call, at
+    most every `interval` seconds and once at the end; `digest` is a hashlib
+    object updated with the body. `checkpoint()` is called before every read
+    and may raise to abandon the transfer (see shedu.jobs). `throttle(n)` is
+    called after every read and may sleep to hold a bytes/s limit (see
+    shedu.ratelimit). Returns the number of bytes written.
+    """
+    report = ThrottledProgress(progress, interval) if progress else None
+    sizer = ChunkSizer()
+    written = 0
+    try:
+        if is_encoded(r.headers):
+            # Compressed bodies come out of urllib3 in sizes of its choosing; let requests decode them.
+            for chunk in r.iter_content(MIN_CHUNK_SIZE):
+                if checkpoint:
+                    checkpoint()
+                f.write(chunk)
+                if digest:
+                    digest.update(chunk)
+                if report:
+                    report(len(chunk))
+                if throttle:
+                    throttle(len(chunk))
+                written += len(chunk)
+        else:
+            readinto = _readinto(r.raw)
+            size = sizer.size
+            while True:
+                if checkpoint:
+                    checkpoint()
+                view = _buffer(size)[:size]
+                began = time.monotonic()
+                n = readinto(view)
+                if not n:
+                    break
+                data = view[:n]
+                f.write(data)
+                if digest:
+                    digest.update(data)
+                if report:
+                    report(n)
+                written += n
+                size = sizer.update(n, time.monotonic() - began)
+                if throttle:
+                    throttle(n)
+    finally:
+        # Bytes already written are reported even when a checkpoint stops the transfer.
+        if report:
+            report.flush()
+    return written
@@ -0,0 +1,95 @@
+"""
+Checking a download tree against its manifest (the `verify` command).
+
+Every file the manifest lists is read back and its size and SHA-256 compared
+with what was recorded while it was downloaded. Files are hashed on a thread
+pool: hashlib and file reads release the GIL, so the threads run on separate
+cores. Each file is read in large blocks into one reused buffer, which keeps
+the number of system calls and the memory use low even for big files.
+"""
+import collections
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from shedu.dedup import STORE_DIR
+from shedu.manifest import MANIFEST_NAME
+from shedu.partial import PART_SUFFIX
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+STATUS_OK = "ok"
+STATUS_MISSING = "missing"
+STATUS_SIZE = "size"
+STATUS_CHECKSUM = "checksum"
+STATUS_UNREADABLE = "unreadable"
+
+VerifyResult = collections.namedtuple('VerifyResult', 'url path status detail')
+VerifyResult.__doc__ = """
+The outcome for one manifest entry: `status` is "ok", "missing", "size",
+"checksum" or "unreadable", with a human-readable `detail` for the others.
+"""
+
+
+def hash_file(path, block_size=HASH_BLOCK_SIZE, progress=None):
+    """Returns the SHA-256 hex digest of a file; `progress(n)` is told about every block read."""
+    digest = hashlib.sha256()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            if progress:
+                progress(n)
+    return digest.hexdigest()
+
+
+def verify_entry(base_dir, url, entry, progress=None):
+    """Checks the file of one manifest entry and returns its VerifyResult."""
+    path = os.path.join(base_dir, entry['path'])
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return VerifyResult(url, path, STATUS_MISSING, "file not found")
+    if size != entry['size']:
+        if progress:
+            progress(entry['size'])
+        return VerifyResult(url, path, STATUS_SIZE, f"{size} bytes, expected {entry['size']}")
+    try:
+        sha256 = hash_file(path, progress=progress)
+    except OSError as e:
+        return VerifyResult(url, path, STATUS_UNREADABLE, str(e))
+    if entry.get('sha256') and sha256 != entry['sha256']:
+        return VerifyResult(url, path, STATUS_CHECKSUM, f"SHA-256 {sha256}, expected {entry['sha256']}")
+    return VerifyResult(url, path, STATUS_OK, None)
+
+
+def verify_manifest(manifest, workers=None, progress=None):
+    """
+    Verifies every entry of a Manifest on `workers` threads (one per core by default).
+
+    Returns the VerifyResults in manifest order. `progress(n)` is called with
+    the bytes checked, from the worker threads.
+    """
+    entries = manifest.entries()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="verify") as pool:
+        futures = [pool.submit(verify_entry, manifest.base_dir, url, entry, progress) for url, entry in entries.items()]
+        return [future.result() for future in futures]
+
+
+def untracked_files(manifest):
+    """Returns the files under the manifest's directory that it doesn't list, skipping the tools' own files."""
+    tracked = {os.path.normcase(os.path.normpath(entry['path'])) for entry in manifest.entries().values()}
+    untracked = []
+    for root, dirs, files in os.walk(manifest.base_dir):
+        dirs[:] = [d for d in dirs if d != STORE_DIR]
+        for name in files:
+            if name == MANIFEST_NAME or name.endswith(PART_SUFFIX) or name.startswith('.shedu-') or name.startswith('shedu-'):
+                continue
+            path = os.path.relpath(os.path.join(root, name), manifest.base_dir)
+            if os.path.normcase(os.path.normpath(path)) not in tracked:
+                untracked.append(path)
+    return untracked
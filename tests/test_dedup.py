@@ -0,0 +1,28 @@
+from shedu.dedup import DedupStore, link_file, validator_key
+
+HEADERS = {'etag': '"5f3a1c2e-32000"'}
+
+
+def test_same_etag_at_other_url_is_not_linked(tmp_path):
+    store = DedupStore(str(tmp_path))
+    track = tmp_path / "001.mp3"
+    track.write_bytes(b"first track")
+    key = validator_key("http://Mirror.example/resource/1/001.mp3#top", HEADERS, 11)
+    store.add(str(track), "a" * 64, key)
+
+    assert store.lookup(validator_key("http://mirror.example/resource/1/001.mp3", HEADERS, 11))
+    # Uploaded together with the first, so nginx gives it the same mtime-size ETag.
+    assert store.lookup(validator_key("http://mirror.example/resource/1/002.mp3", HEADERS, 11)) is None
+
+
+def test_weak_etag_has_no_key():
+    assert validator_key("http://mirror.example/a.mp3", {'etag': 'W/"1"'}, 10) is None
+
+
+def test_linking_again_leaves_no_temporary_file(tmp_path):
+    src, dst = tmp_path / "object", tmp_path / "001.mp3"
+    src.write_bytes(b"track")
+    assert link_file(str(src), str(dst)) == "hardlink"
+    assert link_file(str(src), str(dst)) == "hardlink"
+    assert dst.read_bytes() == b"track"
+    assert not list(tmp_path.glob("*.shedu-link"))
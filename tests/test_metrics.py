@@ -0,0 +1,19 @@
+import urllib.request
+
+import pytest
+
+from shedu import metrics
+
+
+@pytest.mark.parametrize("listen", ["[::1]:0", "127.0.0.1:0"])
+def test_serves_on_ipv4_and_ipv6(listen):
+    host, port = metrics.parse_listen(listen)
+    server = metrics.serve(metrics.Metrics(), host, port)
+    try:
+        port = server.server_address[1]
+        url_host = f"[{host}]" if ':' in host else host
+        with urllib.request.urlopen(f"http://{url_host}:{port}/metrics", timeout=5) as r:
+            assert b"shedu_codes_total" in r.read()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,63 @@
+import gzip
+import http.server
+import os
+import threading
+
+import pytest
+
+from shedu import partial
+
+CONTENT = bytes(range(256)) * 400
+ENCODED = gzip.compress(CONTENT)
+
+
+class GzipHandler(http.server.BaseHTTPRequestHandler):
+    """Always answers gzip-encoded, whatever Accept-Encoding says; ranges are of the encoded body."""
+
+    def do_GET(self):
+        body, status = ENCODED, 200
+        requested = self.headers.get('Range')
+        if requested:
+            start = int(requested.split('=')[1].rstrip('-'))
+            body, status = ENCODED[start:], 206
+        self.send_response(status)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{len(ENCODED) - 1}/{len(ENCODED)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gzip_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/resource/1/001.mp3"
+    server.shutdown()
+    server.server_close()
+
+
+def test_encoded_body_has_no_expected_size():
+    assert partial.expected_size({'content-length': '100', 'content-encoding': 'gzip'}, 0) == 0
+    assert partial.expected_size({'content-length': '100', 'content-encoding': 'identity'}, 50) == 150
+    assert partial.resumed_offset(206, {'content-range': 'bytes 50-99/100', 'content-encoding': 'gzip'}, 50) is None
+
+
+@pytest.mark.parametrize("resume", [False, True])
+def test_gzip_encoded_download(tmp_path, gzip_url, resume):
+    from shedu.engine import Engine
+
+    engine = Engine(str(tmp_path))
+    if resume:
+        # A decoded start of the file from an earlier attempt; the server's ranges are of the gzip body.
+        with open(partial.part_path(str(tmp_path), gzip_url), 'wb') as f:
+            f.write(CONTENT[:1000])
+    path = engine.download(gzip_url, "12345678", "Title")
+    assert path is not None, engine.failures.counts()
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(partial.PART_SUFFIX)]
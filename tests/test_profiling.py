@@ -0,0 +1,40 @@
+import io
+import pstats
+import sys
+import threading
+
+import pytest
+
+from shedu import profiling
+
+
+def finished_work():
+    return sum(range(1000))
+
+
+def still_running(release):
+    release.wait(5)
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="one profiler covers every thread from Python 3.12")
+def test_only_finished_threads_are_merged(tmp_path):
+    release = threading.Event()
+    server = threading.Thread(target=still_running, args=(release,), name="server")
+
+    def run():
+        worker = threading.Thread(target=finished_work, name="worker")
+        worker.start()
+        worker.join()
+        server.start()
+
+    output = io.StringIO()
+    try:
+        profiling.profile_call(run, str(tmp_path / "run.prof"), file=output)
+    finally:
+        release.set()
+        server.join()
+
+    functions = {name for _, _, name in pstats.Stats(str(tmp_path / "run.prof")).stats}
+    assert "finished_work" in functions
+    assert "still_running" not in functions
+    assert "Left out 1 thread(s) still running: server" in output.getvalue()
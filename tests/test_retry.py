@@ -0,0 +1,49 @@
+import pytest
+import requests
+
+from shedu.jobs import Cancelled, Paused
+from shedu.retry import CircuitBreaker, RetryPolicy
+
+URL = "http://mirror.example/resource/1.mp3"
+HOST = "mirror.example"
+
+
+def open_breaker():
+    # A cooldown of 0 lets the next caller through as the trial right away.
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.failure(HOST)
+    return breaker
+
+
+def no_sleep(seconds):
+    raise AssertionError(f"waited {seconds}s for a host whose trial is over")
+
+
+@pytest.mark.parametrize("error", [Paused(), Cancelled(), OSError("disk full"), requests.exceptions.InvalidURL("bad")])
+def test_trial_without_outcome_hands_over(error):
+    breaker = open_breaker()
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+
+    def trial(url):
+        assert breaker.acquire(HOST) == (pytest.approx(0.2), False)
+        raise error
+
+    with pytest.raises(type(error)):
+        policy.call(trial, URL, idempotent=True, sleep=no_sleep)
+    assert policy.call(lambda url: "ok", URL, idempotent=True, sleep=no_sleep) == "ok"
+    assert not breaker.is_open(HOST)
+
+
+def test_failed_trial_reopens():
+    breaker = open_breaker()
+    breaker.cooldown = 60
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+    breaker._hosts[HOST][1] -= 60
+
+    def trial(url):
+        raise requests.exceptions.ConnectionError("refused")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        policy.call(trial, URL, idempotent=True, sleep=no_sleep)
+    wait, trial_slot = breaker.acquire(HOST)
+    assert wait > 59 and not trial_slot
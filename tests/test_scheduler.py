@@ -0,0 +1,25 @@
+import threading
+
+from shedu.scheduler import DownloadScheduler
+
+URL = "http://mirror.example/resource/1/001.mp3"
+
+
+def test_cancel_pending_while_the_lock_is_held():
+    scheduler = DownloadScheduler(max_workers=1, per_host=1)
+    started, release = threading.Event(), threading.Event()
+
+    def job(url):
+        started.set()
+        release.wait(5)
+        return url
+
+    first, second = scheduler.submit(job, URL), scheduler.submit(job, URL)
+    assert started.wait(5)
+    with scheduler._lock:
+        # As a Ctrl+C handler does when the signal arrives during submit() on the main thread.
+        scheduler.cancel_pending()
+    release.set()
+    scheduler.join()
+    assert first.result() == URL
+    assert second.cancelled()
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from shedu.jobqueue import STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, JobQueue
+from shedu.jobs import JobControl
+from shedu.service import JobTracker, queued_codes
+
+CODES = ["10000001", "10000002", "10000003", "10000004", "10000005"]
+URL = "http://mirror.example/resource/{}/001.mp3"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.sqlite3"))
+    queue.submit(CODES)
+    yield queue
+    queue.close()
+
+
+def test_claims_no_more_jobs_than_the_window(queue):
+    control = JobControl()
+    tracker = JobTracker(queue, control, log=lambda message: None, window=2)
+    codes = queued_codes(queue, tracker, control)
+    assert [next(codes), next(codes)] == CODES[:2]
+    assert queue.counts()[STATUS_RUNNING] == 2
+
+    claimed = []
+    reader = threading.Thread(target=lambda: claimed.append(next(codes)))
+    reader.start()
+    reader.join(0.3)
+    assert claimed == [] and queue.counts()[STATUS_QUEUED] == 3
+
+    tracker.code_failed(CODES[0], OSError("lookup failed"), 0.1)
+    reader.join(5)
+    assert claimed == [CODES[2]]
+    assert queue.counts()[STATUS_RUNNING] == 2
+    control.cancel()
+
+
+def test_failures_are_dropped_when_the_job_ends(queue):
+    control = JobControl()
+    tracker = JobTracker(queue, control, log=lambda message: None, window=2)
+    codes = queued_codes(queue, tracker, control)
+    first, second = next(codes), next(codes)
+    for code in (first, second):
+        tracker.code_resolved(code, "Title", [URL.format(code)], 0.1)
+        tracker.download_queued(URL.format(code), code, "Title")
+    error = OSError("disk full")
+    # As the engine does: the failure is recorded before the events.
+    for code in (first, second):
+        tracker.failures.file_failed(code, "Title", URL.format(code), error)
+    tracker.file_error(first, "Title", URL.format(first), error)
+    tracker.download_ended(URL.format(first), None)
+
+    assert tracker.failures.counts() == (0, 1)
+    finished = queue.jobs(STATUS_FAILED)
+    assert [(job.code, job.files, job.failed_files) for job in finished] == [(first, 1, 1)]
+    control.cancel()
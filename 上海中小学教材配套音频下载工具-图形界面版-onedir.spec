@@ -0,0 +1,57 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Fast-starting build of the graphical version: one folder instead of one file,
+# so nothing is unpacked to a temporary directory on every launch, and no UPX,
+# so the DLLs don't have to be decompressed while loading either.
+#
+#     pyinstaller 上海中小学教材配套音频下载工具-图形界面版-onedir.spec
+#
+# The result is dist/上海中小学教材配套音频下载工具-图形界面版/; ship the whole folder.
+# With SHEDU_PROFILE_IMPORTS=1 set while building, the executable gets a console
+# and prints `python -X importtime` output (see benchmarks/bench_startup.py).
+import os
+
+name = '上海中小学教材配套音频下载工具-图形界面版'
+profile_imports = bool(os.environ.get('SHEDU_PROFILE_IMPORTS'))
+
+a = Analysis(
+    [os.path.join(SPECPATH, name + '.py')],
+    pathex=[SPECPATH],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    # Used only by the command-line version (the async engine, progress bars, colours).
+    excludes=['aiohttp', 'tqdm', 'colorama', 'bs4'],
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [('X importtime', None, 'OPTION')] if profile_imports else [],
+    exclude_binaries=True,
+    name=name,
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=profile_imports,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name=name,
+)
@@ -1,297 +1,467 @@
-import tkinter as tk
-from tkinter import ttk, scrolledtext, filedialog
-import threading
-import queue
-import requests
-import os
-import re
-import locale
-import sys
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, unquote
-
-# --- Platform-specific command key for shortcuts ---
-cmd_key = "Command" if sys.platform == "darwin" else "Control"
-
-# ==============================================================================
-#  LANGUAGE TRANSLATIONS & FOLDER FORMATS
-# ==============================================================================
-LANG = {
-    'en': {
-        'title': "SHEDU Audio Downloader", 'inputs_frame': "Inputs", 'codes_label': "Codes:",
-        'options_frame': "Options", 'target_dir_label': "Target Dir:", 'browse_button': "Browse...",
-        'folder_format_label': "Sort into folders:", 'silent_check': "Hide download progress",
-        'log_frame': "Log", 'get_urls_button': "Get URLs", 'download_button': "Get & Download",
-        'msg_enter_code': "Please enter at least one code.",
-        'msg_invalid_code': "Warning: '{code}' is not a valid 8-digit number. Skipping.",
-        'msg_no_links': "No .shtml links found for this code.", 'msg_no_title': "No title found",
-        'msg_download_failed': "  -> Download failed: {e}", 'msg_file_error': "  -> File error: {e}",
-        'msg_request_error': "An error occurred for code {code}: {e}",
-        'progress_label': "Downloading: {filename}", 'download_complete': " ✔️ Download complete: {filename}",
-        'folder_formats': {
-            'No sub-folder (default)': 'n', '{code}-{title}': 'ct', '{code}': 'c',
-            '{title}': 't', '{title}-{code}': 'tc'
-        },
-        'menu_cut': "Cut", 'menu_copy': "Copy", 'menu_paste': "Paste", 'menu_delete': "Delete"
-    },
-    'zh': {
-        'title': "上海中小学教材配套音频下载工具", 'inputs_frame': "输入", 'codes_label': "提取码:",
-        'options_frame': "选项", 'target_dir_label': "目标文件夹:", 'browse_button': "浏览...",
-        'folder_format_label': "按照文件夹分类:", 'silent_check': "隐藏下载进度",
-        'log_frame': "日志", 'get_urls_button': "获取网址", 'download_button': "获取并下载",
-        'msg_enter_code': "请输入至少一个提取码。",
-        'msg_invalid_code': "警告: '{code}' 不是一个有效的8位数字。已跳过。",
-        'msg_no_links': "未能为此提取码找到 .shtml 链接。", 'msg_no_title': "未找到标题",
-        'msg_download_failed': "  -> 下载失败: {e}", 'msg_file_error': "  -> 文件错误: {e}",
-        'msg_request_error': "处理提取码 {code} 时发生错误: {e}",
-        'progress_label': "正在下载: {filename}", 'download_complete': " ✔️ 下载完成: {filename}",
-        'folder_formats': {
-            '不进行分类 (默认)': 'n', '{提取码}-{标题}': 'ct', '{提取码}': 'c',
-            '{标题}': 't', '{标题}-{提取码}': 'tc'
-        },
-        'menu_cut': "剪切", 'menu_copy': "复制", 'menu_paste': "粘贴", 'menu_delete': "删除"
-    }
-}
-
-# ==============================================================================
-#  CORE LOGIC (Identical to previous version)
-# ==============================================================================
-
-def sanitize_filename(name):
-    sanitized = re.sub(r'[<>:"/\\|?*]', '_', name)
-    sanitized = re.sub(r'__+', '_', sanitized)
-    return sanitized.strip(' _')
-
-def download_file(url, base_dir, folder_format, code, title, silent, output_queue, lang):
-    sub_folder = ""
-    if folder_format == 'ct': sub_folder = f"{code}-{title}"
-    elif folder_format == 'c': sub_folder = code
-    elif folder_format == 't': sub_folder = title
-    elif folder_format == 'tc': sub_folder = f"{title}-{code}"
-    safe_sub_folder = sanitize_filename(sub_folder)
-    download_path = os.path.join(base_dir, safe_sub_folder)
-    os.makedirs(download_path, exist_ok=True)
-    try:
-        with requests.get(url, stream=True, timeout=20) as r:
-            r.raise_for_status()
-            filename = unquote(r.url.split('/')[-1])
-            if "content-disposition" in r.headers:
-                match = re.search(r'filename="?([^"]+)"?', r.headers['content-disposition'])
-                if match: filename = unquote(match.group(1))
-            file_path = os.path.join(download_path, sanitize_filename(filename))
-            total_size = int(r.headers.get('content-length', 0))
-            
-            downloaded_bytes = 0
-            with open(file_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_bytes += len(chunk)
-                        if not silent:
-                            progress_data = {'downloaded': downloaded_bytes, 'total': total_size, 'filename': filename}
-                            output_queue.put(('progress', progress_data))
-        
-        output_queue.put(('log', LANG[lang]['download_complete'].format(filename=filename)))
-
-    except Exception as e:
-        output_queue.put(('error', LANG[lang]['msg_download_failed'].format(e=e)))
-
-def fetch_and_parse_logic(code, should_download, options, output_queue):
-    lang = options['lang']
-    base_url = "https://mp3.bookmall.com.cn"
-    target_url = f"{base_url}/book/access.action"
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; rv:11.0) like Gecko"}
-    payload = {"code": code}
-    try:
-        response = requests.post(target_url, headers=headers, data=payload, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        title = soup.select_one('dl.EnglishBox dd h5').get_text(strip=True) if soup.select_one('dl.EnglishBox dd h5') else LANG[lang]['msg_no_title']
-        output_queue.put(('title', code)); output_queue.put(('title', title))
-        shtml_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.shtml')]
-        if not shtml_links: output_queue.put(('warning', LANG[lang]['msg_no_links'])); return
-        for link in shtml_links:
-            full_url = urljoin(base_url, link)
-            output_queue.put(('url', full_url))
-            if should_download:
-                download_file(full_url, options['target_dir'], options['folder_format'], code, title, options['silent'], output_queue, lang)
-    except Exception as e:
-        output_queue.put(('error', LANG[lang]['msg_request_error'].format(code=code, e=e)))
-
-# ==============================================================================
-#  GUI APPLICATION CLASS
-# ==============================================================================
-
-class App:
-    def __init__(self, root, initial_lang):
-        self.root = root
-        self.queue = queue.Queue()
-        self.lang_var = tk.StringVar(value=initial_lang)
-        main_frame = ttk.Frame(root, padding="10")
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        lang_frame = ttk.Frame(main_frame)
-        lang_frame.pack(fill=tk.X, expand=False, pady=(0, 10))
-        ttk.Radiobutton(lang_frame, text="English", variable=self.lang_var, value='en', command=self.update_language).pack(side=tk.LEFT, padx=5)
-        ttk.Radiobutton(lang_frame, text="简体中文", variable=self.lang_var, value='zh', command=self.update_language).pack(side=tk.LEFT, padx=5)
-        self.input_frame = ttk.LabelFrame(main_frame, padding="10")
-        self.input_frame.pack(fill=tk.X, expand=False)
-        self.input_frame.columnconfigure(1, weight=1)
-        self.codes_label = ttk.Label(self.input_frame)
-        self.codes_label.grid(row=0, column=0, sticky="nw", padx=5, pady=5)
-        self.codes_text = scrolledtext.ScrolledText(self.input_frame, height=8, width=40)
-        self.codes_text.grid(row=0, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
-        self.options_frame = ttk.LabelFrame(main_frame, padding="10")
-        self.options_frame.pack(fill=tk.X, expand=False, pady=10)
-        self.options_frame.columnconfigure(1, weight=1)
-        self.target_dir_label = ttk.Label(self.options_frame)
-        self.target_dir_label.grid(row=0, column=0, sticky="w", padx=5, pady=5)
-        self.target_dir_var = tk.StringVar(value=os.getcwd())
-        self.target_dir_entry = ttk.Entry(self.options_frame, textvariable=self.target_dir_var)
-        self.target_dir_entry.grid(row=0, column=1, sticky="ew", padx=5, pady=5)
-        self.browse_button = ttk.Button(self.options_frame, command=self.browse_directory)
-        self.browse_button.grid(row=0, column=2, sticky="e", padx=5, pady=5)
-        self.folder_format_label = ttk.Label(self.options_frame)
-        self.folder_format_label.grid(row=1, column=0, sticky="w", padx=5, pady=5)
-        self.folder_format_var = tk.StringVar()
-        self.folder_format_combo = ttk.Combobox(self.options_frame, textvariable=self.folder_format_var, state="readonly")
-        self.folder_format_combo.grid(row=1, column=1, sticky="w", padx=5, pady=5)
-        self.silent_var = tk.BooleanVar(value=False)
-        self.silent_check = ttk.Checkbutton(self.options_frame, variable=self.silent_var)
-        self.silent_check.grid(row=1, column=2, sticky="w", padx=10, pady=5)
-        
-        self.progress_frame = ttk.Frame(main_frame)
-        self.progress_label = ttk.Label(self.progress_frame, text="", anchor="w")
-        self.progress_label.pack(fill=tk.X, expand=True, pady=(0,2))
-        self.progress_bar = ttk.Progressbar(self.progress_frame, orient='horizontal', mode='determinate')
-        self.progress_bar.pack(fill=tk.X, expand=True)
-
-        self.button_frame = ttk.Frame(main_frame)
-        self.button_frame.pack(fill=tk.X, expand=False, pady=5)
-        self.get_urls_button = ttk.Button(self.button_frame, command=lambda: self.start_task(download=False))
-        self.get_urls_button.pack(side=tk.RIGHT, padx=5)
-        self.download_button = ttk.Button(self.button_frame, command=lambda: self.start_task(download=True))
-        self.download_button.pack(side=tk.RIGHT, padx=5)
-        self.log_frame = ttk.LabelFrame(main_frame, padding="10")
-        self.log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
-        self.log_text = scrolledtext.ScrolledText(self.log_frame, state='disabled', wrap=tk.WORD, bg="black")
-        self.log_text.pack(fill=tk.BOTH, expand=True)
-        self.log_text.tag_config('title', foreground='lightgreen'); self.log_text.tag_config('url', foreground='cyan')
-        self.log_text.tag_config('warning', foreground='yellow'); self.log_text.tag_config('error', foreground='red')
-        self.log_text.tag_config('separator', foreground='lightcoral'); self.log_text.tag_config('log', foreground='white')
-        
-        self.create_context_menus()
-        self.update_language()
-        self.process_queue()
-
-    def create_context_menus(self):
-        self.code_menu = tk.Menu(self.root, tearoff=0)
-        self.log_menu = tk.Menu(self.root, tearoff=0)
-        self.codes_text.bind("<Button-2>" if sys.platform == "darwin" else "<Button-3>", self.show_code_menu)
-        self.log_text.bind("<Button-2>" if sys.platform == "darwin" else "<Button-3>", self.show_log_menu)
-
-    def show_code_menu(self, event):
-        has_selection = bool(self.codes_text.tag_ranges("sel"))
-        d = LANG[self.lang_var.get()]
-        self.code_menu.entryconfig(d['menu_cut'], state=tk.NORMAL if has_selection else tk.DISABLED)
-        self.code_menu.entryconfig(d['menu_copy'], state=tk.NORMAL if has_selection else tk.DISABLED)
-        self.code_menu.entryconfig(d['menu_delete'], state=tk.NORMAL if has_selection else tk.DISABLED)
-        try: self.code_menu.entryconfig(d['menu_paste'], state=tk.NORMAL if self.root.clipboard_get() else tk.DISABLED)
-        except tk.TclError: self.code_menu.entryconfig(d['menu_paste'], state=tk.DISABLED)
-        self.code_menu.post(event.x_root, event.y_root)
-
-    def show_log_menu(self, event):
-        has_selection = bool(self.log_text.tag_ranges("sel"))
-        self.log_menu.entryconfig(LANG[self.lang_var.get()]['menu_copy'], state=tk.NORMAL if has_selection else tk.DISABLED)
-        self.log_menu.post(event.x_root, event.y_root)
-        
-    def delete_selection(self, widget):
-        if widget.tag_ranges("sel"): widget.delete("sel.first", "sel.last")
-
-    def update_language(self):
-        lang = self.lang_var.get()
-        d = LANG[lang]
-        self.root.title(d['title'])
-        self.input_frame.config(text=d['inputs_frame']); self.codes_label.config(text=d['codes_label'])
-        self.options_frame.config(text=d['options_frame']); self.target_dir_label.config(text=d['target_dir_label'])
-        self.browse_button.config(text=d['browse_button']); self.folder_format_label.config(text=d['folder_format_label'])
-        self.silent_check.config(text=d['silent_check']); self.log_frame.config(text=d['log_frame'])
-        self.get_urls_button.config(text=d['get_urls_button']); self.download_button.config(text=d['download_button'])
-        self.code_menu.delete(0, tk.END)
-        self.code_menu.add_command(label=d['menu_cut'], accelerator=f"{cmd_key}+X", command=lambda: self.codes_text.event_generate("<<Cut>>"))
-        self.code_menu.add_command(label=d['menu_copy'], accelerator=f"{cmd_key}+C", command=lambda: self.codes_text.event_generate("<<Copy>>"))
-        self.code_menu.add_command(label=d['menu_paste'], accelerator=f"{cmd_key}+V", command=lambda: self.codes_text.event_generate("<<Paste>>"))
-        self.code_menu.add_separator()
-        self.code_menu.add_command(label=d['menu_delete'], command=lambda: self.delete_selection(self.codes_text))
-        self.log_menu.delete(0, tk.END)
-        self.log_menu.add_command(label=d['menu_copy'], accelerator=f"{cmd_key}+C", command=lambda: self.log_text.event_generate("<<Copy>>"))
-        folder_formats = d['folder_formats']
-        self.folder_format_combo['values'] = list(folder_formats.keys())
-        self.folder_format_var.set(list(folder_formats.keys())[0])
-
-    def browse_directory(self):
-        directory = filedialog.askdirectory()
-        if directory: self.target_dir_var.set(directory)
-
-    def log_message(self, message, tag=None):
-        self.log_text.configure(state='normal')
-        self.log_text.insert(tk.END, message + '\n', tag)
-        self.log_text.see(tk.END)
-        self.log_text.configure(state='disabled')
-        
-    def start_task(self, download=False):
-        raw_codes = self.codes_text.get("1.0", tk.END).strip()
-        lang = self.lang_var.get()
-        if not raw_codes: self.log_message(LANG[lang]['msg_enter_code'], "error"); return
-        codes = re.split(r'[,\s\n]+', raw_codes)
-        unique_codes = sorted(list(set(filter(None, codes))))
-        descriptive_selection = self.folder_format_var.get()
-        folder_format_code = LANG[lang]['folder_formats'][descriptive_selection]
-        options = {'target_dir': self.target_dir_var.get(), 'folder_format': folder_format_code, 'silent': self.silent_var.get(), 'lang': lang}
-        self.log_text.configure(state='normal'); self.log_text.delete('1.0', tk.END); self.log_text.configure(state='disabled')
-        self.get_urls_button.config(state='disabled'); self.download_button.config(state='disabled')
-        if download and not options['silent']: self.progress_frame.pack(fill=tk.X, expand=False, pady=(0,5))
-        threading.Thread(target=self.worker_thread, args=(unique_codes, download, options), daemon=True).start()
-
-    def worker_thread(self, codes, download, options):
-        lang = options['lang']
-        for i, code in enumerate(codes):
-            if not (code.isdigit() and len(code) == 8):
-                self.queue.put(('warning', LANG[lang]['msg_invalid_code'].format(code=code))); continue
-            fetch_and_parse_logic(code, download, options, self.queue)
-            if i < len(codes) - 1: self.queue.put(('separator', '--------'))
-        self.queue.put(('finish', None))
-
-    def process_queue(self):
-        # --- FIX IS HERE: Process all messages in the queue, not just one. ---
-        while not self.queue.empty():
-            try:
-                msg_type, msg_content = self.queue.get_nowait()
-                if msg_type == 'progress':
-                    data = msg_content
-                    if data['total'] > 0:
-                        percentage = (data['downloaded'] / data['total']) * 100
-                        self.progress_bar['value'] = percentage
-                        self.progress_label['text'] = LANG[self.lang_var.get()]['progress_label'].format(filename=data['filename'])
-                    else:
-                        self.progress_bar.config(mode='indeterminate')
-                        self.progress_bar.start()
-                elif msg_type == 'finish':
-                    self.get_urls_button.config(state='normal'); self.download_button.config(state='normal')
-                    self.progress_frame.pack_forget()
-                    self.progress_bar.config(mode='determinate'); self.progress_bar['value'] = 0
-                else:
-                    self.log_message(msg_content, msg_type)
-            except queue.Empty:
-                pass # Should not happen in a while loop, but good practice
-        
-        self.root.after(100, self.process_queue)
-
-if __name__ == "__main__":
-    initial_lang = 'en'
-    try:
-        default_locale, _ = locale.getdefaultlocale()
-        if default_locale and default_locale.lower().startswith(('zh_cn', 'zh_sg')): initial_lang = 'zh'
-    except Exception: pass
-    root = tk.Tk()
-    app = App(root, initial_lang)
+import tkinter as tk
+from tkinter import ttk, scrolledtext, filedialog
+import queue
+import os
+import re
+import locale
+import sys
+import traceback
+from shedu.events import Events
+from shedu.scheduler import DEFAULT_MAX_DOWNLOADS
+from shedu.cache import open_cache
+from shedu.manifest import Manifest
+from shedu.progress import ProgressTracker, format_bytes, format_eta
+from shedu.logbuffer import LogBuffer, LOG_FILENAME
+from shedu.jobs import Job
+from shedu import ratelimit
+from shedu import profiling
+from shedu.failures import FAILED_FILENAME, describe_error
+
+# --- Platform-specific command key for shortcuts ---
+cmd_key = "Command" if sys.platform == "darwin" else "Control"
+
+# ==============================================================================
+#  LANGUAGE TRANSLATIONS & FOLDER FORMATS
+# ==============================================================================
+LANG = {
+    'en': {
+        'title': "SHEDU Audio Downloader", 'inputs_frame': "Inputs", 'codes_label': "Codes:",
+        'options_frame': "Options", 'target_dir_label': "Target Dir:", 'browse_button': "Browse...",
+        'folder_format_label': "Sort into folders:", 'silent_check': "Hide download progress",
+        'parallel_label': "Parallel downloads:", 'refresh_check': "Refresh cached codes",
+        'save_log_check': f"Save full log to {LOG_FILENAME}",
+        'profile_check': f"Debug: time each step ({profiling.TRACE_FILENAME})",
+        'limit_label': "Speed limits:", 'rate_unit': "requests/s", 'speed_unit': "KiB/s (0 = no limit)",
+        'log_frame': "Log", 'get_urls_button': "Get URLs", 'download_button': "Get & Download",
+        'pause_button': "Pause", 'resume_button': "Resume", 'cancel_button': "Cancel",
+        'msg_enter_code': "Please enter at least one code.",
+        'msg_invalid_code': "Warning: '{code}' is not a valid 8-digit number. Skipping.",
+        'msg_no_links': "No .shtml links found for this code.", 'msg_no_title': "No title found",
+        'msg_download_failed': "  -> Download failed: {e}", 'msg_file_error': "  -> File error: {e}",
+        'msg_request_error': "An error occurred for code {code}: {e}",
+        'msg_unexpected_error': "The run stopped on an unexpected error:\n{e}",
+        'msg_paused': "Paused. Unfinished downloads will continue where they stopped.", 'msg_resumed': "Resumed.",
+        'msg_cancelled': "Cancelled. Unfinished files were removed.",
+        'msg_failed_summary': "{codes} code(s) and {files} file(s) failed after all retries; they are listed in {path}.",
+        'msg_profile': "Timings per step:", 'msg_trace_saved': "Trace saved to {path} (open it in chrome://tracing or https://ui.perfetto.dev).",
+        'progress_label': "Downloading {filename} ({files_done}/{files} files): {done} of {total}, {rate}/s, ETA {eta}",
+        'download_complete': " ✔️ Download complete: {filename}",
+        'folder_formats': {
+            'No sub-folder (default)': 'n', '{code}-{title}': 'ct', '{code}': 'c',
+            '{title}': 't', '{title}-{code}': 'tc'
+        },
+        'menu_cut': "Cut", 'menu_copy': "Copy", 'menu_paste': "Paste", 'menu_delete': "Delete"
+    },
+    'zh': {
+        'title': "上海中小学教材配套音频下载工具", 'inputs_frame': "输入", 'codes_label': "提取码:",
+        'options_frame': "选项", 'target_dir_label': "目标文件夹:", 'browse_button': "浏览...",
+        'folder_format_label': "按照文件夹分类:", 'silent_check': "隐藏下载进度",
+        'parallel_label': "同时下载数:", 'refresh_check': "重新获取已缓存的提取码",
+        'save_log_check': f"将完整日志保存到 {LOG_FILENAME}",
+        'profile_check': f"调试：记录各步骤耗时（{profiling.TRACE_FILENAME}）",
+        'limit_label': "速度限制:", 'rate_unit': "次请求/秒", 'speed_unit': "KiB/秒（0 = 不限制）",
+        'log_frame': "日志", 'get_urls_button': "获取网址", 'download_button': "获取并下载",
+        'pause_button': "暂停", 'resume_button': "继续", 'cancel_button': "取消",
+        'msg_enter_code': "请输入至少一个提取码。",
+        'msg_invalid_code': "警告: '{code}' 不是一个有效的8位数字。已跳过。",
+        'msg_no_links': "未能为此提取码找到 .shtml 链接。", 'msg_no_title': "未找到标题",
+        'msg_download_failed': "  -> 下载失败: {e}", 'msg_file_error': "  -> 文件错误: {e}",
+        'msg_request_error': "处理提取码 {code} 时发生错误: {e}",
+        'msg_unexpected_error': "运行因意外错误而停止:\n{e}",
+        'msg_paused': "已暂停。未完成的下载将在继续后从中断处接着下载。", 'msg_resumed': "已继续。",
+        'msg_cancelled': "已取消。未完成的文件已删除。",
+        'msg_failed_summary': "重试后仍有 {codes} 个提取码和 {files} 个文件失败，已记录在 {path}。",
+        'msg_profile': "各步骤耗时：", 'msg_trace_saved': "详细记录已保存到 {path}（可在 chrome://tracing 或 https://ui.perfetto.dev 中打开）。",
+        'progress_label': "正在下载 {filename}（{files_done}/{files} 个文件）：{done} / {total}，{rate}/s，剩余 {eta}",
+        'download_complete': " ✔️ 下载完成: {filename}",
+        'folder_formats': {
+            '不进行分类 (默认)': 'n', '{提取码}-{标题}': 'ct', '{提取码}': 'c',
+            '{标题}': 't', '{标题}-{提取码}': 'tc'
+        },
+        'menu_cut': "剪切", 'menu_copy': "复制", 'menu_paste': "粘贴", 'menu_delete': "删除"
+    }
+}
+
+# ==============================================================================
+#  ENGINE EVENTS (the downloading itself is shedu.engine's, shared with the command-line tool)
+# ==============================================================================
+
+class TrackedFile:
+    """What QueueEvents.download_started() returns: feeds a file's bytes to the shared ProgressTracker."""
+    def __init__(self, tracker, handle):
+        self.tracker = tracker
+        self.handle = handle
+
+    def update(self, nbytes):
+        self.tracker.advance(self.handle, nbytes)
+
+    def close(self):
+        # The file stays active across retries; download_ended() finishes it.
+        pass
+
+class QueueEvents(Events):
+    """Passes what the engine does to the UI thread through its queue, and download progress to the tracker."""
+    def __init__(self, output_queue, lang, tracker=None):
+        self.queue = output_queue
+        self.lang = lang
+        self.tracker = tracker
+        self._blocks = 0
+
+    def _block(self):
+        if self._blocks: self.queue.put(('separator', '--------'))
+        self._blocks += 1
+
+    def code_invalid(self, code):
+        self._block()
+        self.queue.put(('warning', LANG[self.lang]['msg_invalid_code'].format(code=code)))
+
+    def code_failed(self, code, error, seconds):
+        self._block()
+        self.queue.put(('error', LANG[self.lang]['msg_request_error'].format(code=code, e=describe_error(error))))
+
+    def code_resolved(self, code, title, links, seconds):
+        self._block()
+        self.queue.put(('title', code)); self.queue.put(('title', title or LANG[self.lang]['msg_no_title']))
+        if not links: self.queue.put(('warning', LANG[self.lang]['msg_no_links']))
+        for full_url in links: self.queue.put(('url', full_url))
+
+    def download_queued(self, url, code, title):
+        if self.tracker: self.tracker.expect()
+
+    def download_started(self, url, filename, total, offset, previous=None):
+        # Progress only goes to the shared tracker; the UI reads it once per tick.
+        if not self.tracker: return None
+        return TrackedFile(self.tracker, self.tracker.start(filename, total, offset, handle=previous.handle if previous else None))
+
+    def download_done(self, url, path):
+        self.queue.put(('log', LANG[self.lang]['download_complete'].format(filename=os.path.basename(path))))
+
+    def download_failed(self, code, title, url, error):
+        self.queue.put(('error', LANG[self.lang]['msg_download_failed'].format(e=describe_error(error))))
+
+    def file_error(self, code, title, url, error):
+        self.queue.put(('error', LANG[self.lang]['msg_file_error'].format(e=error)))
+
+    def download_ended(self, url, progress):
+        if self.tracker: self.tracker.finish(progress.handle if progress else None)
+
+# ==============================================================================
+#  GUI APPLICATION CLASS
+# ==============================================================================
+
+class App:
+    def __init__(self, root, initial_lang):
+        self.root = root
+        self.queue = queue.Queue()
+        self.tracker = None
+        self.job = None
+        self.log_buffer = LogBuffer()
+        root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.lang_var = tk.StringVar(value=initial_lang)
+        main_frame = ttk.Frame(root, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        lang_frame = ttk.Frame(main_frame)
+        lang_frame.pack(fill=tk.X, expand=False, pady=(0, 10))
+        ttk.Radiobutton(lang_frame, text="English", variable=self.lang_var, value='en', command=self.update_language).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(lang_frame, text="简体中文", variable=self.lang_var, value='zh', command=self.update_language).pack(side=tk.LEFT, padx=5)
+        self.input_frame = ttk.LabelFrame(main_frame, padding="10")
+        self.input_frame.pack(fill=tk.X, expand=False)
+        self.input_frame.columnconfigure(1, weight=1)
+        self.codes_label = ttk.Label(self.input_frame)
+        self.codes_label.grid(row=0, column=0, sticky="nw", padx=5, pady=5)
+        self.codes_text = scrolledtext.ScrolledText(self.input_frame, height=8, width=40)
+        self.codes_text.grid(row=0, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.options_frame = ttk.LabelFrame(main_frame, padding="10")
+        self.options_frame.pack(fill=tk.X, expand=False, pady=10)
+        self.options_frame.columnconfigure(1, weight=1)
+        self.target_dir_label = ttk.Label(self.options_frame)
+        self.target_dir_label.grid(row=0, column=0, sticky="w", padx=5, pady=5)
+        self.target_dir_var = tk.StringVar(value=os.getcwd())
+        self.target_dir_entry = ttk.Entry(self.options_frame, textvariable=self.target_dir_var)
+        self.target_dir_entry.grid(row=0, column=1, sticky="ew", padx=5, pady=5)
+        self.browse_button = ttk.Button(self.options_frame, command=self.browse_directory)
+        self.browse_button.grid(row=0, column=2, sticky="e", padx=5, pady=5)
+        self.folder_format_label = ttk.Label(self.options_frame)
+        self.folder_format_label.grid(row=1, column=0, sticky="w", padx=5, pady=5)
+        self.folder_format_var = tk.StringVar()
+        self.folder_format_combo = ttk.Combobox(self.options_frame, textvariable=self.folder_format_var, state="readonly")
+        self.folder_format_combo.grid(row=1, column=1, sticky="w", padx=5, pady=5)
+        self.silent_var = tk.BooleanVar(value=False)
+        self.silent_check = ttk.Checkbutton(self.options_frame, variable=self.silent_var)
+        self.silent_check.grid(row=1, column=2, sticky="w", padx=10, pady=5)
+        self.parallel_label = ttk.Label(self.options_frame)
+        self.parallel_label.grid(row=2, column=0, sticky="w", padx=5, pady=5)
+        self.parallel_var = tk.IntVar(value=DEFAULT_MAX_DOWNLOADS)
+        self.parallel_spin = ttk.Spinbox(self.options_frame, from_=1, to=16, textvariable=self.parallel_var, width=5, state="readonly")
+        self.parallel_spin.grid(row=2, column=1, sticky="w", padx=5, pady=5)
+        self.refresh_var = tk.BooleanVar(value=False)
+        self.refresh_check = ttk.Checkbutton(self.options_frame, variable=self.refresh_var)
+        self.refresh_check.grid(row=2, column=2, sticky="w", padx=10, pady=5)
+        self.save_log_var = tk.BooleanVar(value=False)
+        self.save_log_check = ttk.Checkbutton(self.options_frame, variable=self.save_log_var)
+        self.save_log_check.grid(row=3, column=2, sticky="w", padx=10, pady=5)
+        self.profile_var = tk.BooleanVar(value=False)
+        self.profile_check = ttk.Checkbutton(self.options_frame, variable=self.profile_var)
+        self.profile_check.grid(row=4, column=2, sticky="w", padx=10, pady=5)
+        # 0 means no limit; the request rate also backs off on its own when the server struggles.
+        self.limit_label = ttk.Label(self.options_frame)
+        self.limit_label.grid(row=3, column=0, sticky="w", padx=5, pady=5)
+        limit_frame = ttk.Frame(self.options_frame)
+        limit_frame.grid(row=3, column=1, sticky="w", padx=5, pady=5)
+        self.rate_var = tk.DoubleVar(value=0)
+        ttk.Spinbox(limit_frame, from_=0, to=100, increment=0.5, textvariable=self.rate_var, width=5).pack(side=tk.LEFT)
+        self.rate_unit_label = ttk.Label(limit_frame)
+        self.rate_unit_label.pack(side=tk.LEFT, padx=(2, 10))
+        self.speed_var = tk.IntVar(value=0)
+        ttk.Spinbox(limit_frame, from_=0, to=102400, increment=128, textvariable=self.speed_var, width=7).pack(side=tk.LEFT)
+        self.speed_unit_label = ttk.Label(limit_frame)
+        self.speed_unit_label.pack(side=tk.LEFT, padx=2)
+        
+        self.progress_frame = ttk.Frame(main_frame)
+        self.progress_label = ttk.Label(self.progress_frame, text="", anchor="w")
+        self.progress_label.pack(fill=tk.X, expand=True, pady=(0,2))
+        self.progress_bar = ttk.Progressbar(self.progress_frame, orient='horizontal', mode='determinate')
+        self.progress_bar.pack(fill=tk.X, expand=True)
+
+        self.button_frame = ttk.Frame(main_frame)
+        self.button_frame.pack(fill=tk.X, expand=False, pady=5)
+        self.get_urls_button = ttk.Button(self.button_frame, command=lambda: self.start_task(download=False))
+        self.get_urls_button.pack(side=tk.RIGHT, padx=5)
+        self.download_button = ttk.Button(self.button_frame, command=lambda: self.start_task(download=True))
+        self.download_button.pack(side=tk.RIGHT, padx=5)
+        self.pause_button = ttk.Button(self.button_frame, command=self.toggle_pause, state='disabled')
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(self.button_frame, command=self.cancel_task, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        self.log_frame = ttk.LabelFrame(main_frame, padding="10")
+        self.log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        self.log_text = scrolledtext.ScrolledText(self.log_frame, state='disabled', wrap=tk.WORD, bg="black")
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_text.tag_config('title', foreground='lightgreen'); self.log_text.tag_config('url', foreground='cyan')
+        self.log_text.tag_config('warning', foreground='yellow'); self.log_text.tag_config('error', foreground='red')
+        self.log_text.tag_config('separator', foreground='lightcoral'); self.log_text.tag_config('log', foreground='white')
+        self.log_text.tag_config('profile', foreground='white', font='TkFixedFont')
+        
+        self.create_context_menus()
+        self.update_language()
+        self.process_queue()
+
+    def create_context_menus(self):
+        self.code_menu = tk.Menu(self.root, tearoff=0)
+        self.log_menu = tk.Menu(self.root, tearoff=0)
+        self.codes_text.bind("<Button-2>" if sys.platform == "darwin" else "<Button-3>", self.show_code_menu)
+        self.log_text.bind("<Button-2>" if sys.platform == "darwin" else "<Button-3>", self.show_log_menu)
+
+    def show_code_menu(self, event):
+        has_selection = bool(self.codes_text.tag_ranges("sel"))
+        d = LANG[self.lang_var.get()]
+        self.code_menu.entryconfig(d['menu_cut'], state=tk.NORMAL if has_selection else tk.DISABLED)
+        self.code_menu.entryconfig(d['menu_copy'], state=tk.NORMAL if has_selection else tk.DISABLED)
+        self.code_menu.entryconfig(d['menu_delete'], state=tk.NORMAL if has_selection else tk.DISABLED)
+        try: self.code_menu.entryconfig(d['menu_paste'], state=tk.NORMAL if self.root.clipboard_get() else tk.DISABLED)
+        except tk.TclError: self.code_menu.entryconfig(d['menu_paste'], state=tk.DISABLED)
+        self.code_menu.post(event.x_root, event.y_root)
+
+    def show_log_menu(self, event):
+        has_selection = bool(self.log_text.tag_ranges("sel"))
+        self.log_menu.entryconfig(LANG[self.lang_var.get()]['menu_copy'], state=tk.NORMAL if has_selection else tk.DISABLED)
+        self.log_menu.post(event.x_root, event.y_root)
+        
+    def delete_selection(self, widget):
+        if widget.tag_ranges("sel"): widget.delete("sel.first", "sel.last")
+
+    def update_language(self):
+        lang = self.lang_var.get()
+        d = LANG[lang]
+        self.root.title(d['title'])
+        self.input_frame.config(text=d['inputs_frame']); self.codes_label.config(text=d['codes_label'])
+        self.options_frame.config(text=d['options_frame']); self.target_dir_label.config(text=d['target_dir_label'])
+        self.browse_button.config(text=d['browse_button']); self.folder_format_label.config(text=d['folder_format_label'])
+        self.silent_check.config(text=d['silent_check']); self.log_frame.config(text=d['log_frame'])
+        self.parallel_label.config(text=d['parallel_label']); self.refresh_check.config(text=d['refresh_check'])
+        self.save_log_check.config(text=d['save_log_check']); self.profile_check.config(text=d['profile_check'])
+        self.limit_label.config(text=d['limit_label']); self.rate_unit_label.config(text=d['rate_unit']); self.speed_unit_label.config(text=d['speed_unit'])
+        self.get_urls_button.config(text=d['get_urls_button']); self.download_button.config(text=d['download_button'])
+        self.pause_button.config(text=d['resume_button'] if self.job and self.job.control.paused else d['pause_button'])
+        self.cancel_button.config(text=d['cancel_button'])
+        self.code_menu.delete(0, tk.END)
+        self.code_menu.add_command(label=d['menu_cut'], accelerator=f"{cmd_key}+X", command=lambda: self.codes_text.event_generate("<<Cut>>"))
+        self.code_menu.add_command(label=d['menu_copy'], accelerator=f"{cmd_key}+C", command=lambda: self.codes_text.event_generate("<<Copy>>"))
+        self.code_menu.add_command(label=d['menu_paste'], accelerator=f"{cmd_key}+V", command=lambda: self.codes_text.event_generate("<<Paste>>"))
+        self.code_menu.add_separator()
+        self.code_menu.add_command(label=d['menu_delete'], command=lambda: self.delete_selection(self.codes_text))
+        self.log_menu.delete(0, tk.END)
+        self.log_menu.add_command(label=d['menu_copy'], accelerator=f"{cmd_key}+C", command=lambda: self.log_text.event_generate("<<Copy>>"))
+        folder_formats = d['folder_formats']
+        self.folder_format_combo['values'] = list(folder_formats.keys())
+        self.folder_format_var.set(list(folder_formats.keys())[0])
+
+    def browse_directory(self):
+        directory = filedialog.askdirectory()
+        if directory: self.target_dir_var.set(directory)
+
+    def log_message(self, message, tag=None):
+        # Lines are shown by flush_log on the next tick, all in one insert.
+        self.log_buffer.append(message, tag)
+
+    def flush_log(self):
+        lines = self.log_buffer.drain()
+        if not lines: return
+        # Only follow the end of the log if the user hasn't scrolled up to read.
+        at_end = self.log_text.yview()[1] >= 1.0
+        chunks = []
+        for message, tag in lines: chunks += [message + '\n', tag or '']
+        self.log_text.configure(state='normal')
+        self.log_text.insert(tk.END, *chunks)
+        # Keep the widget to the newest lines; the rest is in the log file if one is being saved.
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.log_buffer.max_lines
+        if excess > 0: self.log_text.delete('1.0', f'{excess + 1}.0')
+        self.log_text.configure(state='disabled')
+        if at_end: self.log_text.see(tk.END)
+        
+    def start_task(self, download=False):
+        raw_codes = self.codes_text.get("1.0", tk.END).strip()
+        lang = self.lang_var.get()
+        if not raw_codes: self.log_message(LANG[lang]['msg_enter_code'], "error"); return
+        codes = re.split(r'[,\s\n]+', raw_codes)
+        unique_codes = sorted(list(set(filter(None, codes))))
+        descriptive_selection = self.folder_format_var.get()
+        folder_format_code = LANG[lang]['folder_formats'][descriptive_selection]
+        options = {'target_dir': self.target_dir_var.get(), 'folder_format': folder_format_code, 'silent': self.silent_var.get(), 'lang': lang,
+                   'max_downloads': self.parallel_var.get(), 'refresh': self.refresh_var.get(), 'profile': self.profile_var.get()}
+        self.log_text.configure(state='normal'); self.log_text.delete('1.0', tk.END); self.log_text.configure(state='disabled')
+        try: rate, speed = max(0.0, self.rate_var.get()), max(0, self.speed_var.get())
+        except tk.TclError: rate = speed = 0  # Not a number: no limit.
+        ratelimit.configure(requests_per_second=rate, bytes_per_second=speed * 1024)
+        self.log_buffer.close()
+        try: self.log_buffer = LogBuffer(spill_path=os.path.join(options['target_dir'], LOG_FILENAME) if self.save_log_var.get() else None)
+        except OSError as e:
+            self.log_buffer = LogBuffer(); self.log_message(LANG[lang]['msg_file_error'].format(e=e), 'error')
+        self.get_urls_button.config(state='disabled'); self.download_button.config(state='disabled')
+        self.pause_button.config(state='normal'); self.cancel_button.config(state='normal')
+        self.tracker = options['tracker'] = ProgressTracker() if download and not options['silent'] else None
+        if self.tracker:
+            self.progress_label['text'] = ""
+            self.progress_frame.pack(fill=tk.X, expand=False, pady=(0,5))
+        self.job = Job(self.worker_thread, unique_codes, download, options, name="worker").start()
+
+    def toggle_pause(self):
+        if not self.job: return
+        d = LANG[self.lang_var.get()]
+        if self.job.control.paused:
+            self.job.resume(); self.pause_button.config(text=d['pause_button']); self.log_message(d['msg_resumed'], 'log')
+        else:
+            self.job.pause(); self.pause_button.config(text=d['resume_button']); self.log_message(d['msg_paused'], 'warning')
+
+    def cancel_task(self):
+        if not self.job: return
+        # The worker notices at its next checkpoint, at most a chunk away for running downloads.
+        self.job.cancel()
+        self.pause_button.config(state='disabled'); self.cancel_button.config(state='disabled')
+
+    def on_close(self):
+        # Give downloads a moment to stop and remove their .part files before the process goes away.
+        if self.job: self.job.shutdown(timeout=5)
+        self.log_buffer.close()
+        self.root.destroy()
+
+    def worker_thread(self, control, codes, download, options):
+        lang = options['lang']
+        recorder = profiling.enable() if options['profile'] else None
+        try:
+            # Loaded here, off the UI thread, so the window doesn't wait for requests and lxml to import.
+            from shedu.engine import Engine
+            # Downloads run on the engine's pool while this thread keeps resolving codes.
+            # All links live on the bookmall host, so the spinbox value caps both limits.
+            # Downloads are recorded in the manifest, so the command-line tool's `verify` can check them.
+            engine = Engine(options['target_dir'], options['folder_format'], QueueEvents(self.queue, lang, options['tracker']),
+                            download_jobs=options['max_downloads'], per_host=options['max_downloads'],
+                            cache=open_cache(), refresh=options['refresh'],
+                            manifest=Manifest(options['target_dir'], skip_unchanged=False) if download else None,
+                            control=control, no_title=LANG[lang]['msg_no_title'])
+            engine.run(codes, download)
+            # Running downloads stop at their next chunk once cancelled, so this doesn't wait long.
+            try: engine.finish()
+            except OSError as e: self.queue.put(('error', LANG[lang]['msg_file_error'].format(e=e)))
+            if control.cancelled: self.queue.put(('warning', LANG[lang]['msg_cancelled']))
+            else:
+                # Same file as the command-line tool writes, so its --rerun-failed can pick up where this run left off.
+                failed_path = os.path.join(options['target_dir'], FAILED_FILENAME)
+                failed_codes, failed_files = engine.failures.counts()
+                try:
+                    if engine.failures.save(failed_path):
+                        self.queue.put(('error', LANG[lang]['msg_failed_summary'].format(codes=failed_codes, files=failed_files, path=failed_path)))
+                except OSError as e:
+                    self.queue.put(('error', LANG[lang]['msg_file_error'].format(e=e)))
+            if recorder:
+                profiling.disable()
+                self.report_profile(recorder, options)
+        except Exception:
+            # Whatever goes wrong, the traceback goes to the log and the buttons come back;
+            # downloads this run already queued stop rather than go on in the background.
+            control.cancel()
+            self.queue.put(('error', LANG[lang]['msg_unexpected_error'].format(e=traceback.format_exc().rstrip())))
+        finally:
+            if recorder: profiling.disable()
+            self.queue.put(('finish', None))
+
+    def report_profile(self, recorder, options):
+        # The debug option: the per-step table in the log and the full trace next to the downloads.
+        d = LANG[options['lang']]
+        self.queue.put(('title', d['msg_profile']))
+        for line in recorder.format_summary(): self.queue.put(('profile', line))
+        trace_path = os.path.join(options['target_dir'], profiling.TRACE_FILENAME)
+        try:
+            recorder.save_trace(trace_path)
+            self.queue.put(('log', d['msg_trace_saved'].format(path=trace_path)))
+        except OSError as e:
+            self.queue.put(('error', d['msg_file_error'].format(e=e)))
+
+    def process_queue(self):
+        # --- FIX IS HERE: Process all messages in the queue, not just one. ---
+        while not self.queue.empty():
+            try:
+                msg_type, msg_content = self.queue.get_nowait()
+                if msg_type == 'finish':
+                    self.get_urls_button.config(state='normal'); self.download_button.config(state='normal')
+                    self.tracker = self.job = None
+                    self.pause_button.config(state='disabled', text=LANG[self.lang_var.get()]['pause_button'])
+                    self.cancel_button.config(state='disabled')
+                    self.log_buffer.close()
+                    self.progress_frame.pack_forget()
+                    self.progress_bar.stop(); self.progress_bar.config(mode='determinate'); self.progress_bar['value'] = 0
+                else:
+                    self.log_message(msg_content, msg_type)
+            except queue.Empty:
+                pass # Should not happen in a while loop, but good practice
+        # One log insert and one progress update per tick, however many messages arrived since the last one.
+        self.flush_log()
+        if self.tracker: self.show_progress(self.tracker.snapshot())
+        
+        self.root.after(100, self.process_queue)
+
+    def show_progress(self, snapshot):
+        if not snapshot.active and not snapshot.files_done: return
+        if snapshot.known and snapshot.total:
+            if str(self.progress_bar['mode']) != 'determinate':
+                self.progress_bar.stop(); self.progress_bar.config(mode='determinate')
+            self.progress_bar['value'] = snapshot.done / snapshot.total * 100
+        elif str(self.progress_bar['mode']) != 'indeterminate':
+            self.progress_bar.config(mode='indeterminate'); self.progress_bar.start()
+        filename = snapshot.active[0] if snapshot.active else ""
+        if len(snapshot.active) > 1: filename += f" +{len(snapshot.active) - 1}"
+        self.progress_label['text'] = LANG[self.lang_var.get()]['progress_label'].format(
+            filename=filename, files_done=snapshot.files_done, files=snapshot.files, done=format_bytes(snapshot.done),
+            total=format_bytes(snapshot.total) if snapshot.known else "?", rate=format_bytes(snapshot.rate or 0), eta=format_eta(snapshot.eta))
+
+if __name__ == "__main__":
+    initial_lang = 'en'
+    try:
+        default_locale, _ = locale.getdefaultlocale()
+        if default_locale and default_locale.lower().startswith(('zh_cn', 'zh_sg')): initial_lang = 'zh'
+    except Exception: pass
+    root = tk.Tk()
+    app = App(root, initial_lang)
+    # Used by benchmarks/bench_startup.py to time launch to first window.
+    if os.environ.get("SHEDU_STARTUP_PROBE"): root.after_idle(root.destroy)
     root.mainloop()
\ No newline at end of file
@@ -1,152 +1,762 @@
-import argparse
-import requests
-import os
-import re
-from bs4 import BeautifulSoup
-from colorama import init, Fore, Style
-from urllib.parse import urljoin, unquote # <-- MODIFIED IMPORT
-from tqdm import tqdm
-
-def sanitize_filename(name):
-    """Removes characters that are invalid in folder or file names."""
-    sanitized = re.sub(r'[<>:"/\\|?*]', '_', name)
-    sanitized = re.sub(r'__+', '_', sanitized)
-    sanitized = sanitized.strip(' _')
-    return sanitized
-
-def download_file(url, base_dir, folder_format, code, title, silent):
-    """
-    Downloads a file from a URL with a progress bar.
-    """
-    sub_folder = ""
-    if folder_format == 'ct':
-        sub_folder = f"{code}-{title}"
-    elif folder_format == 'c':
-        sub_folder = code
-    elif folder_format == 't':
-        sub_folder = title
-    elif folder_format == 'tc':
-        sub_folder = f"{title}-{code}"
-
-    safe_sub_folder = sanitize_filename(sub_folder)
-    download_path = os.path.join(base_dir, safe_sub_folder)
-    os.makedirs(download_path, exist_ok=True)
-
-    try:
-        with requests.get(url, stream=True, timeout=20) as r:
-            r.raise_for_status()
-            
-            filename = ""
-            if "content-disposition" in r.headers:
-                disp = r.headers['content-disposition']
-                match = re.search(r'filename="?([^"]+)"?', disp)
-                if match:
-                    # --- FIX START ---
-                    # Decode the filename from the header
-                    filename = unquote(match.group(1))
-                    # --- FIX END ---
-            
-            if not filename:
-                # --- FIX START ---
-                # Decode the filename from the URL as a fallback
-                filename = unquote(url.split('/')[-1])
-                # --- FIX END ---
-
-            file_path = os.path.join(download_path, sanitize_filename(filename))
-            total_size = int(r.headers.get('content-length', 0))
-
-            with open(file_path, 'wb') as f, tqdm(
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-                desc=f"  -> {filename}",
-                disable=silent
-            ) as bar:
-                for chunk in r.iter_content(chunk_size=8192):
-                    size = f.write(chunk)
-                    bar.update(size)
-            
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}  -> Download failed: {e}{Style.RESET_ALL}")
-    except IOError as e:
-        print(f"{Fore.RED}  -> File error: {e}{Style.RESET_ALL}")
-
-
-def fetch_and_parse(code, args):
-    """
-    Posts a code, extracts title/links, and optionally downloads them.
-    """
-    base_url = "https://mp3.bookmall.com.cn"
-    target_url = f"{base_url}/book/access.action"
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; rv:11.0) like Gecko"}
-    payload = {"code": code}
-
-    try:
-        response = requests.post(target_url, headers=headers, data=payload, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        title_element = soup.select_one('dl.EnglishBox dd h5')
-        title = title_element.get_text(strip=True) if title_element else "No title found"
-        
-        print(f"{Fore.LIGHTGREEN_EX}{code}{Style.RESET_ALL}")
-        print(f"{Fore.LIGHTGREEN_EX}{title}{Style.RESET_ALL}")
-
-        shtml_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.shtml')]
-
-        if not shtml_links:
-            print(f"{Fore.YELLOW}No .shtml links found for this code.{Style.RESET_ALL}")
-            return
-
-        for link in shtml_links:
-            full_url = urljoin(base_url, link)
-            print(f"{Fore.CYAN}{full_url}{Style.RESET_ALL}")
-            if args.download:
-                download_file(full_url, args.target, args.folder_format, code, title, args.silent)
-
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}An error occurred for code {code}: {e}{Style.RESET_ALL}")
-
-def main():
-    """Main function to parse command-line arguments and run the script."""
-    init()
-    parser = argparse.ArgumentParser(
-        description="Fetch and download files from bookmall by posting access codes.",
-        formatter_class=argparse.RawTextHelpFormatter
-    )
-    parser.add_argument("-c", "--codes", required=True, help="A comma-separated string of 8-digit codes.")
-    parser.add_argument("-d", "--download", action="store_true", help="Trigger the download of all found files.")
-    parser.add_argument("-t", "--target", default=".", help="Target directory for downloads (default: current directory).")
-    parser.add_argument(
-        "-f", "--folder-format",
-        default="n",
-        choices=['ct', 'c', 't', 'tc', 'n'],
-        help="""Set the sub-folder format for downloaded files.
-'ct': {code}-{title}
-'c': {code}
-'t': {title}
-'tc': {title}-{code}
-'n': No sub-folder (default)"""
-    )
-    
-    verbosity_group = parser.add_mutually_exclusive_group()
-    verbosity_group.add_argument("-v", "--verbose", action="store_false", dest="silent", help="Show download progress bar (default).")
-    verbosity_group.add_argument("-s", "--silent", action="store_true", help="Do not show download progress bar.")
-
-    args = parser.parse_args()
-    
-    unique_codes = sorted(list(set(code.strip() for code in args.codes.split(','))))
-
-    for i, code in enumerate(unique_codes):
-        if not (code.isdigit() and len(code) == 8):
-            print(f"{Fore.YELLOW}Warning: '{code}' is not a valid 8-digit number. Skipping.{Style.RESET_ALL}")
-            continue
-        
-        fetch_and_parse(code, args)
-        
-        if i < len(unique_codes) - 1:
-             print(f"{Fore.LIGHTRED_EX}--------{Style.RESET_ALL}")
-
-if __name__ == "__main__":
+import argparse
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from colorama import init, Fore, Style
+from shedu.events import Events
+from shedu.jobs import Cancelled, JobControl
+from shedu.folders import NO_TITLE, FOLDER_FORMATS
+from shedu.scheduler import DEFAULT_MAX_DOWNLOADS, DEFAULT_PER_HOST
+from shedu.manifest import Manifest
+from shedu.cache import open_cache
+from shedu.codes import split_codes, read_codes, unique_codes
+from shedu.records import JsonlWriter, code_record, resolved_record, STATUS_ERROR, STATUS_INVALID
+from shedu import retry
+from shedu.failures import FAILED_FILENAME, load_failures, describe_error
+from shedu import ratelimit
+from shedu import profiling
+from shedu import metrics
+from shedu.progress import parse_size, format_bytes
+from shedu.dedup import DedupStore
+from shedu.verify import verify_manifest, untracked_files, STATUS_OK, STATUS_MISSING
+from shedu.plan import SPACE_RESERVE, STATUS_NEW, STATUS_PARTIAL, STATUS_PRESENT, STATUS_STORED, STATUS_FAILED
+
+# Where download messages go; --format jsonl moves them to stderr so stdout only carries records.
+message_file = None
+# The engine (requests, lxml), tqdm and asyncio are imported where they are first needed,
+# so --help, `verify` and runs without progress bars don't wait for them to load; so are
+# the job queue and service of `serve` and `submit`.
+
+def write(text, file=None):
+    """Prints a line through tqdm.write() once tqdm is loaded, so it doesn't break up progress bars."""
+    if 'tqdm' in sys.modules:
+        from tqdm import tqdm
+        tqdm.write(text, file=file)
+    else:
+        print(text, file=file)
+
+class ConsoleEvents(Events):
+    """
+    Shows what the engine does on the console.
+
+    Each code is printed as a colored block of code, title and links, or with
+    a `writer` (--format jsonl) written as one record. Download messages and
+    progress bars go to message_file. Downloads run in parallel, so every
+    transfer keeps a line of its own for its bar until it ends.
+    """
+
+    def __init__(self, silent, writer=None):
+        self.silent = silent
+        self.writer = writer
+        self._blocks = 0
+        self._lock = threading.Lock()
+        # Progress bar -> its line (tqdm position) while the download lasts.
+        self._positions = {}
+
+    def _block(self):
+        # Printed before each block but the first, as the end of a stream isn't known in advance.
+        if self._blocks:
+            write(f"{Fore.LIGHTRED_EX}--------{Style.RESET_ALL}")
+        self._blocks += 1
+
+    def code_invalid(self, code):
+        if self.writer:
+            self.writer.write(code_record(code, STATUS_INVALID))
+            return
+        self._block()
+        write(f"{Fore.YELLOW}Warning: '{code}' is not a valid 8-digit number. Skipping.{Style.RESET_ALL}")
+
+    def code_failed(self, code, error, seconds):
+        if self.writer:
+            self.writer.write(code_record(code, STATUS_ERROR, error=describe_error(error), resolve_seconds=seconds))
+            return
+        self._block()
+        write(f"{Fore.RED}An error occurred for code {code}: {describe_error(error)}{Style.RESET_ALL}")
+
+    def code_resolved(self, code, title, links, seconds):
+        if self.writer:
+            self.writer.write(resolved_record(code, title, links, seconds))
+            return
+        self._block()
+        write(f"{Fore.LIGHTGREEN_EX}{code}{Style.RESET_ALL}")
+        write(f"{Fore.LIGHTGREEN_EX}{title or NO_TITLE}{Style.RESET_ALL}")
+        if not links:
+            write(f"{Fore.YELLOW}No .shtml links found for this code.{Style.RESET_ALL}")
+        for full_url in links:
+            write(f"{Fore.CYAN}{full_url}{Style.RESET_ALL}")
+
+    def download_started(self, url, filename, total, offset, previous=None):
+        if self.silent:
+            return None
+        from tqdm import tqdm
+        with self._lock:
+            # A retry takes over the line of the earlier attempt; a new download the lowest free one.
+            position = self._positions.pop(previous, None)
+            if position is None:
+                taken = set(self._positions.values())
+                position = next(n for n in range(len(taken) + 1) if n not in taken)
+            bar = tqdm(total=total, initial=offset, unit='iB', unit_scale=True, unit_divisor=1024,
+                       desc=f"  -> {filename}", position=position, leave=False)
+            self._positions[bar] = position
+        return bar
+
+    def download_done(self, url, path):
+        if not self.silent:
+            write(f"  -> Done: {os.path.basename(path)}", file=message_file)
+
+    def download_ended(self, url, progress):
+        if progress is not None:
+            with self._lock:
+                self._positions.pop(progress, None)
+
+    def download_skipped(self, url, path):
+        if not self.silent:
+            write(f"  -> Unchanged, skipped: {path}", file=message_file)
+
+    def download_linked(self, url, path):
+        if not self.silent:
+            write(f"  -> Linked from store: {os.path.basename(path)}", file=message_file)
+
+    def download_failed(self, code, title, url, error):
+        write(f"{Fore.RED}  -> Download failed: {describe_error(error)}{Style.RESET_ALL}", file=message_file)
+
+    def file_error(self, code, title, url, error):
+        write(f"{Fore.RED}  -> File error: {error}{Style.RESET_ALL}", file=message_file)
+
+def print_plan(plan, args, top=10):
+    """Prints the summary of a --plan run."""
+    def line(text, color=""):
+        write(f"{color}{text}{Style.RESET_ALL if color else ''}", file=message_file)
+
+    for code in plan.invalid_codes:
+        line(f"Warning: '{code}' is not a valid 8-digit number. Skipping.", Fore.YELLOW)
+    codes = len({f.code for f in plan.files})
+    line(f"Plan: {len(plan.files)} file(s) from {codes} code(s)", Fore.LIGHTGREEN_EX)
+    line(f"  To download:     {plan.count(STATUS_NEW, STATUS_PARTIAL)} file(s), {format_bytes(plan.needed)}"
+         f" ({plan.count(STATUS_PARTIAL)} partly downloaded already)")
+    line(f"  Already present: {plan.count(STATUS_PRESENT)} file(s), {format_bytes(plan.total_bytes(STATUS_PRESENT))}")
+    if args.dedup:
+        line(f"  In dedup store:  {plan.count(STATUS_STORED)} file(s), {format_bytes(plan.total_bytes(STATUS_STORED))}")
+    if plan.unknown_sizes:
+        line(f"  Unknown size:    {plan.unknown_sizes} file(s); the total is a lower bound", Fore.YELLOW)
+    for f in plan.files:
+        if f.status == STATUS_FAILED:
+            line(f"  Probe failed: {f.url}: {f.error}", Fore.RED)
+    for code, error in plan.failed_codes:
+        line(f"  Code {code} failed: {error}", Fore.RED)
+
+    largest = plan.largest(top)
+    if largest:
+        line("Largest files:")
+        for f in largest:
+            line(f"  {format_bytes(f.size):>10}  {os.path.relpath(f.path, args.target)}  ({f.content_type or 'unknown type'})")
+
+def run_plan(engine, codes, args):
+    """
+    --plan: resolves every code, probes every link and prints what downloading them takes.
+
+    With -d the files that aren't on disk yet are then queued on the engine,
+    unless the target volume lacks the space. Returns False if it does.
+    """
+    plan = engine.plan(codes)
+    print_plan(plan, args)
+
+    free, enough = plan.space_check(args.target)
+    summary = f"Free space for {os.path.abspath(args.target)}: {format_bytes(free)}, needed {format_bytes(plan.needed)} (+{format_bytes(SPACE_RESERVE)} reserve)"
+    if not enough:
+        write(f"{Fore.RED}{summary}: not enough{', nothing was downloaded' if args.download else ''}.{Style.RESET_ALL}", file=message_file)
+        return False
+    write(f"{Fore.LIGHTGREEN_EX}{summary}: OK{Style.RESET_ALL}", file=message_file)
+
+    if args.download:
+        engine.download_plan(plan)
+    return True
+
+def positive_int(value):
+    """argparse type for options that need a count of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def non_negative_int(value):
+    """argparse type for options that may be 0."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value}")
+    return number
+
+def non_negative_float(value):
+    """argparse type for rates, where 0 means no limit."""
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value}")
+    return number
+
+def listen_address(value):
+    """argparse type for --metrics-listen, --listen and --connect."""
+    try:
+        return metrics.parse_listen(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected [HOST:]PORT, got {value}")
+
+def report_retry(url, attempt, delay, error):
+    """RetryPolicy callback: says which request failed and when it is tried again."""
+    write(f"{Fore.YELLOW}  -> Attempt {attempt} for {url} failed ({error}); retrying in {delay:.1f}s{Style.RESET_ALL}", file=message_file)
+
+def report_dedup(dedup):
+    """Prints what the --dedup store saved in this run."""
+    if dedup.linked or dedup.merged:
+        write(f"{Fore.LIGHTGREEN_EX}Dedup: {dedup.linked} file(s) linked instead of downloaded ({format_bytes(dedup.bytes_saved)}), "
+                   f"{dedup.merged} duplicate download(s) merged ({format_bytes(dedup.disk_saved)}).{Style.RESET_ALL}", file=message_file)
+
+def report_failures(failures, path):
+    """Saves the permanent failures of a FailureLog to `path` (for --rerun-failed) and prints how many there were."""
+    failed_codes, failed_files = failures.counts()
+    if failures.save(path):
+        write(f"{Fore.RED}{failed_codes} code(s) and {failed_files} file(s) failed after all retries; "
+                   f"they are listed in {path}.\nRe-run just those with --rerun-failed.{Style.RESET_ALL}", file=message_file)
+
+def report_profile(recorder, path):
+    """--profile: prints the per-phase timings and saves the trace to `path`."""
+    write(f"{Fore.LIGHTGREEN_EX}Timings per phase:{Style.RESET_ALL}", file=sys.stderr)
+    for line in recorder.format_summary():
+        write(line, file=sys.stderr)
+    try:
+        recorder.save_trace(path)
+    except OSError as e:
+        write(f"{Fore.RED}Could not write the trace to {path}: {e}{Style.RESET_ALL}", file=sys.stderr)
+        return
+    write(f"Trace written to {path} (open it in chrome://tracing or https://ui.perfetto.dev).", file=sys.stderr)
+
+def export_metrics(args, parser):
+    """Starts --metrics-listen and --metrics-file; returns the TextfileWriter to close at the end, if any."""
+    if not (args.metrics_listen or args.metrics_file):
+        return None
+    exported = metrics.enable()
+    try:
+        if args.metrics_listen:
+            metrics.serve(exported, *args.metrics_listen)
+        return metrics.TextfileWriter(exported, args.metrics_file) if args.metrics_file else None
+    except OSError as e:
+        parser.error(f"cannot export metrics: {e}")
+
+def run_batch(engine, codes, args, failed_files, failed_path):
+    """Runs the batch on the chosen engine and reports the dedup savings and failures; returns False if --plan found too little space."""
+    if args.engine == 'async' and not args.plan:
+        import asyncio
+        try:
+            asyncio.run(engine.run_async(codes, args.download, failed_files))
+        except KeyboardInterrupt:
+            # asyncio.run() has cancelled the run; its .part files are resumed next time.
+            write(f"{Fore.YELLOW}Interrupted; unfinished downloads resume on the next run.{Style.RESET_ALL}", file=message_file)
+            engine.control.cancel()
+        finally:
+            if engine.dedup:
+                report_dedup(engine.dedup)
+            report_failures(engine.failures, failed_path)
+        return True
+
+    enough_space = True
+    try:
+        if args.plan:
+            enough_space = run_plan(engine, codes, args)
+            # The plan has resolved every code and queued what is to be downloaded.
+            codes = ()
+        engine.run(codes, args.download, failed_files)
+    except Cancelled:
+        # Interrupted while --plan was resolving; run() returns by itself.
+        pass
+    finally:
+        try:
+            # After Ctrl+C this waits for the downloads in progress to stop.
+            engine.finish()
+        finally:
+            if engine.dedup:
+                report_dedup(engine.dedup)
+            report_failures(engine.failures, failed_path)
+    return enough_space
+
+def verify_main(argv):
+    """The `verify` command: checks a download tree against the manifest written while downloading it."""
+    init()
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} verify",
+        description="Check downloaded files against the sizes and SHA-256 checksums recorded in the target directory's manifest."
+    )
+    parser.add_argument("-t", "--target", default=".", help="Download directory to check (default: current directory).")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="Number of files hashed at the same time (default: one per CPU core)."
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Delete damaged files and drop them from the manifest, so the next -d or --sync run downloads them again."
+    )
+    parser.add_argument("-s", "--silent", action="store_true", help="Do not show a progress bar.")
+    args = parser.parse_args(argv)
+
+    manifest = Manifest(args.target)
+    entries = manifest.entries()
+    if not entries:
+        print(f"{Fore.YELLOW}No downloads are recorded in {os.path.abspath(args.target)}.{Style.RESET_ALL}")
+        sys.exit(1)
+
+    total = sum(entry['size'] for entry in entries.values())
+    from tqdm import tqdm
+    with tqdm(total=total, unit='iB', unit_scale=True, unit_divisor=1024, desc="Verifying", disable=args.silent) as bar:
+        results = verify_manifest(manifest, args.jobs, bar.update)
+
+    bad = [result for result in results if result.status != STATUS_OK]
+    for result in bad:
+        write(f"{Fore.RED}{result.status}: {os.path.relpath(result.path, args.target)}: {result.detail}{Style.RESET_ALL}")
+    untracked = untracked_files(manifest)
+    color = Fore.RED if bad else Fore.LIGHTGREEN_EX
+    print(f"{color}{len(results) - len(bad)} file(s) OK, {len(bad)} damaged or missing, "
+          f"{len(untracked)} not in the manifest.{Style.RESET_ALL}")
+
+    if args.repair and bad:
+        for result in bad:
+            if result.status != STATUS_MISSING:
+                os.remove(result.path)
+            manifest.forget(result.url)
+        manifest.save()
+        print(f"Removed {len(bad)} damaged or missing file(s) from the manifest; the next -d or --sync run downloads them again.")
+    sys.exit(1 if bad else 0)
+
+def log(message):
+    """Prints one timestamped line of the `serve` log."""
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+def serve_main(argv):
+    """The `serve` command: downloads the codes submitted to the job queue until it is stopped."""
+    from shedu.jobqueue import JobQueue, QUEUE_FILENAME, STATUS_QUEUED, STATUS_RUNNING
+    from shedu.service import JobTracker, run_service, serve_socket
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} serve",
+        description="""Run as a service: download every code submitted to the target directory's
+job queue (with `submit`, or over --listen) as it comes in, until stopped
+with Ctrl+C. Connections, the lookup cache and the manifest stay warm
+between jobs; unchanged files are skipped as with --sync. Jobs cut off by a
+stop or crash run again on the next start, resuming their .part files.""",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("-t", "--target", default=".", help="Target directory for downloads (default: current directory).")
+    parser.add_argument("-f", "--folder-format", default="ct", choices=FOLDER_FORMATS,
+                        help="Sub-folder format, as for downloads (default: 'ct', {code}-{title}).")
+    parser.add_argument("-j", "--jobs", type=positive_int, default=1,
+                        help="Number of jobs worked on at the same time (default: 1); the next is claimed once one is over.")
+    parser.add_argument(
+        "--download-jobs",
+        type=positive_int,
+        default=DEFAULT_MAX_DOWNLOADS,
+        help=f"Maximum number of files downloaded at the same time (default: {DEFAULT_MAX_DOWNLOADS})."
+    )
+    parser.add_argument(
+        "--per-host",
+        type=positive_int,
+        default=DEFAULT_PER_HOST,
+        help=f"Maximum number of simultaneous downloads from one host (default: {DEFAULT_PER_HOST})."
+    )
+    parser.add_argument("--retries", type=non_negative_int, default=retry.DEFAULT_ATTEMPTS - 1,
+                        help=f"How often a failed request is retried (default: {retry.DEFAULT_ATTEMPTS - 1}).")
+    parser.add_argument("--max-rate", metavar="N", type=non_negative_float, default=0,
+                        help="Send at most N requests per second to a host (default: 0, no limit).")
+    parser.add_argument("--max-speed", metavar="SIZE", type=parse_size, default=0,
+                        help="Download at most SIZE bytes per second from a host, e.g. 500K (default: 0, no limit).")
+    parser.add_argument("--dedup", action="store_true", help="Hardlink content shared by several codes instead of downloading it again.")
+    parser.add_argument("--queue", metavar="FILE", help=f"The job queue database (default: {QUEUE_FILENAME} in the target directory).")
+    parser.add_argument(
+        "--listen",
+        metavar="[HOST:]PORT",
+        type=listen_address,
+        help=f"""Also accept jobs on a local socket (HOST defaults to {metrics.DEFAULT_HOST}), for
+`submit --connect` or any client sending one JSON object per line.
+Anyone who can connect can submit jobs."""
+    )
+    parser.add_argument("--metrics-listen", metavar="[HOST:]PORT", type=listen_address,
+                        help="Serve Prometheus metrics at http://HOST:PORT/metrics.")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help=f"Write the metrics to FILE every {metrics.TEXTFILE_INTERVAL:.0f}s, for node_exporter.")
+    args = parser.parse_args(argv)
+
+    queue_path = args.queue or os.path.join(args.target, QUEUE_FILENAME)
+    try:
+        queue = JobQueue(queue_path)
+    except (OSError, sqlite3.Error) as e:
+        parser.error(f"cannot open the job queue {queue_path}: {e}")
+    if args.listen:
+        try:
+            serve_socket(queue, *args.listen)
+        except OSError as e:
+            parser.error(f"cannot listen on {args.listen[0]}:{args.listen[1]}: {e}")
+
+    retry.configure(attempts=args.retries + 1,
+                    on_retry=lambda url, attempt, delay, error: log(f"attempt {attempt} for {url} failed ({error}); retrying in {delay:.1f}s"))
+    ratelimit.configure(requests_per_second=args.max_rate, bytes_per_second=args.max_speed)
+    metrics_file = export_metrics(args, parser)
+
+    from shedu.engine import Engine
+    control = JobControl()
+    tracker = JobTracker(queue, control, log, window=args.jobs)
+    # Stopped downloads keep their .part files; the next start resumes them.
+    engine = Engine(
+        args.target, args.folder_format, tracker, resolve_jobs=args.jobs, download_jobs=args.download_jobs,
+        per_host=args.per_host, cache=open_cache(), manifest=Manifest(args.target, skip_unchanged=True),
+        dedup=DedupStore(args.target) if args.dedup else None, failures=tracker.failures, control=control, keep_partial=True,
+    )
+
+    def stop(signum, frame):
+        if control.cancelled:
+            return
+        log("stopping; downloads in progress resume on the next start")
+        control.cancel()
+        # A second Ctrl+C ends the process at once.
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    listening = f", accepting jobs on {args.listen[0]}:{args.listen[1]}" if args.listen else ""
+    log(f"serving {os.path.abspath(args.target)} from {queue_path}{listening}")
+    try:
+        run_service(engine, queue, tracker, control)
+    finally:
+        if metrics_file:
+            metrics_file.close()
+        counts = queue.counts()
+        queue.close()
+    log(f"stopped; {counts[STATUS_QUEUED] + counts[STATUS_RUNNING]} job(s) left for the next start")
+
+def submit_main(argv):
+    """The `submit` command: queues codes for `serve` and shows the state of the queue."""
+    from shedu.jobqueue import JobQueue, QUEUE_FILENAME, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+    from shedu.service import send_request
+    init()
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} submit",
+        description="Queue codes for `serve` to download, or show the state of its job queue. "
+                    "The service need not be running: it works through the queue when it starts."
+    )
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("-c", "--codes", help="A comma-separated string of 8-digit codes.")
+    input_group.add_argument("--codes-file", metavar="FILE", type=argparse.FileType('r', encoding='utf-8-sig'),
+                             help="Read codes from FILE ('-' for stdin), separated by commas, spaces or newlines.")
+    input_group.add_argument("--status", action="store_true", help="Only show how many jobs are queued, running, done and failed.")
+    parser.add_argument("-t", "--target", default=".", help="Target directory of the service (default: current directory).")
+    parser.add_argument("--queue", metavar="FILE", help=f"The job queue database (default: {QUEUE_FILENAME} in the target directory).")
+    parser.add_argument("--connect", metavar="[HOST:]PORT", type=listen_address,
+                        help="Submit to a service running with --listen instead of writing to the queue database.")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        codes = None
+    elif args.codes_file:
+        codes = list(unique_codes(read_codes(args.codes_file)))
+    else:
+        codes = list(unique_codes(split_codes(args.codes)))
+
+    failed_jobs = []
+    if args.connect:
+        try:
+            result = send_request(*args.connect, {'submit': codes}) if codes is not None else {}
+            counts = send_request(*args.connect, {'status': True}).get('counts')
+        except (OSError, ValueError) as e:
+            print(f"{Fore.RED}Cannot reach the service at {args.connect[0]}:{args.connect[1]}: {e}{Style.RESET_ALL}")
+            sys.exit(1)
+        error = result.get('error') or (None if counts else "no counts in the reply")
+        if error:
+            print(f"{Fore.RED}The service refused the request: {error}{Style.RESET_ALL}")
+            sys.exit(1)
+    else:
+        queue_path = args.queue or os.path.join(args.target, QUEUE_FILENAME)
+        try:
+            queue = JobQueue(queue_path)
+            result = queue.submit(codes) if codes is not None else {}
+            counts = queue.counts()
+            if args.status:
+                failed_jobs = queue.jobs(STATUS_FAILED, limit=10)
+            queue.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"{Fore.RED}Cannot use the job queue {queue_path}: {e}{Style.RESET_ALL}")
+            sys.exit(1)
+
+    for code in result.get('invalid', ()):
+        print(f"{Fore.YELLOW}Warning: '{code}' is not a valid 8-digit number. Skipping.{Style.RESET_ALL}")
+    if codes is not None:
+        print(f"{Fore.LIGHTGREEN_EX}Queued {result['queued']} code(s){Style.RESET_ALL}; "
+              f"{result['pending']} already queued or running.")
+    print(f"Queue: {counts[STATUS_QUEUED]} queued, {counts[STATUS_RUNNING]} running, "
+          f"{counts[STATUS_DONE]} done, {counts[STATUS_FAILED]} failed.")
+    for job in failed_jobs:
+        finished = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job.finished))
+        reason = job.error or f"{job.failed_files} of {job.files} file(s) failed"
+        print(f"{Fore.RED}  job {job.id}: {job.code} failed {finished}: {reason}{Style.RESET_ALL}")
+
+def main():
+    """Main function to parse command-line arguments and run the script."""
+    global message_file
+    # `verify`, `serve` and `submit` are commands of their own; everything else is the download tool's options.
+    commands = {'verify': verify_main, 'serve': serve_main, 'submit': submit_main}
+    if sys.argv[1:2] and sys.argv[1] in commands:
+        commands[sys.argv[1]](sys.argv[2:])
+        return
+    init()
+    parser = argparse.ArgumentParser(
+        description="Fetch and download files from bookmall by posting access codes.",
+        epilog="""To check downloaded files against their recorded checksums, run: %(prog)s verify -h
+To run as a service working through a job queue: %(prog)s serve -h
+and to queue codes for it: %(prog)s submit -h""",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("-c", "--codes", help="A comma-separated string of 8-digit codes.")
+    input_group.add_argument(
+        "--rerun-failed",
+        action="store_true",
+        help="Retry only what failed in the last run in the target directory:\nthe codes and files listed in --failed-file."
+    )
+    input_group.add_argument(
+        "--codes-file",
+        metavar="FILE",
+        type=argparse.FileType('r', encoding='utf-8-sig'),
+        help="Read codes from FILE ('-' for stdin), separated by commas, spaces or newlines.\nCodes are processed in the order they are read, while the rest is still coming in."
+    )
+    parser.add_argument("-d", "--download", action="store_true", help="Trigger the download of all found files.")
+    parser.add_argument("-t", "--target", default=".", help="Target directory for downloads (default: current directory).")
+    parser.add_argument(
+        "-f", "--folder-format",
+        default="n",
+        choices=FOLDER_FORMATS,
+        help="""Set the sub-folder format for downloaded files.
+'ct': {code}-{title}
+'c': {code}
+'t': {title}
+'tc': {title}-{code}
+'n': No sub-folder (default)"""
+    )
+    
+    parser.add_argument(
+        "-j", "--jobs",
+        type=positive_int,
+        default=1,
+        help="Number of codes to resolve concurrently (default: 1).\nOutput is still printed per code, in order (-c codes are sorted)."
+    )
+    parser.add_argument(
+        "--download-jobs",
+        type=positive_int,
+        default=DEFAULT_MAX_DOWNLOADS,
+        help=f"Maximum number of files downloaded at the same time (default: {DEFAULT_MAX_DOWNLOADS})."
+    )
+    parser.add_argument(
+        "--per-host",
+        type=positive_int,
+        default=DEFAULT_PER_HOST,
+        help=f"Maximum number of simultaneous downloads from one host (default: {DEFAULT_PER_HOST})."
+    )
+
+    parser.add_argument(
+        "--engine",
+        default="sync",
+        choices=['sync', 'async'],
+        help="""Networking backend.
+'sync': requests with worker threads (default)
+'async': asyncio/aiohttp on a single thread; suits very large --jobs values"""
+    )
+
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Incremental sync: skip files that are unchanged since the last run.\nUses a manifest kept in the target directory (implies -d)."
+    )
+
+    parser.add_argument(
+        "--retries",
+        type=non_negative_int,
+        default=retry.DEFAULT_ATTEMPTS - 1,
+        help=f"""How often a failed request is retried (default: {retry.DEFAULT_ATTEMPTS - 1}).
+Connection errors, timeouts, 429 and 5xx responses are retried with
+exponential backoff and jitter, honoring Retry-After; after
+{retry.BREAKER_THRESHOLD} failures in a row a host gets a {retry.BREAKER_COOLDOWN:.0f}s break."""
+    )
+    parser.add_argument(
+        "--failed-file",
+        metavar="FILE",
+        help=f"Where codes and files that still failed are listed at the end of a run\n(default: {FAILED_FILENAME} in the target directory)."
+    )
+
+    parser.add_argument(
+        "--max-rate",
+        metavar="N",
+        type=non_negative_float,
+        default=0,
+        help="Send at most N requests per second to a host (default: 0, no limit)."
+    )
+    parser.add_argument(
+        "--max-speed",
+        metavar="SIZE",
+        type=parse_size,
+        default=0,
+        help="Download at most SIZE bytes per second from a host, e.g. 500K or 2M\n(default: 0, no limit)."
+    )
+    parser.add_argument(
+        "--no-adapt",
+        action="store_true",
+        help="""Keep the request rate fixed. By default it is halved when the server
+answers 429/5xx, times out or slows down markedly, and raised again
+step by step (up to --max-rate, if given) while it keeps up."""
+    )
+
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="""Resolve every code and probe every file (HEAD) first, then print the
+bytes to download, the largest files, the files already present and the
+free space. With -d only the missing files are downloaded, and only if
+they fit on the target volume; otherwise the exit status is 1.
+The plan always runs on threads, whatever --engine says."""
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="""Keep one copy of files shared by several codes: a download whose
+content (SHA-256) is in the target directory's store already is replaced
+by a hardlink to it, and a URL stored before is linked without being
+downloaded again while its ETag and size are unchanged (implies -d)."""
+    )
+
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--refresh", action="store_true", help="Ignore cached code lookups and fetch them again (the cache is updated).")
+    cache_group.add_argument("--no-cache", action="store_true", help="Neither read nor write the code lookup cache.")
+
+    parser.add_argument(
+        "--format",
+        default="text",
+        choices=['text', 'jsonl'],
+        help="""Output format.
+'text': colored blocks of title and links (default)
+'jsonl': one JSON object per code, written as soon as it resolves, with
+         code, status, title, links, error and timings; messages about
+         downloads go to stderr"""
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="""Time every phase of every lookup and download (POST, parsing, time to
+first byte, transfer, disk writes), print a table per phase to stderr at
+the end and save a trace for chrome://tracing or Perfetto
+(--trace-file)."""
+    )
+    parser.add_argument(
+        "--trace-file",
+        metavar="FILE",
+        help=f"Where --profile saves its trace (default: {profiling.TRACE_FILENAME} in the target directory;\nimplies --profile)."
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE",
+        help="""Run the batch under cProfile, worker threads included, save the
+statistics to FILE (for pstats or snakeviz) and print the slowest
+functions to stderr."""
+    )
+
+    parser.add_argument(
+        "--metrics-listen",
+        metavar="[HOST:]PORT",
+        type=listen_address,
+        help=f"""Serve Prometheus metrics at http://HOST:PORT/metrics while the run lasts
+(HOST defaults to {metrics.DEFAULT_HOST}; IPv6 in brackets, e.g. [::1]:9100):
+codes resolved, bytes downloaded, downloads in flight, retries and errors
+by reason, lookup and download latency histograms."""
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help=f"""Write the same metrics to FILE every {metrics.TEXTFILE_INTERVAL:.0f}s and at the end, for
+node_exporter's textfile collector (FILE must end in .prom there)."""
+    )
+
+    verbosity_group = parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument("-v", "--verbose", action="store_false", dest="silent", help="Show download progress bar (default).")
+    verbosity_group.add_argument("-s", "--silent", action="store_true", help="Do not show download progress bar.")
+
+    args = parser.parse_args()
+    if args.sync or args.dedup:
+        args.download = True
+    if args.trace_file:
+        args.profile = True
+    failed_path = args.failed_file or os.path.join(args.target, FAILED_FILENAME)
+
+    failed_files = []
+    if args.rerun_failed:
+        if not os.path.exists(failed_path):
+            parser.error(f"--rerun-failed: there is no {failed_path}")
+        failed_codes, failed_files = load_failures(failed_path)
+        codes = sorted(set(failed_codes))
+        # Failed files come from a run with -d; download them again in any case.
+        if failed_files:
+            args.download = True
+    elif args.codes_file:
+        codes = unique_codes(read_codes(args.codes_file))
+    else:
+        codes = sorted(set(split_codes(args.codes)))
+
+    if args.format == 'jsonl':
+        message_file = sys.stderr
+    retry.configure(attempts=args.retries + 1, on_retry=report_retry)
+    ratelimit.configure(requests_per_second=args.max_rate, bytes_per_second=args.max_speed, adaptive=not args.no_adapt)
+
+    from shedu.engine import Engine
+    control = JobControl()
+    # Every download is recorded (for `verify`); only --sync skips unchanged files.
+    # Interrupted downloads keep their .part files; the next run resumes them.
+    engine = Engine(
+        args.target, args.folder_format, ConsoleEvents(args.silent, JsonlWriter() if args.format == 'jsonl' else None),
+        resolve_jobs=args.jobs, download_jobs=args.download_jobs, per_host=args.per_host,
+        cache=open_cache(not args.no_cache), refresh=args.refresh,
+        manifest=Manifest(args.target, skip_unchanged=args.sync) if args.download else None,
+        dedup=DedupStore(args.target) if args.dedup else None, control=control, keep_partial=True,
+    )
+
+    stopped_by = None
+
+    def stop(signum, frame):
+        nonlocal stopped_by
+        if control.cancelled:
+            return
+        stopped_by = signum
+        write(f"{Fore.YELLOW}Interrupted; stopping the downloads in progress, they resume on the next run.{Style.RESET_ALL}", file=message_file)
+        engine.cancel()
+        # A second Ctrl+C ends the process at once.
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # asyncio.run() handles Ctrl+C itself on the async engine.
+    if args.engine != 'async' or args.plan:
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    metrics_file = export_metrics(args, parser)
+    recorder = profiling.enable() if args.profile else None
+    try:
+        if args.cprofile:
+            enough_space = profiling.profile_call(lambda: run_batch(engine, codes, args, failed_files, failed_path), args.cprofile)
+        else:
+            enough_space = run_batch(engine, codes, args, failed_files, failed_path)
+    finally:
+        if recorder:
+            report_profile(recorder, args.trace_file or os.path.join(args.target, profiling.TRACE_FILENAME))
+        if metrics_file:
+            metrics_file.close()
+    if control.cancelled:
+        sys.exit(128 + (stopped_by or signal.SIGINT))
+    if not enough_space:
+        sys.exit(1)
+
+if __name__ == "__main__":
     main()
\ No newline at end of file